@@ -0,0 +1,153 @@
+# bench_resilient_decode.py
+"""
+Accuracy/latency benchmark for resilient_decode vs decode_watermark.
+
+Every label is put through a set of geometric distortions (crop, quarter
+turn, upscale, upscale + small rotation, downscale) and decoded both ways.
+The report lists the decode rate per distortion and p50/p95 latency for
+aligned and distorted scans. Labels come from a directory of watermarked
+PNGs (those that decode as-is) or are generated.
+
+    python bench_resilient_decode.py --images watermarked_images --limit 10 --workers 4
+    python bench_resilient_decode.py --synthetic 8 --width 1600 --height 1000
+"""
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from watermark import decode_watermark, embed_watermark, prepare_data, resilient_decode
+
+# ------------------------
+# Distortions
+# ------------------------
+def _crop(img: np.ndarray, top: int, left: int, bottom: int, right: int) -> np.ndarray:
+    h, w = img.shape[:2]
+    return img[top:h - bottom, left:w - right]
+
+def _warp(img: np.ndarray, scale: float, angle: float = 0.0) -> np.ndarray:
+    """Camera-style resample: scale and rotate about the centre, bilinear."""
+    h, w = img.shape[:2]
+    out_w, out_h = int(round(w * scale)), int(round(h * scale))
+    m = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, scale)
+    m[0, 2] += (out_w - w) / 2.0
+    m[1, 2] += (out_h - h) / 2.0
+    return cv2.warpAffine(img, m, (out_w, out_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+DISTORTIONS: List[Tuple[str, Callable[[np.ndarray], np.ndarray]]] = [
+    ("aligned", lambda img: img),
+    ("crop 3/5/2/4 px", lambda img: _crop(img, 3, 5, 2, 4)),
+    ("crop 10/17 px", lambda img: _crop(img, 10, 17, 0, 0)),
+    ("rotate 90", lambda img: np.ascontiguousarray(np.rot90(img))),
+    ("upscale 1.5x", lambda img: _warp(img, 1.5)),
+    ("upscale 2x + crop", lambda img: _crop(_warp(img, 2.0), 4, 7, 3, 3)),
+    ("upscale 1.5x + 1 deg", lambda img: _warp(img, 1.5, 1.0)),
+    ("downscale 0.9x", lambda img: _warp(img, 0.9)),
+]
+
+# ------------------------
+# Inputs
+# ------------------------
+def _load_labels(directory: str, limit: int) -> List[Tuple[str, np.ndarray, str]]:
+    labels = []
+    for name in sorted(os.listdir(directory)):
+        img = cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        truth = decode_watermark(img)
+        if truth is None:
+            continue
+        labels.append((name, img, truth))
+        if len(labels) >= limit:
+            break
+    return labels
+
+def _synthetic_labels(count: int, width: int, height: int, seed: int) -> List[Tuple[str, np.ndarray, str]]:
+    """Blurred colour noise with some text on top, watermarked with a random hash."""
+    rng = np.random.default_rng(seed)
+    labels = []
+    for i in range(count):
+        img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+        img = cv2.GaussianBlur(cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC), (0, 0), 3)
+        for j in range(6):
+            org = (int(rng.integers(0, width // 2)), int(rng.integers(40, height)))
+            cv2.putText(img, f"BATCH-{i:03d}-{j}", org, cv2.FONT_HERSHEY_SIMPLEX, 2.0, (255, 255, 255), 4)
+        data_hash = hashlib.sha256(f"label-{seed}-{i}".encode()).hexdigest()
+        labels.append((f"synthetic-{i}", embed_watermark(img, prepare_data(data_hash)), "0x" + data_hash))
+    return labels
+
+# ------------------------
+# Harness
+# ------------------------
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+def _pct(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) * 1000 if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="watermarked_images", help="directory of watermarked PNGs")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--synthetic", type=int, default=0, help="generate N labels instead of reading --images")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="process pool size for resilient_decode (0 = run in this process)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        labels = _synthetic_labels(args.synthetic, args.width, args.height, args.seed)
+    else:
+        labels = _load_labels(args.images, args.limit)
+    if not labels:
+        raise SystemExit(f"No decodable watermarked images in {args.images}; try --synthetic 8.")
+
+    executor: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(args.workers) if args.workers else None
+    if executor is not None:
+        # Spawn the workers before timing anything.
+        list(executor.map(abs, range(args.workers)))
+    print(f"{len(labels)} labels, {len(DISTORTIONS)} distortions, "
+          f"{args.workers or 'no'} worker processes\n")
+
+    hits: Dict[str, List[int]] = {name: [0, 0] for name, _ in DISTORTIONS}
+    times = {"plain": {"aligned": [], "distorted": []}, "resilient": {"aligned": [], "distorted": []}}
+    try:
+        for label, img, truth in labels:
+            for name, distort in DISTORTIONS:
+                scan = distort(img)
+                kind = "aligned" if name == "aligned" else "distorted"
+                plain, t_plain = _timed(decode_watermark, scan)
+                result, t_res = _timed(resilient_decode, scan, executor)
+                hits[name][0] += plain == truth
+                hits[name][1] += result["hash"] == truth
+                times["plain"][kind].append(t_plain)
+                times["resilient"][kind].append(t_res)
+                if result["hash"] not in (None, truth):
+                    print(f"❌ {label} / {name}: decoded a different hash {result['hash']}")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    n = len(labels)
+    print(f"{'distortion':<22} {'plain':>8} {'resilient':>10}")
+    for name, (plain_ok, res_ok) in hits.items():
+        print(f"{name:<22} {plain_ok:>4}/{n:<3} {res_ok:>6}/{n:<3}")
+    total = n * len(DISTORTIONS)
+    print(f"{'all':<22} {sum(h[0] for h in hits.values()):>4}/{total:<3} {sum(h[1] for h in hits.values()):>6}/{total:<3}\n")
+
+    for kind in ("aligned", "distorted"):
+        p, r = times["plain"][kind], times["resilient"][kind]
+        print(f"{kind:<10} p50 plain {_pct(p, 50):8.1f} ms   resilient {_pct(r, 50):8.1f} ms   "
+              f"p95 plain {_pct(p, 95):8.1f} ms   resilient {_pct(r, 95):8.1f} ms")
+
+if __name__ == "__main__":
+    main()
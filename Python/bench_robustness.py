@@ -0,0 +1,268 @@
+# bench_robustness.py
+"""
+Robustness + throughput benchmark for the watermark pipeline.
+
+Each synthetic label is embedded, put through a set of distortions (JPEG
+quality sweep, resize, crop, blur, noise, rotation) and decoded, plainly or
+with --resilient through the geometry search, with the labels spread over a
+process pool. The JSON report holds throughput (labels/s), embed/decode
+latency percentiles, peak worker memory and, per distortion, the raw payload
+bit-error rate and the hash recovery rate.
+
+With --baseline the report is compared against a stored one and the script
+exits 1 if speed or accuracy regressed beyond the tolerances; --save writes
+the report so it can become the next baseline.
+
+    python bench_robustness.py --workers 1 --baseline bench_robustness_baseline.json
+    python bench_robustness.py --workers 4 --labels 64 --save new_baseline.json
+
+bench_robustness_baseline.json was recorded with the defaults and
+--workers 1 (a single-core machine); timings only compare on like hardware.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from watermark import (
+    DEFAULT_PROFILE, PROFILES, decode_watermark_soft, embed_watermark, get_profile,
+    payload_bit_length, prepare_data, qim_soft_votes, resilient_decode, target_band,
+)
+
+try:
+    import resource
+    _RESOURCE_OK = True
+except ImportError:  # Windows
+    _RESOURCE_OK = False
+
+# ------------------------
+# Distortions
+# ------------------------
+def _jpeg(img: np.ndarray, quality: int) -> np.ndarray:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def _resize(img: np.ndarray, scale: float) -> np.ndarray:
+    """Down/upscale and back to the original size, like a re-exported image."""
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+
+def _crop(img: np.ndarray, top: int, left: int) -> np.ndarray:
+    return img[top:, left:]
+
+def _noise(img: np.ndarray, sigma: float) -> np.ndarray:
+    rng = np.random.default_rng(int(img[0, 0, 0]))
+    return np.clip(img + rng.normal(0, sigma, img.shape), 0, 255).astype(np.uint8)
+
+def _rotate(img: np.ndarray, angle: float) -> np.ndarray:
+    h, w = img.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, 1.0)
+    return cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+DISTORTIONS: List[Tuple[str, Callable[[np.ndarray], np.ndarray]]] = [
+    ("none", lambda img: img),
+    ("jpeg95", lambda img: _jpeg(img, 95)),
+    ("jpeg90", lambda img: _jpeg(img, 90)),
+    ("jpeg75", lambda img: _jpeg(img, 75)),
+    ("jpeg60", lambda img: _jpeg(img, 60)),
+    ("jpeg50", lambda img: _jpeg(img, 50)),
+    ("resize0.75", lambda img: _resize(img, 0.75)),
+    ("resize0.5", lambda img: _resize(img, 0.5)),
+    ("crop8x8", lambda img: _crop(img, 8, 8)),
+    ("crop3x5", lambda img: _crop(img, 3, 5)),
+    ("blur0.6", lambda img: cv2.GaussianBlur(img, (0, 0), 0.6)),
+    ("blur1.0", lambda img: cv2.GaussianBlur(img, (0, 0), 1.0)),
+    ("noise2", lambda img: _noise(img, 2.0)),
+    ("noise5", lambda img: _noise(img, 5.0)),
+    ("rotate0.5", lambda img: _rotate(img, 0.5)),
+]
+
+# ------------------------
+# Worker (one label per task)
+# ------------------------
+def _synthetic_image(index: int, width: int, height: int, seed: int) -> np.ndarray:
+    """Blurred colour noise with some text on top; the same (index, seed) gives the same image."""
+    rng = np.random.default_rng([seed, index])
+    img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC), (0, 0), 3)
+    for j in range(6):
+        org = (int(rng.integers(0, width // 2)), int(rng.integers(40, height)))
+        cv2.putText(img, f"BATCH-{index:03d}-{j}", org, cv2.FONT_HERSHEY_SIMPLEX, 2.0, (255, 255, 255), 4)
+    return img
+
+def _bit_errors(img: np.ndarray, payload: np.ndarray, profile: str) -> int:
+    """Payload bits a soft majority over the (unaligned) target band gets wrong, before RS."""
+    luma = cv2.cvtColor(img, cv2.COLOR_BGR2YUV)[..., 0]
+    band = target_band(luma, profile).ravel()
+    if band.size < payload.size:
+        return int(payload.size)
+    votes = qim_soft_votes(band, payload.size, get_profile(profile)["q"])
+    return int(np.count_nonzero((votes.sum(axis=0) > 0) != payload.astype(bool)))
+
+def _peak_rss_mb() -> Optional[float]:
+    if not _RESOURCE_OK:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_label(index: int, width: int, height: int, seed: int, profile: str,
+              resilient: bool = False) -> Dict[str, Any]:
+    img = _synthetic_image(index, width, height, seed)
+    data_hash = "0x" + hashlib.sha256(f"label-{seed}-{index}".encode()).hexdigest()
+    payload = prepare_data(data_hash, profile)
+
+    t0 = time.perf_counter()
+    marked = embed_watermark(img, payload, profile)
+    embed_s = time.perf_counter() - t0
+
+    decode = resilient_decode if resilient else decode_watermark_soft
+    results = {}
+    for name, distort in DISTORTIONS:
+        scan = distort(marked)
+        t0 = time.perf_counter()
+        decoded = decode(scan)
+        decode_s = time.perf_counter() - t0
+        results[name] = {
+            "recovered": decoded["hash"] == data_hash,
+            "wrongHash": decoded["hash"] not in (None, data_hash),
+            "bitErrors": _bit_errors(scan, payload, profile),
+            "decodeS": decode_s,
+        }
+    return {"embedS": embed_s, "distortions": results, "peakRssMb": _peak_rss_mb()}
+
+# ------------------------
+# Report
+# ------------------------
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    ms = np.asarray(values) * 1000
+    return {f"p{q}": round(float(np.percentile(ms, q)), 2) for q in (50, 95, 99)}
+
+def build_report(runs: List[Dict[str, Any]], wall_s: float, args) -> Dict[str, Any]:
+    bits = payload_bit_length(args.profile)
+    per_distortion = {}
+    for name, _ in DISTORTIONS:
+        rows = [r["distortions"][name] for r in runs]
+        per_distortion[name] = {
+            "recoveryRate": round(sum(r["recovered"] for r in rows) / len(rows), 4),
+            "bitErrorRate": round(sum(r["bitErrors"] for r in rows) / (len(rows) * bits), 5),
+            "wrongHashes": sum(r["wrongHash"] for r in rows),
+            "decodeMs": _percentiles([r["decodeS"] for r in rows]),
+        }
+    rss = [r["peakRssMb"] for r in runs if r["peakRssMb"] is not None]
+    return {
+        "config": {
+            "labels": len(runs), "width": args.width, "height": args.height, "seed": args.seed,
+            "profile": args.profile, "resilient": args.resilient, "workers": args.workers,
+            "distortions": [name for name, _ in DISTORTIONS],
+        },
+        "throughput": {
+            "labelsPerSec": round(len(runs) / wall_s, 3),
+            "wallS": round(wall_s, 3),
+        },
+        "latency": {
+            "embedMs": _percentiles([r["embedS"] for r in runs]),
+            "decodeCleanMs": per_distortion["none"]["decodeMs"],
+            "decodeAllMs": _percentiles([d["decodeS"] for r in runs for d in r["distortions"].values()]),
+        },
+        "memory": {"peakWorkerRssMb": round(max(rss), 1) if rss else None},
+        "distortions": per_distortion,
+    }
+
+# ------------------------
+# Baseline comparison
+# ------------------------
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], speed_tol: float, rate_tol: float) -> List[str]:
+    """Regressions of `report` against `baseline`, as readable lines (empty when none)."""
+    problems = []
+    if report["config"] != baseline["config"]:
+        changed = sorted(k for k in report["config"] if report["config"][k] != baseline["config"].get(k))
+        problems.append(f"config differs from the baseline ({', '.join(changed)}); numbers are not comparable")
+        return problems
+
+    def slower(label: str, now: float, then: float, higher_is_better: bool):
+        change = (now - then) / then if then else 0.0
+        if (-change if higher_is_better else change) > speed_tol:
+            problems.append(f"{label}: {then} -> {now} ({change:+.0%})")
+
+    slower("labelsPerSec", report["throughput"]["labelsPerSec"], baseline["throughput"]["labelsPerSec"], True)
+    for metric in ("embedMs", "decodeCleanMs", "decodeAllMs"):
+        for q in ("p50", "p95"):
+            slower(f"{metric}.{q}", report["latency"][metric][q], baseline["latency"][metric][q], False)
+    mem_now, mem_then = report["memory"]["peakWorkerRssMb"], baseline["memory"]["peakWorkerRssMb"]
+    if mem_now and mem_then:
+        slower("peakWorkerRssMb", mem_now, mem_then, False)
+
+    for name, now in report["distortions"].items():
+        then = baseline["distortions"].get(name)
+        if then is None:
+            continue
+        if now["recoveryRate"] < then["recoveryRate"] - rate_tol:
+            problems.append(f"{name} recoveryRate: {then['recoveryRate']} -> {now['recoveryRate']}")
+        if now["bitErrorRate"] > then["bitErrorRate"] + rate_tol / 10:
+            problems.append(f"{name} bitErrorRate: {then['bitErrorRate']} -> {now['bitErrorRate']}")
+        if now["wrongHashes"] > then["wrongHashes"]:
+            problems.append(f"{name} wrongHashes: {then['wrongHashes']} -> {now['wrongHashes']}")
+    return problems
+
+# ------------------------
+# Harness
+# ------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", type=int, default=16)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=list(PROFILES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="process pool size (0 = run in this process)")
+    parser.add_argument("--resilient", action="store_true", help="decode with resilient_decode (geometry search)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="report JSON to compare against")
+    parser.add_argument("--save", help="write the report here")
+    parser.add_argument("--speed-tolerance", type=float, default=0.15,
+                        help="allowed relative slowdown / throughput drop")
+    parser.add_argument("--rate-tolerance", type=float, default=0.05,
+                        help="allowed absolute drop in a recovery rate (a tenth of it for bit-error rates)")
+    args = parser.parse_args()
+
+    task_args = [(i, args.width, args.height, args.seed, args.profile, args.resilient) for i in range(args.labels)]
+    if args.workers:
+        with ProcessPoolExecutor(args.workers) as pool:
+            # Spawn the workers (and import cv2 in them) before the clock starts.
+            list(pool.map(abs, range(args.workers)))
+            t0 = time.perf_counter()
+            runs = list(pool.map(run_label, *zip(*task_args)))
+            wall_s = time.perf_counter() - t0
+    else:
+        t0 = time.perf_counter()
+        runs = [run_label(*a) for a in task_args]
+        wall_s = time.perf_counter() - t0
+
+    report = build_report(runs, wall_s, args)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(report, fh, indent=2)
+            fh.write("\n")
+        print(f"✅ Report saved to {args.save}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        problems = compare(report, baseline, args.speed_tolerance, args.rate_tolerance)
+        if problems:
+            for line in problems:
+                print(f"❌ {line}", file=sys.stderr)
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
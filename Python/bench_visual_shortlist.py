@@ -0,0 +1,115 @@
+# bench_visual_shortlist.py
+"""
+Top-1 accuracy/latency benchmark for the visual shortlist /verify falls back
+to when no watermark decodes (image_index.ImageIndex).
+
+Synthetic labels (blurred colour noise with text on top) are registered in a
+throwaway index. A share of them is then "photographed": perspective warp,
+placed on a random background, Gaussian blur and JPEG re-encoding. The report
+lists top-1/top-3 hit rates, query p50/p95 latency, and how often a photo of
+a label that was never registered still returns a candidate.
+
+    python bench_visual_shortlist.py --labels 2000 --queries 200 --unregistered 100
+    python bench_visual_shortlist.py --labels 500 --queries 100 --blur 2.0 --jpeg 40
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+from image_index import ImageIndex, image_fingerprint, query_fingerprint
+
+# ------------------------
+# Inputs
+# ------------------------
+def _label(rng: np.random.Generator, i: int, width: int, height: int) -> np.ndarray:
+    img = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC), (0, 0), 3)
+    for j in range(6):
+        org = (int(rng.integers(0, width // 2)), int(rng.integers(40, height)))
+        cv2.putText(img, f"BATCH-{i:04d}-{j}", org, cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
+    return img
+
+def _photograph(img: np.ndarray, rng: np.random.Generator, blur: float, jpeg: int) -> np.ndarray:
+    """The label at an angle on a random background, blurred and JPEG-compressed."""
+    h, w = img.shape[:2]
+    out_w, out_h = int(w * 1.3), int(h * 1.3)
+    jitter = lambda: rng.uniform(-0.08, 0.08)
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = np.float32([
+        [out_w * (0.12 + jitter()), out_h * (0.12 + jitter())],
+        [out_w * (0.88 + jitter()), out_h * (0.12 + jitter())],
+        [out_w * (0.88 + jitter()), out_h * (0.88 + jitter())],
+        [out_w * (0.12 + jitter()), out_h * (0.88 + jitter())],
+    ])
+    background = np.full((out_h, out_w, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+    m = cv2.getPerspectiveTransform(src, dst)
+    photo = cv2.warpPerspective(img, m, (out_w, out_h), dst=background, borderMode=cv2.BORDER_TRANSPARENT)
+    if blur > 0:
+        photo = cv2.GaussianBlur(photo, (0, 0), blur)
+    ok, buf = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, jpeg])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+# ------------------------
+# Harness
+# ------------------------
+def _pct(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) * 1000 if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", type=int, default=2000, help="labels registered in the index")
+    parser.add_argument("--queries", type=int, default=200, help="photos of registered labels")
+    parser.add_argument("--unregistered", type=int, default=100, help="photos of labels that were never registered")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=500)
+    parser.add_argument("--blur", type=float, default=1.5, help="Gaussian blur sigma of the photo")
+    parser.add_argument("--jpeg", type=int, default=60, help="JPEG quality of the photo")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = ImageIndex(os.path.join(tmp, "bench_index.db"))
+        t0 = time.perf_counter()
+        for i in range(args.labels):
+            index.add(f"0x{i:064x}", f"label-{i}.png", image_fingerprint(_label(np.random.default_rng([args.seed, i]),
+                                                                                 i, args.width, args.height)))
+        print(f"{args.labels} labels indexed in {time.perf_counter() - t0:.1f}s, "
+              f"photos: perspective warp, blur {args.blur}, JPEG {args.jpeg}\n")
+
+        top1 = top3 = 0
+        times = []
+        targets = rng.choice(args.labels, size=min(args.queries, args.labels), replace=False)
+        for i in targets:
+            label = _label(np.random.default_rng([args.seed, int(i)]), int(i), args.width, args.height)
+            photo = _photograph(label, rng, args.blur, args.jpeg)
+            t = time.perf_counter()
+            matches = index.search(query_fingerprint(photo), 3)
+            times.append(time.perf_counter() - t)
+            hashes = [m["dataHash"] for m in matches]
+            top1 += bool(hashes) and hashes[0] == f"0x{i:064x}"
+            top3 += f"0x{i:064x}" in hashes
+
+        false_matches = 0
+        for i in range(args.labels, args.labels + args.unregistered):
+            label = _label(np.random.default_rng([args.seed, i]), i, args.width, args.height)
+            photo = _photograph(label, rng, args.blur, args.jpeg)
+            t = time.perf_counter()
+            matches = index.search(query_fingerprint(photo), 3)
+            times.append(time.perf_counter() - t)
+            if matches:
+                false_matches += 1
+                print(f"❌ unregistered label-{i} matched {matches[0]['dataHash'][:12]}… score {matches[0]['score']}")
+
+    n = len(targets)
+    print(f"top-1 {top1}/{n} ({top1 / max(n, 1):.0%})   top-3 {top3}/{n} ({top3 / max(n, 1):.0%})")
+    print(f"unregistered photos with a candidate: {false_matches}/{args.unregistered}")
+    print(f"query (fingerprint + search) p50 {_pct(times, 50):.1f} ms   p95 {_pct(times, 95):.1f} ms")
+
+if __name__ == "__main__":
+    main()
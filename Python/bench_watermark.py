@@ -0,0 +1,131 @@
+# bench_watermark.py
+"""
+Before/after microbenchmark for the QIM embed/decode engine.
+
+The legacy per-coefficient loops and the full wavedec2/waverec2 embed
+are kept here as reference implementations. The script checks that the
+vectorized engine produces bit-identical coefficients and decoded hashes,
+that the Haar fast path reads the same band and stays within one grey level
+of the full transform, then times both.
+
+    python bench_watermark.py --width 4000 --height 3000 --repeat 3
+"""
+import argparse
+import hashlib
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+import pywt
+
+from watermark import (
+    Q, WAVELET, DWT_LEVEL, PAYLOAD_BIT_LENGTH,
+    prepare_data, qim_embed, qim_extract_votes, majority_vote,
+    decode_watermark, embed_watermark, target_band,
+)
+
+# ------------------------
+# Legacy reference (nested Python loops)
+# ------------------------
+def legacy_embed(coeffs_flat: np.ndarray, watermark_payload: np.ndarray) -> np.ndarray:
+    payload_len = int(watermark_payload.size)
+    num_tiles = coeffs_flat.size // payload_len
+    for tile_idx in range(num_tiles):
+        start = tile_idx * payload_len
+        for i in range(payload_len):
+            coeff_index = start + i
+            C = coeffs_flat[coeff_index]
+            q_idx = int(np.round(C / Q))
+            bit = int(watermark_payload[i])
+            if bit == 0:
+                if q_idx % 2 != 0:
+                    q_idx -= 1
+            else:
+                if q_idx % 2 == 0:
+                    q_idx += 1
+            coeffs_flat[coeff_index] = q_idx * Q
+    return coeffs_flat
+
+def legacy_bits(target_coeffs: np.ndarray) -> np.ndarray:
+    num_tiles = target_coeffs.size // PAYLOAD_BIT_LENGTH
+    bit_votes = [[] for _ in range(PAYLOAD_BIT_LENGTH)]
+    for tile_idx in range(num_tiles):
+        start = tile_idx * PAYLOAD_BIT_LENGTH
+        for i in range(PAYLOAD_BIT_LENGTH):
+            q_idx = int(np.round(target_coeffs[start + i] / Q))
+            bit_votes[i].append(1 if (q_idx % 2) != 0 else 0)
+    return np.array([Counter(v).most_common(1)[0][0] for v in bit_votes], dtype=np.uint8)
+
+def vector_bits(target_coeffs: np.ndarray) -> np.ndarray:
+    return majority_vote(qim_extract_votes(target_coeffs, PAYLOAD_BIT_LENGTH))
+
+def legacy_embed_image(image: np.ndarray, watermark_payload: np.ndarray) -> np.ndarray:
+    """Full two-level transform, embed, waverec2 (even-sized images only: odd ones were resized)."""
+    y_channel, u_channel, v_channel = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2YUV))
+    coeffs = pywt.wavedec2(y_channel, WAVELET, level=DWT_LEVEL)
+    c_h, c_v, c_d = coeffs[-1]
+    coeffs[-1] = (qim_embed(c_h.flatten(), watermark_payload).reshape(c_h.shape), c_v, c_d)
+    y_out = np.clip(pywt.waverec2(coeffs, WAVELET), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(cv2.merge([y_out, u_channel, v_channel]), cv2.COLOR_YUV2BGR)
+
+# ------------------------
+# Harness
+# ------------------------
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    y = rng.integers(0, 256, size=(args.height, args.width), dtype=np.uint8)
+    band = pywt.wavedec2(y, WAVELET, level=DWT_LEVEL)[-1][0].flatten()
+    payload = prepare_data(hashlib.sha256(b"bench").hexdigest())
+    # A few coefficients on exact .5 boundaries exercise half-to-even rounding.
+    band[:8] = Q * (np.arange(8) + 0.5)
+
+    print(f"Image {args.width}x{args.height}: {band.size} target coeffs, {band.size // PAYLOAD_BIT_LENGTH} tiles")
+
+    legacy_out = legacy_embed(band.copy(), payload)
+    vector_out = qim_embed(band.copy(), payload)
+    assert np.array_equal(legacy_out, vector_out), "embed mismatch"
+
+    noisy = vector_out + rng.normal(0, Q / 3, size=vector_out.size)
+    assert np.array_equal(legacy_bits(noisy), vector_bits(noisy)), "decode mismatch"
+    print("✅ Bit-exact: embed coefficients and voted bits match the legacy loops.")
+
+    image = rng.integers(0, 256, size=(args.height // 2 * 2, args.width // 2 * 2, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (0, 0), 2)
+    image_y = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)[..., 0]
+    legacy_band = pywt.wavedec2(image_y, WAVELET, level=DWT_LEVEL)[-1][0]
+    assert np.allclose(legacy_band, target_band(image_y), atol=1e-3), "band mismatch"
+    legacy_img = legacy_embed_image(image, payload)
+    fast_img = embed_watermark(image, payload)
+    assert np.abs(legacy_img.astype(np.int16) - fast_img).max() <= 1, "embedded image drifted"
+    assert decode_watermark(fast_img) == decode_watermark(legacy_img), "decoded hash mismatch"
+    print("✅ Haar fast path: same band, embedded image within 1 grey level, same decoded hash.")
+
+    rows = [
+        ("embed", lambda: legacy_embed(band.copy(), payload), lambda: qim_embed(band.copy(), payload)),
+        ("decode", lambda: legacy_bits(noisy), lambda: vector_bits(noisy)),
+        ("band", lambda: pywt.wavedec2(image_y, WAVELET, level=DWT_LEVEL)[-1][0], lambda: target_band(image_y)),
+        ("image", lambda: legacy_embed_image(image, payload), lambda: embed_watermark(image, payload)),
+    ]
+    for name, before, after in rows:
+        t_before = _best_of(before, args.repeat)
+        t_after = _best_of(after, args.repeat)
+        print(f"{name:<7} legacy {t_before * 1000:10.1f} ms   vectorized {t_after * 1000:8.2f} ms   x{t_before / t_after:,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# chain_cache.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from eth_utils import event_abi_to_log_topic
+
+from multicall import Multicall
+
+# ------------------------
+# Read-through cache for contract view calls
+# ------------------------
+# Misses are read at `synced_block`, the last block whose logs have been
+# processed, so every cached value is consistent with the invalidations
+# applied so far. A background poller pulls the contract's logs for each new
+# block range, evicts the (function, args) keys each event can change, then
+# advances `synced_block`. If the poller falls behind by more than
+# `max_lag` seconds, reads bypass the cache and go to "latest". Misses from
+# call_many() are fetched together in one Multicall round trip. Listeners
+# see every event as (name, args, block) so caches built on top of these
+# reads can evict their own entries.
+
+CacheKey = Tuple[str, Tuple[Any, ...]]
+
+def _keys_for_event(name: str, args: Dict[str, Any]) -> List[CacheKey]:
+    if name == "ProductAdded":
+        return [
+            ("viewProductDetails", (args["productHash"],)),
+            ("viewProductsByBatch", (args["batchNumber"],)),
+            ("viewProductsByManufacturer", (args["manufacturerId"],)),
+            ("viewTotalProducts", ()),
+        ]
+    if name == "BatchAdded":
+        return [
+            ("viewBatchesByManufacturer", (args["manufacturerId"],)),
+            ("viewTotalBatches", ()),
+        ]
+    if name == "QCSubmitted":
+        return [
+            ("checkProductStandard", (args["batchNumber"],)),
+            ("viewQCSubmissions", (args["batchNumber"],)),
+            ("viewTotalQCSubmissions", ()),
+        ]
+    return []
+
+def _is_cacheable(fn_name: str, result: Any) -> bool:
+    # A missing product may be registered any moment; only cache hits.
+    if fn_name == "viewProductDetails":
+        return bool(result and result[0])
+    return True
+
+class ContractReadCache:
+    def __init__(self, w3, contract, multicall: Optional[Multicall] = None, poll_interval: float = 3.0,
+                 max_lag: float = 30.0, max_entries: int = 100_000, log_chunk: int = 2000):
+        self.w3 = w3
+        self.contract = contract
+        self.multicall = multicall
+        self.poll_interval = poll_interval
+        self.max_lag = max_lag
+        self.max_entries = max_entries
+        self.log_chunk = log_chunk
+        self._entries: "OrderedDict[CacheKey, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._topics = {
+            event_abi_to_log_topic(item): item["name"]
+            for item in contract.abi if item.get("type") == "event"
+        }
+        self._listeners: List[Callable[[str, Dict[str, Any], int], None]] = []
+        self.synced_block: Optional[int] = None
+        self._synced_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidations = 0
+
+    # --- reads ---
+    def _fresh(self) -> bool:
+        return self.synced_block is not None and time.monotonic() - self._synced_at <= self.max_lag
+
+    def _read(self, calls: List[CacheKey], block: Any) -> List[Any]:
+        if len(calls) == 1 or self.multicall is None:
+            return [getattr(self.contract.functions, fn)(*args).call(block_identifier=block) for fn, args in calls]
+        return self.multicall.call(calls, block_identifier=block)
+
+    def consistent_block(self) -> Optional[int]:
+        """Block that cached reads are pinned to, or None while reads are bypassing the cache."""
+        return self.synced_block if self._fresh() else None
+
+    def call(self, fn_name: str, *args):
+        """contract.functions.<fn_name>(*args).call(), served from cache when possible."""
+        return self.call_many([(fn_name, tuple(args))])[0]
+
+    def call_many(self, calls: List[CacheKey]) -> List[Any]:
+        """Results for several (fn_name, args) view calls; all misses share one round trip."""
+        calls = [(fn, tuple(args)) for fn, args in calls]
+        if not self._fresh():
+            self.bypassed += len(calls)
+            return self._read(calls, "latest")
+
+        results: List[Any] = [None] * len(calls)
+        missing: List[int] = []
+        with self._lock:
+            for i, key in enumerate(calls):
+                entry = self._entries.get(key)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    results[i] = entry[1]
+            block = self.synced_block
+        self.hits += len(calls) - len(missing)
+        self.misses += len(missing)
+        if not missing:
+            return results
+
+        fetched = self._read([calls[i] for i in missing], block)
+        with self._lock:
+            # An invalidation may have landed while we were reading; only
+            # store if the values are still as new as the synced block.
+            store = self.synced_block == block
+            for i, result in zip(missing, fetched):
+                results[i] = result
+                if store and _is_cacheable(calls[i][0], result):
+                    self._entries[calls[i]] = (block, result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def invalidate(self, keys: List[CacheKey]):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def add_listener(self, fn: Callable[[str, Dict[str, Any], int], None]):
+        self._listeners.append(fn)
+
+    # --- log polling ---
+    def sync_once(self) -> int:
+        """Processes logs up to the current head. Returns the number of events applied."""
+        head = self.w3.eth.block_number
+        if self.synced_block is None:
+            self.synced_block = head
+            self._synced_at = time.monotonic()
+            return 0
+
+        applied = 0
+        start = self.synced_block + 1
+        while start <= head:
+            end = min(head, start + self.log_chunk - 1)
+            logs = self.w3.eth.get_logs({"address": self.contract.address, "fromBlock": start, "toBlock": end})
+            for log in logs:
+                name = self._topics.get(bytes(log["topics"][0])) if log["topics"] else None
+                if name is None:
+                    continue
+                event = getattr(self.contract.events, name)().process_log(log)
+                self.invalidate(_keys_for_event(name, event["args"]))
+                for listener in self._listeners:
+                    try:
+                        listener(name, event["args"], log["blockNumber"])
+                    except Exception as e:
+                        print(f"❌ Chain event listener failed on {name}: {e}")
+                applied += 1
+            with self._lock:
+                self.synced_block = end
+            start = end + 1
+        self._synced_at = time.monotonic()
+        return applied
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception as e:
+                print(f"❌ Contract log poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "invalidations": self.invalidations,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "multicallRoundTrips": self.multicall.round_trips if self.multicall else None,
+            "syncedBlock": self.synced_block,
+            "secondsSinceSync": round(time.monotonic() - self._synced_at, 3) if self.synced_block is not None else None,
+        }
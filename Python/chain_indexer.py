@@ -0,0 +1,350 @@
+# chain_indexer.py
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_utils import event_abi_to_log_topic
+
+# ------------------------
+# Local read model of the contract's events (SQLite)
+# ------------------------
+# A background task tails the contract's logs into SQLite. Blocks at least
+# `confirmations` deep are written once as confirmed rows, and the indexer
+# checkpoints the last such block together with its hash. The unconfirmed tip
+# is re-read on every tick and its rows are replaced wholesale, so a shallow
+# reorg simply disappears on the next tick. If the checkpointed hash changes
+# (a reorg deeper than the confirmation depth), rows are rolled back to the
+# newest stored block hash that still matches the chain and are re-indexed.
+#
+# List / filter / count / time-range queries then run against local tables
+# instead of fanning out eth_calls. Rows are ordered by (block, logIndex) and
+# paginated with a "<block>.<logIndex>" cursor.
+
+# event name -> (table, [(event arg, column)])
+_TABLES = {
+    "ProductAdded": ("products", [
+        ("productHash", "product_hash"),
+        ("productCid", "product_cid"),
+        ("batchNumber", "batch_number"),
+        ("manufacturerId", "manufacturer_id"),
+    ]),
+    "BatchAdded": ("batches", [
+        ("manufacturerId", "manufacturer_id"),
+        ("batchNumber", "batch_number"),
+    ]),
+    "QCSubmitted": ("qc_submissions", [
+        ("uploaderId", "uploader_id"),
+        ("qcCid", "qc_cid"),
+        ("isStandard", "is_standard"),
+        ("batchNumber", "batch_number"),
+    ]),
+}
+_TABLES_BY_NAME = {table: columns for table, columns in _TABLES.values()}
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS products (
+        block_number INTEGER NOT NULL, log_index INTEGER NOT NULL, tx_hash TEXT, timestamp INTEGER,
+        confirmed INTEGER NOT NULL,
+        product_hash TEXT, product_cid TEXT, batch_number TEXT, manufacturer_id TEXT,
+        PRIMARY KEY (block_number, log_index)
+    );
+    CREATE INDEX IF NOT EXISTS products_batch ON products(batch_number);
+    CREATE INDEX IF NOT EXISTS products_manufacturer ON products(manufacturer_id);
+    CREATE INDEX IF NOT EXISTS products_hash ON products(product_hash);
+    CREATE INDEX IF NOT EXISTS products_time ON products(timestamp);
+
+    CREATE TABLE IF NOT EXISTS batches (
+        block_number INTEGER NOT NULL, log_index INTEGER NOT NULL, tx_hash TEXT, timestamp INTEGER,
+        confirmed INTEGER NOT NULL,
+        manufacturer_id TEXT, batch_number TEXT,
+        PRIMARY KEY (block_number, log_index)
+    );
+    CREATE INDEX IF NOT EXISTS batches_manufacturer ON batches(manufacturer_id);
+    CREATE INDEX IF NOT EXISTS batches_batch ON batches(batch_number);
+    CREATE INDEX IF NOT EXISTS batches_time ON batches(timestamp);
+
+    CREATE TABLE IF NOT EXISTS qc_submissions (
+        block_number INTEGER NOT NULL, log_index INTEGER NOT NULL, tx_hash TEXT, timestamp INTEGER,
+        confirmed INTEGER NOT NULL,
+        uploader_id TEXT, qc_cid TEXT, is_standard INTEGER, batch_number TEXT,
+        PRIMARY KEY (block_number, log_index)
+    );
+    CREATE INDEX IF NOT EXISTS qc_batch ON qc_submissions(batch_number);
+    CREATE INDEX IF NOT EXISTS qc_uploader ON qc_submissions(uploader_id);
+    CREATE INDEX IF NOT EXISTS qc_time ON qc_submissions(timestamp);
+
+    CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, hash TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# column -> JSON field for list results
+_FIELDS = {
+    "block_number": "blockNumber",
+    "log_index": "logIndex",
+    "tx_hash": "transactionHash",
+    "timestamp": "timestamp",
+    "product_hash": "productHash",
+    "product_cid": "productCid",
+    "batch_number": "batchNumber",
+    "manufacturer_id": "manufacturerId",
+    "uploader_id": "uploaderId",
+    "qc_cid": "qcCid",
+    "is_standard": "isStandard",
+}
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'<block>.<logIndex>' -> (block, logIndex). Raises ValueError for anything else."""
+    if not cursor:
+        return None
+    block, log_index = (int(part) for part in cursor.split("."))
+    return block, log_index
+
+class ChainIndexer:
+    def __init__(self, w3, contract, db_path: str, from_block: int = 0, confirmations: int = 12,
+                 poll_interval: float = 5.0, log_chunk: int = 2000, keep_block_hashes: int = 256):
+        self.w3 = w3
+        self.contract = contract
+        self.from_block = from_block
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.log_chunk = log_chunk
+        self.keep_block_hashes = keep_block_hashes
+        self._topics = {
+            event_abi_to_log_topic(item): item["name"]
+            for item in contract.abi if item.get("type") == "event" and item["name"] in _TABLES
+        }
+        self._timestamps: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'indexed_block'").fetchone()
+        self.indexed_block: Optional[int] = int(row["value"]) if row else None
+        self.head_block: Optional[int] = None
+        self.reorgs = 0
+        self._caught_up_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    # --- writing ---
+    def _block_timestamp(self, block_hash: str) -> int:
+        ts = self._timestamps.get(block_hash)
+        if ts is None:
+            if len(self._timestamps) > 10_000:
+                self._timestamps.clear()
+            ts = self._timestamps[block_hash] = int(self.w3.eth.get_block(block_hash)["timestamp"])
+        return ts
+
+    def _fetch(self, start: int, end: int) -> List[Tuple[str, tuple]]:
+        """Decoded (table, row) pairs for the contract's logs in [start, end]."""
+        rows = []
+        logs = self.w3.eth.get_logs({"address": self.contract.address, "fromBlock": start, "toBlock": end})
+        for log in logs:
+            name = self._topics.get(bytes(log["topics"][0])) if log["topics"] else None
+            if name is None:
+                continue
+            args = getattr(self.contract.events, name)().process_log(log)["args"]
+            table, columns = _TABLES[name]
+            block_hash = self.w3.to_hex(log["blockHash"])
+            rows.append((table, (
+                log["blockNumber"], log["logIndex"], self.w3.to_hex(log["transactionHash"]),
+                self._block_timestamp(block_hash),
+                *[args[arg] for arg, _ in columns],
+            )))
+        return rows
+
+    def _insert(self, rows: List[Tuple[str, tuple]], confirmed: bool):
+        for table, values in rows:
+            columns = ["block_number", "log_index", "tx_hash", "timestamp"] + [c for _, c in _TABLES_BY_NAME[table]]
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, confirmed) "
+                f"VALUES ({', '.join('?' * len(columns))}, ?)",
+                values + (int(confirmed),)
+            )
+
+    def _rollback_to(self, block: int):
+        for table, _ in _TABLES.values():
+            self._conn.execute(f"DELETE FROM {table} WHERE block_number > ?", (block,))
+        self._conn.execute("DELETE FROM blocks WHERE number > ?", (block,))
+        self._set_indexed(block)
+
+    def _set_indexed(self, block: int):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed_block', ?)", (str(block),))
+        self.indexed_block = block
+
+    def _check_reorg(self):
+        if self.indexed_block is None:
+            return
+        stored = self._query("SELECT number, hash FROM blocks ORDER BY number DESC")
+        if not stored or stored[0]["hash"] == self.w3.to_hex(self.w3.eth.get_block(stored[0]["number"])["hash"]):
+            return
+        # The checkpoint is no longer canonical: find the newest stored block that is.
+        for row in stored[1:]:
+            if row["hash"] == self.w3.to_hex(self.w3.eth.get_block(row["number"])["hash"]):
+                print(f"⚠ Reorg below the confirmation depth; re-indexing from block {row['number'] + 1}.")
+                with self._lock, self._conn:
+                    self._rollback_to(row["number"])
+                self.reorgs += 1
+                return
+        print("⚠ Reorg deeper than every stored block hash; re-indexing from the start.")
+        with self._lock, self._conn:
+            self._rollback_to(self.from_block - 1)
+        self.reorgs += 1
+
+    def sync_once(self) -> int:
+        """Indexes confirmed blocks up to head - confirmations, then refreshes the tip. Returns rows written."""
+        head = self.w3.eth.block_number
+        self.head_block = head
+        safe = head - self.confirmations
+        self._check_reorg()
+
+        written = 0
+        start = self.from_block if self.indexed_block is None else self.indexed_block + 1
+        while start <= safe:
+            end = min(safe, start + self.log_chunk - 1)
+            rows = self._fetch(start, end)
+            end_hash = self.w3.to_hex(self.w3.eth.get_block(end)["hash"])
+            with self._lock, self._conn:
+                self._insert(rows, confirmed=True)
+                self._conn.execute("INSERT OR REPLACE INTO blocks (number, hash) VALUES (?, ?)", (end, end_hash))
+                self._conn.execute(
+                    "DELETE FROM blocks WHERE number NOT IN (SELECT number FROM blocks ORDER BY number DESC LIMIT ?)",
+                    (self.keep_block_hashes,)
+                )
+                self._set_indexed(end)
+            written += len(rows)
+            start = end + 1
+
+        tip = self._fetch(start, head) if start <= head else []
+        with self._lock, self._conn:
+            for table, _ in _TABLES.values():
+                self._conn.execute(f"DELETE FROM {table} WHERE confirmed = 0")
+            self._insert(tip, confirmed=False)
+        self._caught_up_at = time.monotonic()
+        return written + len(tip)
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception as e:
+                print(f"❌ Chain indexer sync failed at block {self.indexed_block}: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # --- queries ---
+    @property
+    def caught_up(self) -> bool:
+        """True when the last sync reached the chain head recently."""
+        return self._caught_up_at > 0 and time.monotonic() - self._caught_up_at <= max(60.0, self.poll_interval * 5)
+
+    def _query(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _list(self, table: str, filters: Dict[str, Any], since: Optional[int], until: Optional[int],
+              after: Optional[Tuple[int, int]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        where, args = [], []
+        for column, value in filters.items():
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            where.append("timestamp >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            args.append(until)
+        if after is not None:
+            where.append("(block_number, log_index) > (?, ?)")
+            args.extend(after)
+        sql = f"SELECT * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY block_number, log_index LIMIT ?"
+        rows = self._query(sql, tuple(args) + (limit + 1,))
+
+        items = []
+        for row in rows[:limit]:
+            item = {_FIELDS[k]: row[k] for k in row.keys() if k in _FIELDS}
+            item["confirmed"] = bool(row["confirmed"])
+            if "isStandard" in item:
+                item["isStandard"] = bool(item["isStandard"])
+            items.append(item)
+        next_cursor = f"{rows[limit - 1]['block_number']}.{rows[limit - 1]['log_index']}" if len(rows) > limit else None
+        return items, next_cursor
+
+    def products(self, batch_number: Optional[str] = None, manufacturer_id: Optional[str] = None,
+                 since: Optional[int] = None, until: Optional[int] = None,
+                 after: Optional[Tuple[int, int]] = None, limit: int = 100):
+        return self._list("products", {"batch_number": batch_number, "manufacturer_id": manufacturer_id},
+                          since, until, after, limit)
+
+    def batches(self, manufacturer_id: Optional[str] = None, since: Optional[int] = None,
+                until: Optional[int] = None, after: Optional[Tuple[int, int]] = None, limit: int = 100):
+        return self._list("batches", {"manufacturer_id": manufacturer_id}, since, until, after, limit)
+
+    def qc_submissions(self, batch_number: Optional[str] = None, uploader_id: Optional[str] = None,
+                       is_standard: Optional[bool] = None, since: Optional[int] = None,
+                       until: Optional[int] = None, after: Optional[Tuple[int, int]] = None, limit: int = 100):
+        filters = {
+            "batch_number": batch_number,
+            "uploader_id": uploader_id,
+            "is_standard": None if is_standard is None else int(is_standard),
+        }
+        return self._list("qc_submissions", filters, since, until, after, limit)
+
+    def manufacturers(self) -> List[Dict[str, Any]]:
+        rows = self._query("""
+            SELECT b.manufacturer_id AS manufacturer_id,
+                   COUNT(DISTINCT b.batch_number) AS batches,
+                   MIN(b.timestamp) AS first_seen,
+                   (SELECT COUNT(*) FROM products p WHERE p.manufacturer_id = b.manufacturer_id) AS products
+            FROM batches b GROUP BY b.manufacturer_id ORDER BY MIN(b.block_number), MIN(b.log_index)
+        """)
+        return [{
+            "manufacturerId": r["manufacturer_id"],
+            "batches": r["batches"],
+            "products": r["products"],
+            "firstSeen": r["first_seen"],
+        } for r in rows]
+
+    def summary(self, since: Optional[int] = None, until: Optional[int] = None) -> Dict[str, Any]:
+        """Event counts (optionally within [since, until)) for dashboards."""
+        where, args = "", ()
+        if since is not None or until is not None:
+            where = " WHERE timestamp >= ? AND timestamp < ?"
+            args = (since if since is not None else 0, until if until is not None else 2 ** 62)
+        count = lambda table: self._query(f"SELECT COUNT(*) AS n FROM {table}{where}", args)[0]["n"]
+        qc = self._query(
+            f"SELECT SUM(is_standard) AS passed, COUNT(*) AS total, COUNT(DISTINCT batch_number) AS batches "
+            f"FROM qc_submissions{where}", args
+        )[0]
+        return {
+            "totalBatches": count("batches"),
+            "totalProducts": count("products"),
+            "totalQCSubmissions": qc["total"],
+            "qcPassed": qc["passed"] or 0,
+            "qcFailed": qc["total"] - (qc["passed"] or 0),
+            "batchesWithQC": qc["batches"],
+            "manufacturers": self._query(f"SELECT COUNT(DISTINCT manufacturer_id) AS n FROM batches{where}", args)[0]["n"],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "indexedBlock": self.indexed_block,
+            "headBlock": self.head_block,
+            "confirmations": self.confirmations,
+            "caughtUp": self.caught_up,
+            "reorgs": self.reorgs,
+        }
@@ -0,0 +1,148 @@
+# cid_cache.py
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# ------------------------
+# Two-tier cache for immutable IPFS content
+# ------------------------
+# Content behind a CID never changes, so entries never expire. Tier 1 is an
+# in-process LRU bounded by total bytes; tier 2 is a directory of files named
+# by CID, sharded into subdirectories by the next-to-last two characters of the
+# CID (the layout Kubo's flatfs uses; leading characters like "Qm" or "bafy"
+# are the same for every CID and would not spread files).
+#
+# Request paths use get_async()/put_async(): a memory hit returns inline and
+# only the disk tier runs in a worker thread, so a slow disk never stalls the
+# event loop.
+
+class CIDCache:
+    def __init__(self, disk_dir: Optional[str], memory_bytes: int):
+        self.disk_dir = disk_dir
+        self.memory_bytes = memory_bytes
+        self._lru: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lru_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.fills = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, cid: str) -> str:
+        shard = cid[-3:-1] if len(cid) >= 3 else "__"
+        return os.path.join(self.disk_dir, shard, cid)
+
+    def _remember(self, cid: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._lru.pop(cid, None)
+            if old is not None:
+                self._lru_bytes -= len(old)
+            self._lru[cid] = data
+            self._lru_bytes += len(data)
+            while self._lru_bytes > self.memory_bytes:
+                _, evicted = self._lru.popitem(last=False)
+                self._lru_bytes -= len(evicted)
+
+    def _memory_get(self, cid: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._lru.get(cid)
+            if data is not None:
+                self._lru.move_to_end(cid)
+                self.memory_hits += 1
+            return data
+
+    def _disk_get(self, cid: str) -> Optional[bytes]:
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(cid), "rb") as fh:
+                    data = fh.read()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self.disk_hits += 1
+                self._remember(cid, data)
+                return data
+        self.misses += 1
+        return None
+
+    def get(self, cid: str) -> Optional[bytes]:
+        data = self._memory_get(cid)
+        return data if data is not None else self._disk_get(cid)
+
+    async def get_async(self, cid: str) -> Optional[bytes]:
+        data = self._memory_get(cid)
+        if data is not None:
+            return data
+        if not self.disk_dir:
+            self.misses += 1
+            return None
+        return await asyncio.to_thread(self._disk_get, cid)
+
+    def _disk_put(self, cid: str, data: bytes):
+        path = self._disk_path(cid)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, cid: str, data: bytes):
+        """Stores content that the caller has already verified against `cid`."""
+        self.fills += 1
+        self._remember(cid, data)
+        if self.disk_dir:
+            self._disk_put(cid, data)
+
+    async def put_async(self, cid: str, data: bytes):
+        self.fills += 1
+        self._remember(cid, data)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, cid, data)
+
+    def warm(self) -> int:
+        """Loads the most recently written disk entries into memory, up to the byte budget."""
+        if not self.disk_dir:
+            return 0
+        entries = []
+        for shard in os.scandir(self.disk_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.name, entry.path))
+        entries.sort(reverse=True)
+
+        loaded, budget = 0, self.memory_bytes
+        for _, size, cid, path in entries:
+            if size > budget:
+                continue
+            with open(path, "rb") as fh:
+                self._remember(cid, fh.read())
+            budget -= size
+            loaded += 1
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, used = len(self._lru), self._lru_bytes
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memoryHits": self.memory_hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "fills": self.fills,
+            "hitRate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memoryEntries": entries,
+            "memoryBytes": used,
+            "memoryBudgetBytes": self.memory_bytes,
+            "diskDir": self.disk_dir,
+        }
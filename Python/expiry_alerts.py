@@ -0,0 +1,177 @@
+# expiry_alerts.py
+import asyncio
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# ------------------------
+# Incremental expiry alerts
+# ------------------------
+# Scans store expiryDate as "YYYY-MM-DD", so the string order is the date
+# order and a range filter on it works as a day-bucketed index. A run on day
+# D alerts about scans expiring in (D, D + window_days]. Only two slices of
+# `scans` are read:
+#   - expiries that entered the window since the last run:
+#     expiryDate in (previous window end, D + window_days];
+#   - scans written since the last run (timestamp > cursor, with some
+#     overlap for clock skew) whose expiry was already inside the window.
+# Either way a run reads about as many docs as there are new expiries and new
+# scans, however large `scans` is.
+#
+# Every (user, product, expiry day) that was alerted is recorded here, so a
+# rescan or an overlapping slice doesn't alert the same user twice. Rows are
+# dropped once their day has passed. Alerts that share a product and day go
+# out as one multicast, and tokens come from one batched read per run.
+# The window end and cursor only move after a run completes; a retried run
+# skips the groups it already sent.
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alerted (
+        user_id TEXT NOT NULL,
+        product_name TEXT NOT NULL,
+        expiry_day TEXT NOT NULL,
+        alerted_at REAL NOT NULL,
+        PRIMARY KEY (user_id, product_name, expiry_day)
+    );
+    CREATE INDEX IF NOT EXISTS alerted_day ON alerted(expiry_day);
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_SCAN_FIELDS = ["userId", "productName", "expiryDate"]
+
+class ExpiryAlerts:
+    def __init__(self, db_path: str, window_days: int = 30, cursor_overlap: float = 300.0):
+        self.window_days = window_days
+        self.cursor_overlap = cursor_overlap
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # --- state ---
+    def _execute(self, sql: str, args: Tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _meta(self, key: str) -> Optional[str]:
+        rows = self._execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def _set_meta(self, key: str, value: str):
+        self._execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _already_alerted(self, days: List[str]) -> set:
+        marks = ",".join("?" * len(days))
+        rows = self._execute(f"SELECT user_id, product_name, expiry_day FROM alerted WHERE expiry_day IN ({marks})",
+                             tuple(days))
+        return set(rows)
+
+    def _mark(self, product_name: str, day: str, user_ids: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO alerted (user_id, product_name, expiry_day, alerted_at) VALUES (?, ?, ?, ?)",
+                [(user_id, product_name, day, now) for user_id in user_ids]
+            )
+
+    # --- Firestore reads ---
+    @staticmethod
+    def _read(query) -> List[Dict[str, Any]]:
+        return [doc.to_dict() or {} for doc in query.select(_SCAN_FIELDS).stream()]
+
+    def _entering_window(self, notifier, after: str, until: str) -> List[Dict[str, Any]]:
+        scans = notifier.db.collection("scans")
+        query = scans.where(filter=notifier.field_filter("expiryDate", ">", after)) \
+                     .where(filter=notifier.field_filter("expiryDate", "<=", until))
+        return self._read(query)
+
+    def _written_since(self, notifier, cursor: float) -> List[Dict[str, Any]]:
+        since = datetime.fromtimestamp(cursor - self.cursor_overlap, tz=timezone.utc)
+        return self._read(notifier.db.collection("scans").where(filter=notifier.field_filter("timestamp", ">", since)))
+
+    # --- run ---
+    async def run(self, notifier, today: Optional[date] = None) -> Dict[str, Any]:
+        """Alerts owners of scans that entered the window since the last run. Returns run metrics."""
+        t0 = time.perf_counter()
+        started = time.time()
+        today = today or date.today()
+        first_day = today.isoformat()
+        window_end = (today + timedelta(days=self.window_days)).isoformat()
+        previous_end = max(self._meta("window_end") or first_day, first_day)
+        cursor = self._meta("scan_cursor")
+
+        docs = []
+        if previous_end < window_end:
+            docs += await asyncio.to_thread(self._entering_window, notifier, previous_end, window_end)
+        if cursor is not None:
+            docs += await asyncio.to_thread(self._written_since, notifier, float(cursor))
+
+        # (product, day) -> users, skipping what earlier runs (or a rescan) covered.
+        groups: Dict[Tuple[str, str], Dict[str, bool]] = {}
+        for d in docs:
+            user_id, product_name, raw = d.get("userId"), d.get("productName"), d.get("expiryDate")
+            if not user_id or not product_name or not isinstance(raw, str):
+                continue
+            try:
+                day = datetime.strptime(raw, "%Y-%m-%d").date().isoformat()
+            except ValueError:
+                continue
+            if first_day < day <= window_end:
+                groups.setdefault((product_name, day), {})[user_id] = True
+        done = self._already_alerted(sorted({day for _, day in groups})) if groups else set()
+        pending = {}
+        for (product_name, day), users in groups.items():
+            fresh = [u for u in users if (u, product_name, day) not in done]
+            if fresh:
+                pending[(product_name, day)] = fresh
+        skipped = sum(len(users) for users in groups.values()) - sum(len(users) for users in pending.values())
+
+        all_users = list(dict.fromkeys(u for users in pending.values() for u in users))
+        owners = await notifier.resolve_tokens(all_users) if all_users else {}
+        token_of = {u: token for token, users in owners.items() for u in users}
+
+        async def alert(product_name: str, day: str, users: List[str]) -> Dict[str, Any]:
+            group_owners: Dict[str, List[str]] = {}
+            for u in users:
+                if u in token_of:
+                    group_owners.setdefault(token_of[u], []).append(u)
+            metrics = await notifier.deliver(
+                group_owners,
+                title="Product Expiry Alert",
+                body=f"Your {product_name} is expiring on {day}!",
+                data={"alertType": "expiry", "productName": product_name, "expiryDate": day}
+            ) if group_owners else {}
+            await asyncio.to_thread(self._mark, product_name, day, users)
+            return metrics
+
+        results = await asyncio.gather(*(alert(p, d, users) for (p, d), users in pending.items()))
+
+        self._set_meta("window_end", max(previous_end, window_end))
+        self._set_meta("scan_cursor", str(started))
+        self._execute("DELETE FROM alerted WHERE expiry_day <= ?", (first_day,))
+
+        summary = {
+            "windowStart": previous_end,
+            "windowEnd": window_end,
+            "scansRead": len(docs),
+            "alerts": sum(len(users) for users in pending.values()),
+            "alreadyAlerted": skipped,
+            "users": len(all_users),
+        }
+        for key in ("tokens", "sent", "failed", "pruned", "multicasts"):
+            summary[key] = sum(r.get(key, 0) for r in results)
+        summary["elapsedMs"] = round((time.perf_counter() - t0) * 1000, 1)
+        self.last_run = {**summary, "finishedAt": time.time()}
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._execute("SELECT COUNT(*) FROM alerted")
+        return {
+            "windowEnd": self._meta("window_end"),
+            "scanCursor": float(self._meta("scan_cursor") or 0) or None,
+            "alertedTracked": rows[0][0],
+            "lastRun": self.last_run,
+        }
@@ -0,0 +1,272 @@
+# image_index.py
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from watermark import decode_watermark
+
+# ------------------------
+# Visual index of registered label images
+# ------------------------
+# When the watermark can't be read (blurred phone photos, glare on blister
+# foil), /verify can still shortlist the label a photo most likely shows.
+# Every watermarked image gets a fingerprint: a 64-bit DCT perceptual hash
+# plus up to ORB_FEATURES ORB descriptors. Fingerprints live in SQLite; memory
+# only holds two lookup structures, rebuilt by load() in the background:
+#
+#   * multi-index hashing over the pHash: the hash is split into 4 16-bit
+#     chunks, and any hash within distance r of the query matches at least one
+#     chunk within r // 4, so a lookup probes a few hundred buckets instead of
+#     comparing against every image;
+#   * LSH tables over the ORB descriptors: each table keys a descriptor by a
+#     fixed random subset of its bits, and images collect an IDF-weighted vote
+#     per colliding descriptor.
+#
+# The best-voted images are re-ranked by brute-force ORB matching (Lowe ratio
+# test) against their stored descriptors, keeping only matches consistent with
+# one homography (RANSAC) - a flat label photographed at an angle.
+
+PHASH_CHUNKS = 4
+ORB_FEATURES = 64          # stored per registered image
+ORB_QUERY_FEATURES = 500   # extracted from a photo being verified
+# Features are taken from a downscaled copy: at this size camera blur and JPEG
+# noise mostly vanish, which makes ORB descriptors far more repeatable. Photos
+# get a little more room since the label rarely fills the frame.
+ORB_MAX_SIDE = 400
+ORB_QUERY_MAX_SIDE = 512
+
+def _phash(gray: np.ndarray) -> int:
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def image_fingerprint(img_bgr: np.ndarray, features: int = ORB_FEATURES, max_side: int = ORB_MAX_SIDE) -> Dict[str, Any]:
+    """{"phash": int, "descriptors": bytes, "points": bytes} for one BGR image.
+
+    descriptors are n x 32-byte ORB descriptors, points their n x 2 float32
+    keypoint coordinates (used for the RANSAC check).
+    """
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY) if img_bgr.ndim == 3 else img_bgr
+    phash = _phash(gray)
+    scale = max_side / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    orb = cv2.ORB_create(nfeatures=features * 4)
+    keypoints, descriptors = orb.detectAndCompute(gray, None)
+    if descriptors is None:
+        descriptors, points = np.zeros((0, 32), np.uint8), np.zeros((0, 2), np.float32)
+    else:
+        # keep the strongest corners; they are the most repeatable under blur
+        order = np.argsort([-kp.response for kp in keypoints])[:features]
+        descriptors = descriptors[order]
+        points = np.float32([keypoints[i].pt for i in order])
+    return {"phash": phash, "descriptors": descriptors.tobytes(), "points": points.tobytes()}
+
+def query_fingerprint(img_bgr: np.ndarray) -> Dict[str, Any]:
+    return image_fingerprint(img_bgr, ORB_QUERY_FEATURES, ORB_QUERY_MAX_SIDE)
+
+def decode_and_fingerprint(path: str) -> Optional[Dict[str, Any]]:
+    """Reads a stored watermarked image: its embedded hash plus fingerprint (for backfilling)."""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    try:
+        data_hash = decode_watermark(img)
+    except Exception:
+        data_hash = None
+    return {"dataHash": data_hash, **image_fingerprint(img)}
+
+def _chunk_neighbours(value: int, radius: int, width: int = 64 // PHASH_CHUNKS) -> List[int]:
+    out = [value]
+    if radius >= 1:
+        out += [value ^ (1 << i) for i in range(width)]
+    if radius >= 2:
+        out += [value ^ (1 << i) ^ (1 << j) for i in range(width) for j in range(i + 1, width)]
+    return out
+
+class ImageIndex:
+    def __init__(self, db_path: str, max_phash_distance: int = 10, lsh_tables: int = 4, lsh_bits: int = 16,
+                 min_votes: int = 3, rerank: int = 20, min_inliers: int = 18):
+        self.max_phash_distance = max_phash_distance
+        self.min_votes = min_votes
+        self.rerank = rerank
+        self.min_inliers = min_inliers
+        rng = np.random.default_rng(0x5EED)
+        self._lsh_positions = [rng.choice(256, lsh_bits, replace=False) for _ in range(lsh_tables)]
+        self._lsh_weights = (1 << np.arange(lsh_bits, dtype=np.int64))
+        self._lock = threading.Lock()
+        self._phash: Dict[int, int] = {}
+        self._data_hash: Dict[int, str] = {}
+        self._mih: List[Dict[int, List[int]]] = [{} for _ in range(PHASH_CHUNKS)]
+        self._lsh: List[Dict[int, array]] = [{} for _ in range(lsh_tables)]
+        self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY,
+                data_hash TEXT,
+                filename TEXT UNIQUE,
+                phash BLOB NOT NULL,
+                descriptors BLOB NOT NULL,
+                points BLOB NOT NULL,
+                added_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._filenames = {row[0] for row in self._conn.execute("SELECT filename FROM images")}
+        # Rows up to here are loaded into memory by load(); later add()s go straight in.
+        self._stored_max_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM images").fetchone()[0]
+        self.loaded = self._stored_max_id == 0
+
+    def load(self, chunk: int = 2000):
+        """Builds the lookup structures from SQLite in chunks, so searches and adds can interleave."""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, data_hash, phash, descriptors FROM images WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (last_id, self._stored_max_id, chunk)
+                ).fetchall()
+                for image_id, data_hash, phash, descriptors in rows:
+                    if data_hash:
+                        self._remember(image_id, data_hash, int.from_bytes(phash, "big"), descriptors)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+        self.loaded = True
+
+    # --- in-memory structures ---
+    def _lsh_keys(self, descriptors: np.ndarray) -> List[np.ndarray]:
+        bits = np.unpackbits(descriptors, axis=1)
+        return [bits[:, pos].astype(np.int64) @ self._lsh_weights for pos in self._lsh_positions]
+
+    def _remember(self, image_id: int, data_hash: str, phash: int, descriptors: bytes):
+        self._phash[image_id] = phash
+        self._data_hash[image_id] = data_hash
+        for i, table in enumerate(self._mih):
+            table.setdefault((phash >> (16 * i)) & 0xFFFF, []).append(image_id)
+        desc = np.frombuffer(descriptors, np.uint8).reshape(-1, 32)
+        if len(desc):
+            for table, keys in zip(self._lsh, self._lsh_keys(desc)):
+                for key in set(keys.tolist()):
+                    table.setdefault(key, array("I")).append(image_id)
+
+    # --- public API ---
+    def has(self, filename: str) -> bool:
+        return filename in self._filenames
+
+    def add(self, data_hash: Optional[str], filename: str, fingerprint: Dict[str, Any]):
+        """Stores one image_fingerprint(). data_hash=None records an image that could not be attributed."""
+        with self._lock:
+            if filename in self._filenames:
+                return
+            cur = self._conn.execute(
+                "INSERT INTO images (data_hash, filename, phash, descriptors, points, added_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (data_hash, filename, fingerprint["phash"].to_bytes(8, "big"),
+                 fingerprint["descriptors"], fingerprint["points"], time.time())
+            )
+            self._conn.commit()
+            self._filenames.add(filename)
+            if data_hash:
+                self._remember(cur.lastrowid, data_hash, fingerprint["phash"], fingerprint["descriptors"])
+
+    def _phash_candidates(self, phash: int) -> Dict[int, int]:
+        radius = self.max_phash_distance // PHASH_CHUNKS
+        seen: Dict[int, int] = {}
+        for i, table in enumerate(self._mih):
+            for key in _chunk_neighbours((phash >> (16 * i)) & 0xFFFF, radius):
+                for image_id in table.get(key, ()):
+                    if image_id not in seen:
+                        seen[image_id] = bin(self._phash[image_id] ^ phash).count("1")
+        return {k: d for k, d in seen.items() if d <= self.max_phash_distance}
+
+    def _feature_candidates(self, desc: np.ndarray) -> List[int]:
+        hits, weights = [], []
+        for table, keys in zip(self._lsh, self._lsh_keys(desc)):
+            for key in set(keys.tolist()):
+                bucket = table.get(key)
+                if bucket is not None:
+                    hits.append(np.frombuffer(bucket, np.uint32))
+                    # IDF: a bucket every label lands in (plain edges, text
+                    # strokes) says little about which label this is.
+                    weights.append(np.full(len(bucket), np.log1p(len(self._phash) / len(bucket))))
+        if not hits:
+            return []
+        ids, inverse, votes = np.unique(np.concatenate(hits), return_inverse=True, return_counts=True)
+        score = np.bincount(inverse, weights=np.concatenate(weights))
+        keep = votes >= self.min_votes
+        ids, score = ids[keep], score[keep]
+        return ids[np.argsort(-score, kind="stable")[:self.rerank]].tolist()
+
+    def _inliers(self, desc: np.ndarray, points: np.ndarray, image_ids: List[int]) -> Dict[int, int]:
+        """Ratio-test ORB matches that agree on one homography, per candidate image."""
+        if not image_ids or len(desc) < 2:
+            return {}
+        marks = ",".join("?" * len(image_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, descriptors, points FROM images WHERE id IN ({marks})", image_ids
+            ).fetchall()
+        inliers = {}
+        for image_id, desc_blob, points_blob in rows:
+            train = np.frombuffer(desc_blob, np.uint8).reshape(-1, 32)
+            train_points = np.frombuffer(points_blob, np.float32).reshape(-1, 2)
+            if len(train) < 2:
+                continue
+            good = [p[0] for p in self._matcher.knnMatch(train, desc, k=2)
+                    if len(p) == 2 and p[0].distance < 0.8 * p[1].distance]
+            if len(good) < 4:
+                inliers[image_id] = 0
+                continue
+            src = train_points[[m.queryIdx for m in good]]
+            dst = points[[m.trainIdx for m in good]]
+            _, mask = cv2.findHomography(src, dst, cv2.RANSAC, 8.0)
+            inliers[image_id] = int(mask.sum()) if mask is not None else 0
+        return inliers
+
+    def search(self, fingerprint: Dict[str, Any], limit: int = 5) -> List[Dict[str, Any]]:
+        """Best-matching registered images, one entry per dataHash, strongest first."""
+        desc = np.frombuffer(fingerprint["descriptors"], np.uint8).reshape(-1, 32)
+        points = np.frombuffer(fingerprint["points"], np.float32).reshape(-1, 2)
+        with self._lock:
+            near = self._phash_candidates(fingerprint["phash"])
+            shortlist = list(dict.fromkeys(list(near) + (self._feature_candidates(desc) if len(desc) else [])))
+        inliers = self._inliers(desc, points, shortlist)
+
+        best: Dict[str, Dict[str, Any]] = {}
+        for image_id in shortlist:
+            distance = near.get(image_id)
+            count = inliers.get(image_id, 0)
+            if distance is None and count < self.min_inliers:
+                continue
+            # a near-identical pHash counts like every stored feature matching
+            score = max(count / ORB_FEATURES, 1 - distance / 64 if distance is not None else 0.0)
+            data_hash = self._data_hash[image_id]
+            if data_hash not in best or score > best[data_hash]["score"]:
+                best[data_hash] = {
+                    "dataHash": data_hash,
+                    "score": round(min(score, 1.0), 4),
+                    "phashDistance": distance,
+                    "featureInliers": count,
+                }
+        return sorted(best.values(), key=lambda c: -c["score"])[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "images": len(self._phash),
+            "unattributed": len(self._filenames) - len(self._phash),
+            "lshBuckets": sum(len(t) for t in self._lsh),
+            "loaded": self.loaded,
+        }
@@ -0,0 +1,323 @@
+# ipfs_client.py
+import asyncio
+import base64
+import hashlib
+import json
+import os
+from typing import Any, List, Optional
+
+import aiohttp
+
+from cid_cache import CIDCache
+
+# ------------------------
+# CIDs
+# ------------------------
+_B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def _b58encode(data: bytes) -> str:
+    n = int.from_bytes(data, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 58)
+        out = _B58_ALPHABET[rem] + out
+    pad = len(data) - len(data.lstrip(b"\0"))
+    return "1" * pad + out
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+_CHUNK_SIZE = 256 * 1024  # default `ipfs add` chunker; larger files become multi-block DAGs
+_CODEC_RAW = 0x55
+_CODEC_DAG_PB = 0x70
+
+def _unixfs_file_node(data: bytes) -> bytes:
+    unixfs = b"\x08\x02"
+    if data:
+        unixfs += b"\x12" + _varint(len(data)) + data
+    unixfs += b"\x18" + _varint(len(data))
+    return b"\x0a" + _varint(len(unixfs)) + unixfs
+
+def compute_cid_v0(data: bytes) -> str:
+    """CIDv0 that `ipfs add` / Pinata assign to a single-chunk (<= 256 KiB) file."""
+    return _b58encode(b"\x12\x20" + hashlib.sha256(_unixfs_file_node(data)).digest())
+
+def _read_varint(buf: bytes, pos: int):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def verify_cid(cid: str, data: bytes) -> Optional[bool]:
+    """
+    True/False if `data` can be checked against `cid`, None if it cannot
+    (multi-block files, non-sha256 hashes or unknown encodings).
+    """
+    if len(data) > _CHUNK_SIZE:
+        return None
+    if cid.startswith("Qm"):
+        return compute_cid_v0(data) == cid
+    if not cid.startswith("b"):
+        return None
+    try:
+        body = cid[1:].upper()
+        raw = base64.b32decode(body + "=" * (-len(body) % 8))
+        version, pos = _read_varint(raw, 0)
+        codec, pos = _read_varint(raw, pos)
+    except (ValueError, IndexError):
+        return None
+    digest = raw[pos + 2:]
+    if version != 1 or raw[pos:pos + 2] != b"\x12\x20" or len(digest) != 32:
+        return None
+    if codec == _CODEC_RAW:
+        return hashlib.sha256(data).digest() == digest
+    if codec == _CODEC_DAG_PB:
+        return hashlib.sha256(_unixfs_file_node(data)).digest() == digest
+    return None
+
+# ------------------------
+# Fetch sources
+# ------------------------
+# A source knows how to turn a CID into bytes. Public gateways serve
+# GET /ipfs/<cid>; a local Kubo node serves POST /api/v0/cat?arg=<cid>.
+
+class _RetryableStatus(Exception):
+    pass
+
+class _ContentMismatch(Exception):
+    pass
+
+class GatewaySource:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.name = self.base_url
+
+    def public_url(self, cid: str) -> str:
+        return f"{self.base_url}/ipfs/{cid}"
+
+    async def fetch(self, session: aiohttp.ClientSession, cid: str) -> Optional[bytes]:
+        async with session.get(self.public_url(cid)) as resp:
+            return await _read_body(resp)
+
+class LocalNodeSource:
+    def __init__(self, api_url: str):
+        self.api_url = api_url.rstrip("/")
+        self.name = f"local:{self.api_url}"
+
+    async def fetch(self, session: aiohttp.ClientSession, cid: str) -> Optional[bytes]:
+        async with session.post(f"{self.api_url}/api/v0/cat", params={"arg": cid}) as resp:
+            return await _read_body(resp)
+
+async def _read_body(resp: aiohttp.ClientResponse) -> Optional[bytes]:
+    if resp.status == 429 or resp.status >= 500:
+        raise _RetryableStatus(f"HTTP {resp.status}")
+    if resp.status != 200:
+        return None
+    return await resp.read()
+
+# ------------------------
+# Pin backends
+# ------------------------
+class PinataBackend:
+    def __init__(self, api_key: str, secret_key: str, api_url: str = "https://api.pinata.cloud"):
+        self.api_url = api_url.rstrip("/")
+        self.headers = {
+            "pinata_api_key": api_key,
+            "pinata_secret_api_key": secret_key
+        }
+
+    async def pin(self, session: aiohttp.ClientSession, file_bytes: bytes, filename: str) -> str:
+        form = aiohttp.FormData()
+        form.add_field("file", file_bytes, filename=filename)
+        async with session.post(f"{self.api_url}/pinning/pinFileToIPFS", data=form, headers=self.headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json(content_type=None))["IpfsHash"]
+
+class LocalNodeBackend:
+    def __init__(self, api_url: str):
+        self.api_url = api_url.rstrip("/")
+
+    async def pin(self, session: aiohttp.ClientSession, file_bytes: bytes, filename: str) -> str:
+        form = aiohttp.FormData()
+        form.add_field("file", file_bytes, filename=filename)
+        async with session.post(f"{self.api_url}/api/v0/add", params={"pin": "true"}, data=form) as resp:
+            resp.raise_for_status()
+            return (await resp.json(content_type=None))["Hash"]
+
+# ------------------------
+# Client
+# ------------------------
+class IPFSClient:
+    """
+    Keep-alive pooled IPFS client. Fetches race the configured sources with
+    hedging: the first source starts immediately, the next one joins after
+    `hedge_delay` seconds (or as soon as an earlier one fails), and the first
+    successful body wins while the rest are cancelled.
+    """
+
+    def __init__(self, sources: List[Any], pin_backend: Any, timeout: float = 10.0,
+                 retries: int = 2, backoff: float = 0.2, hedge_delay: float = 0.3,
+                 pool_size: int = 64, cache: Optional[CIDCache] = None):
+        if not sources:
+            raise ValueError("IPFSClient needs at least one fetch source.")
+        self.sources = sources
+        self.pin_backend = pin_backend
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_delay = hedge_delay
+        self.pool_size = pool_size
+        self.cache = cache
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_env(cls, pinata_api_key: Optional[str], pinata_secret_key: Optional[str]) -> "IPFSClient":
+        """
+        IPFS_GATEWAYS      comma-separated gateway base URLs (raced in order)
+        IPFS_LOCAL_NODE    Kubo RPC URL; fetched first and, with
+                           IPFS_PIN_BACKEND=local, used for pinning
+        PINATA_API_URL     override for the Pinata API (e.g. the stand-in server)
+        IPFS_TIMEOUT / IPFS_RETRIES / IPFS_HEDGE_DELAY
+        IPFS_CACHE_DIR     on-disk CID cache ("" disables the disk tier)
+        IPFS_CACHE_MEMORY_MB  in-process LRU budget
+        """
+        gateways = os.getenv("IPFS_GATEWAYS", "https://ipfs.io,https://gateway.pinata.cloud,https://dweb.link")
+        local_node = os.getenv("IPFS_LOCAL_NODE")
+        sources: List[Any] = [LocalNodeSource(local_node)] if local_node else []
+        sources += [GatewaySource(g.strip()) for g in gateways.split(",") if g.strip()]
+
+        if os.getenv("IPFS_PIN_BACKEND", "pinata").lower() == "local":
+            if not local_node:
+                raise RuntimeError("❌ IPFS_PIN_BACKEND=local requires IPFS_LOCAL_NODE.")
+            pin_backend = LocalNodeBackend(local_node)
+        else:
+            if not all([pinata_api_key, pinata_secret_key]):
+                raise RuntimeError("❌ Missing Pinata API keys. Check your .env file.")
+            pin_backend = PinataBackend(pinata_api_key, pinata_secret_key,
+                                        os.getenv("PINATA_API_URL", "https://api.pinata.cloud"))
+
+        return cls(
+            sources,
+            pin_backend,
+            timeout=float(os.getenv("IPFS_TIMEOUT", 10)),
+            retries=int(os.getenv("IPFS_RETRIES", 2)),
+            hedge_delay=float(os.getenv("IPFS_HEDGE_DELAY", 0.3)),
+            cache=CIDCache(
+                os.getenv("IPFS_CACHE_DIR", "ipfs_cache") or None,
+                int(float(os.getenv("IPFS_CACHE_MEMORY_MB", 64)) * 1024 * 1024),
+            ),
+        )
+
+    def gateway_url(self, cid: str) -> str:
+        """Public URL for a CID on the first HTTP gateway, for links in responses."""
+        for source in self.sources:
+            if isinstance(source, GatewaySource):
+                return source.public_url(cid)
+        return f"https://ipfs.io/ipfs/{cid}"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _with_retries(self, call) -> Optional[bytes]:
+        for attempt in range(self.retries + 1):
+            try:
+                return await call()
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        return None
+
+    async def _fetch_one(self, source: Any, cid: str) -> Optional[bytes]:
+        session = self._get_session()
+        body = await self._with_retries(lambda: source.fetch(session, cid))
+        if body is not None and verify_cid(cid, body) is False:
+            raise _ContentMismatch(f"{source.name} returned content that does not match {cid}")
+        return body
+
+    async def fetch_bytes(self, cid: str) -> Optional[bytes]:
+        if self.cache is not None:
+            cached = await self.cache.get_async(cid)
+            if cached is not None:
+                return cached
+        body = await self._race(cid)
+        if body is not None and self.cache is not None and verify_cid(cid, body):
+            await self.cache.put_async(cid, body)
+        return body
+
+    async def _race(self, cid: str) -> Optional[bytes]:
+        pending_sources = list(self.sources)
+        tasks = set()
+        errors = []
+        try:
+            while tasks or pending_sources:
+                if not tasks:
+                    tasks.add(asyncio.create_task(self._fetch_one(pending_sources.pop(0), cid)))
+                    continue
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=self.hedge_delay if pending_sources else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # Hedge: nobody has answered yet, bring in the next source.
+                    tasks.add(asyncio.create_task(self._fetch_one(pending_sources.pop(0), cid)))
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None and task.result() is not None:
+                        return task.result()
+                    errors.append(task.exception() or "not found")
+                if pending_sources:
+                    tasks.add(asyncio.create_task(self._fetch_one(pending_sources.pop(0), cid)))
+        finally:
+            for task in tasks:
+                task.cancel()
+        print(f"❌ IPFS fetch failed for {cid}: {errors}")
+        return None
+
+    async def fetch_json(self, cid: str) -> Optional[dict]:
+        body = await self.fetch_bytes(cid)
+        if body is None:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    async def upload(self, file_bytes: bytes, filename: str) -> Optional[str]:
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            try:
+                cid = await self.pin_backend.pin(session, file_bytes, filename)
+                if self.cache is not None and verify_cid(cid, file_bytes):
+                    await self.cache.put_async(cid, file_bytes)
+                return cid
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                client_error = isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429
+                if client_error or attempt == self.retries:
+                    print(f"❌ IPFS pin error: {e}")
+                    return None
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        return None
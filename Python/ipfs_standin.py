@@ -0,0 +1,108 @@
+# ipfs_standin.py
+"""
+Offline stand-in for the IPFS services the API talks to. One aiohttp server
+answers as a Pinata pinning API, a Kubo RPC node and a public gateway, all
+backed by an in-memory store keyed by real CIDv0s.
+
+    python ipfs_standin.py --port 8081 --latency 0.05
+
+then point the API at it:
+
+    IPFS_GATEWAYS=http://127.0.0.1:8081 PINATA_API_URL=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import random
+from datetime import datetime
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from ipfs_client import compute_cid_v0
+
+class IPFSStandIn:
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.blocks: Dict[str, bytes] = {}
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    def put(self, data: bytes) -> str:
+        cid = compute_cid_v0(data)
+        self.blocks[cid] = data
+        return cid
+
+    async def _delay_or_fail(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise web.HTTPServiceUnavailable(text="simulated gateway failure")
+
+    async def _read_upload(self, request: web.Request) -> bytes:
+        form = await request.post()
+        upload = form.get("file")
+        if upload is None:
+            raise web.HTTPBadRequest(text="missing 'file' field")
+        return upload.file.read()
+
+    async def handle_gateway(self, request: web.Request) -> web.Response:
+        await self._delay_or_fail()
+        data = self.blocks.get(request.match_info["cid"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    async def handle_cat(self, request: web.Request) -> web.Response:
+        await self._delay_or_fail()
+        data = self.blocks.get(request.query.get("arg", ""))
+        if data is None:
+            raise web.HTTPInternalServerError(text="block not found locally")
+        return web.Response(body=data)
+
+    async def handle_pinata(self, request: web.Request) -> web.Response:
+        await self._delay_or_fail()
+        data = await self._read_upload(request)
+        cid = self.put(data)
+        return web.json_response({"IpfsHash": cid, "PinSize": len(data), "Timestamp": datetime.utcnow().isoformat() + "Z"})
+
+    async def handle_add(self, request: web.Request) -> web.Response:
+        await self._delay_or_fail()
+        data = await self._read_upload(request)
+        cid = self.put(data)
+        return web.json_response({"Name": cid, "Hash": cid, "Size": str(len(data))})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/ipfs/{cid}", self.handle_gateway)
+        app.router.add_post("/api/v0/cat", self.handle_cat)
+        app.router.add_post("/api/v0/add", self.handle_add)
+        app.router.add_post("/pinning/pinFileToIPFS", self.handle_pinata)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving inside the running loop and returns the base URL."""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    standin = IPFSStandIn(latency=args.latency, fail_rate=args.fail_rate)
+    web.run_app(standin.make_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
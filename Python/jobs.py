@@ -0,0 +1,334 @@
+# jobs.py
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# ------------------------
+# Persistent job queue (SQLite)
+# ------------------------
+# Long-running operations are stored as jobs before any work starts. A job's
+# handler wraps each expensive side effect (pin, tx submission, receipt,
+# notification, embedded image, ...) in `job.step(name, fn)`, which records
+# the step's result as a checkpoint. If the process dies, its jobs are picked
+# up again and their handlers replay: finished steps return the checkpointed
+# value instead of running again.
+#
+# Several processes (uvicorn workers, a rolling restart) can share one queue.
+# A claimed job carries its owner and a lease that the owner's dispatcher
+# renews every few seconds; a "running" job is only taken over once its
+# lease has expired, i.e. its owner stopped heartbeating. Completion is
+# signalled in-process and also polled from the database, so a waiter sees a
+# job that another process ran.
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class JobFailed(Exception):
+    """Raised by a handler for errors that retrying cannot fix."""
+
+class Job:
+    def __init__(self, queue: "JobQueue", row: Dict[str, Any]):
+        self.queue = queue
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.params = row["params"]
+        self.checkpoints: Dict[str, Any] = queue._load_checkpoints(self.id)
+
+    async def step(self, name: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs fn() once per job; later replays return the checkpointed result."""
+        if name in self.checkpoints:
+            return self.checkpoints[name]
+        value = await fn()
+        self.queue._save_checkpoint(self.id, name, value)
+        self.checkpoints[name] = value
+        return value
+
+    def record(self, name: str, value: Any):
+        """Stores a checkpoint directly, e.g. ahead of a side effect a crash could leave half done."""
+        self.queue._save_checkpoint(self.id, name, value)
+        self.checkpoints[name] = value
+
+    def forget(self, name: str):
+        """Drops a checkpoint so the next replay runs that step again."""
+        self.queue._execute("DELETE FROM checkpoints WHERE job_id = ? AND step = ?", (self.id, name))
+        self.checkpoints.pop(name, None)
+
+class JobQueue:
+    def __init__(self, db_path: str, default_concurrency: int = 2, max_attempts: int = 3,
+                 retry_backoff: float = 5.0, poll_interval: float = 1.0, lease_seconds: float = 30.0):
+        self.db_path = db_path
+        self.default_concurrency = default_concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renewed_at = 0.0
+        self._handlers: Dict[str, Callable[[Job], Awaitable[Any]]] = {}
+        self._limits: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                idempotency_key TEXT UNIQUE,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, kind, not_before);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                job_id TEXT NOT NULL,
+                step TEXT NOT NULL,
+                value TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, step)
+            );
+        """)
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # Queues created before leases: every running job counts as expired.
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    # --- storage ---
+    def _execute(self, sql: str, args: Tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _row(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        row = dict(rows[0])
+        row["params"] = json.loads(row["params"])
+        row["result"] = json.loads(row["result"]) if row["result"] else None
+        return row
+
+    def _load_checkpoints(self, job_id: str) -> Dict[str, Any]:
+        rows = self._execute("SELECT step, value FROM checkpoints WHERE job_id = ? ORDER BY created_at", (job_id,))
+        return {r["step"]: json.loads(r["value"]) for r in rows}
+
+    def _save_checkpoint(self, job_id: str, step: str, value: Any):
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints (job_id, step, value, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, step, json.dumps(value), time.time())
+        )
+
+    def _set_status(self, job_id: str, status: str, **fields):
+        self._update(job_id, None, status, **fields)
+
+    def _update(self, job_id: str, held_by: Optional[str], status: str, **fields) -> bool:
+        cols = ["status = ?", "updated_at = ?"]
+        args = [status, time.time()]
+        for key, value in fields.items():
+            cols.append(f"{key} = ?")
+            args.append(json.dumps(value) if key == "result" else value)
+        sql = f"UPDATE jobs SET {', '.join(cols)} WHERE id = ?"
+        args.append(job_id)
+        if held_by is not None:
+            sql += " AND owner = ?"
+            args.append(held_by)
+        with self._lock:
+            return self._conn.execute(sql, tuple(args)).rowcount == 1
+
+    def _release(self, job_id: str, status: str, **fields):
+        """Ends this process's run of a job, unless its lease was lost to another process meanwhile."""
+        if not self._update(job_id, self.owner, status, owner=None, lease_until=0, **fields):
+            print(f"⚠ Job {job_id} was taken over by another worker; its outcome here is discarded")
+
+    # --- public API ---
+    def register(self, kind: str, handler: Callable[[Job], Awaitable[Any]], concurrency: Optional[int] = None):
+        self._handlers[kind] = handler
+        self._limits[kind] = concurrency or self.default_concurrency
+        self._running.setdefault(kind, 0)
+
+    def enqueue(self, kind: str, params: Dict[str, Any], idempotency_key: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """Adds a job. With an idempotency key already on file, returns that job instead. -> (job, created)
+
+        A failed job found by its key is queued again with its attempts reset;
+        its checkpoints are kept, so it resumes where it stopped.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'.")
+        if idempotency_key:
+            existing = self._resubmit(idempotency_key)
+            if existing is not None:
+                return existing, False
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            self._execute(
+                "INSERT INTO jobs (id, kind, idempotency_key, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, idempotency_key, QUEUED, json.dumps(params), now, now)
+            )
+        except sqlite3.IntegrityError:
+            # Lost a race with an identical request.
+            return self._resubmit(idempotency_key), False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self.get(job_id), True
+
+    def _resubmit(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,))
+        if not rows:
+            return None
+        job_id = rows[0]["id"]
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, not_before = 0, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, FAILED)
+            )
+        if cur.rowcount == 1:
+            print(f"⚠ Job {job_id} failed earlier; re-queued from its checkpoints")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id: str, include_params: bool = False) -> Optional[Dict[str, Any]]:
+        row = self._row(job_id)
+        if row is None:
+            return None
+        checkpoints = self._load_checkpoints(job_id)
+        return {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "error": row["error"],
+            "result": row["result"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+            "stepsCompleted": len(checkpoints),
+            "checkpoints": checkpoints,
+            **({"params": row["params"]} if include_params else {}),
+        }
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The job once it has finished. Raises asyncio.TimeoutError after `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in (SUCCEEDED, FAILED):
+                return job
+            # Woken at once if this process runs the job; otherwise the
+            # database is checked again every poll_interval.
+            step = self.poll_interval
+            if deadline is not None:
+                step = min(step, deadline - time.monotonic())
+                if step <= 0:
+                    raise asyncio.TimeoutError(f"Job {job_id} still {job['status']}")
+            event = self._waiters.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), step)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- workers ---
+    async def _run(self, row: Dict[str, Any]):
+        kind = row["kind"]
+        try:
+            job = Job(self, row)
+            result = await self._handlers[kind](job)
+            self._release(job.id, SUCCEEDED, result=result, error=None)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            if isinstance(e, JobFailed) or attempts >= self.max_attempts:
+                print(f"❌ Job {row['id']} ({kind}) failed: {e}")
+                self._release(row["id"], FAILED, attempts=attempts, error=str(e))
+            else:
+                print(f"⚠ Job {row['id']} ({kind}) attempt {attempts} failed, retrying: {e}")
+                self._release(row["id"], QUEUED, attempts=attempts, error=str(e),
+                              not_before=time.time() + self.retry_backoff * attempts)
+        finally:
+            self._running[kind] -= 1
+            event = self._waiters.get(row["id"])
+            job_row = self._row(row["id"])
+            if event is not None and job_row["status"] in (SUCCEEDED, FAILED):
+                self._waiters.pop(row["id"]).set()
+            self._wakeup.set()
+
+    def _claim(self, kind: str, limit: int):
+        # Queued jobs that are due, and running ones whose owner stopped renewing its lease.
+        now = time.time()
+        rows = self._execute(
+            "SELECT id, status FROM jobs WHERE kind = ? AND ((status = ? AND not_before <= ?) OR (status = ? AND lease_until < ?)) "
+            "ORDER BY created_at LIMIT ?",
+            (kind, QUEUED, now, RUNNING, now, limit)
+        )
+        claimed = []
+        for r in rows:
+            now = time.time()
+            with self._lock:
+                cur = self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ? AND (status = ? OR (status = ? AND lease_until < ?))",
+                    (RUNNING, self.owner, now + self.lease_seconds, now, r["id"], QUEUED, RUNNING, now)
+                )
+            if cur.rowcount == 1:
+                if r["status"] == RUNNING:
+                    print(f"⚠ Job {r['id']} ({kind}) lease expired; resuming it here")
+                claimed.append(self._row(r["id"]))
+        return claimed
+
+    def _renew_leases(self):
+        now = time.time()
+        if now - self._renewed_at < self.lease_seconds / 3:
+            return
+        self._renewed_at = now
+        self._execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                      (now + self.lease_seconds, self.owner, RUNNING))
+
+    async def _dispatch_forever(self):
+        while True:
+            self._wakeup.clear()
+            self._renew_leases()
+            for kind, limit in self._limits.items():
+                free = limit - self._running[kind]
+                if free <= 0:
+                    continue
+                for row in self._claim(kind, free):
+                    self._running[kind] += 1
+                    asyncio.create_task(self._run(row))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Starts dispatching. Jobs interrupted by a restart are resumed once their lease expires."""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,77 @@
+# multicall.py
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_abi import decode
+from eth_utils.abi import get_abi_output_types
+
+# ------------------------
+# Batched contract reads via Multicall3
+# ------------------------
+# Many view calls are packed into one eth_call to Multicall3.aggregate3,
+# deployed at the same address on Polygon, Amoy and most EVM chains. Each
+# sub-call's return data is decoded against our own contract ABI and shaped
+# like web3's .call() (a single output is returned bare, several as a list).
+# Without a Multicall3 deployment the calls fall back to one eth_call each.
+
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+MULTICALL3_ABI = [
+    {"inputs":[{"components":[{"internalType":"address","name":"target","type":"address"},{"internalType":"bool","name":"allowFailure","type":"bool"},{"internalType":"bytes","name":"callData","type":"bytes"}],"internalType":"struct Multicall3.Call3[]","name":"calls","type":"tuple[]"}],"name":"aggregate3","outputs":[{"components":[{"internalType":"bool","name":"success","type":"bool"},{"internalType":"bytes","name":"returnData","type":"bytes"}],"internalType":"struct Multicall3.Result[]","name":"returnData","type":"tuple[]"}],"stateMutability":"payable","type":"function"}
+]
+
+Call = Tuple[str, Tuple[Any, ...]]
+
+class MulticallError(Exception):
+    pass
+
+class Multicall:
+    def __init__(self, w3, contract, address: Optional[str] = MULTICALL3_ADDRESS, max_calls: int = 500):
+        self.w3 = w3
+        self.contract = contract
+        self.max_calls = max_calls
+        self._aggregator = None
+        if address:
+            self._aggregator = w3.eth.contract(address=w3.to_checksum_address(address), abi=MULTICALL3_ABI)
+        self._available: Optional[bool] = None
+        self._output_types: Dict[str, List[str]] = {
+            item["name"]: get_abi_output_types(item)
+            for item in contract.abi if item.get("type") == "function"
+        }
+        self.round_trips = 0
+
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = self._aggregator is not None and len(self.w3.eth.get_code(self._aggregator.address)) > 0
+            if not self._available:
+                print("⚠ Multicall3 not found on this chain; batched reads fall back to one call each.")
+        return self._available
+
+    def _decode(self, fn_name: str, data: bytes) -> Any:
+        values = decode(self._output_types[fn_name], data)
+        return values[0] if len(values) == 1 else list(values)
+
+    def call(self, calls: List[Call], block_identifier: Any = "latest") -> List[Any]:
+        """Runs every (fn_name, args) view call and returns the results in order."""
+        if not calls:
+            return []
+        if not self.available():
+            self.round_trips += len(calls)
+            return [
+                getattr(self.contract.functions, fn)(*args).call(block_identifier=block_identifier)
+                for fn, args in calls
+            ]
+
+        results: List[Any] = []
+        for start in range(0, len(calls), self.max_calls):
+            chunk = calls[start:start + self.max_calls]
+            packed = [
+                (self.contract.address, True, self.contract.encode_abi(fn, args=list(args)))
+                for fn, args in chunk
+            ]
+            self.round_trips += 1
+            raw = self._aggregator.functions.aggregate3(packed).call(block_identifier=block_identifier)
+            for (fn, args), (success, data) in zip(chunk, raw):
+                if not success:
+                    raise MulticallError(f"{fn}{args} reverted inside multicall")
+                results.append(self._decode(fn, data))
+        return results
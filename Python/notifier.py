@@ -0,0 +1,186 @@
+# notifier.py
+import asyncio
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# ------------------------
+# Push fan-out over Firestore + FCM
+# ------------------------
+# A recall can reach hundreds of thousands of users, so nothing here costs one
+# round trip per user or per token:
+#   - user docs are read with db.get_all() in chunks, projected to fcmToken;
+#   - tokens are deduplicated (a shared device appears once) and sent as FCM
+#     multicasts of up to 500;
+#   - tokens FCM reports as unregistered (or issued to another sender) are
+#     removed from their user docs with batched writes, so the next fan-out
+#     doesn't pay for them again. Each delete is conditional on the doc being
+#     unchanged since it was read, so a token refreshed meanwhile is kept;
+#   - only tokens FCM reported as failed are resent. A multicast call that
+#     raises may have delivered part of its group, so it is not repeated.
+# All SDK calls are blocking and run in threads, at most `concurrency` of
+# them at a time across everything the notifier is doing. The Firestore client and
+# the messaging module are passed in, so the Firestore emulator
+# (FIRESTORE_EMULATOR_HOST) or notify_standin's fakes can take their place.
+
+FCM_MULTICAST_LIMIT = 500      # tokens per send_each_for_multicast call
+FIRESTORE_WRITE_LIMIT = 500    # writes per batch commit
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class Notifier:
+    def __init__(self, db, messaging, field_filter: Callable[[str, str, Any], Any], delete_field: Any,
+                 read_chunk: int = 300, concurrency: int = 8, send_retries: int = 2):
+        self.db = db
+        self.messaging = messaging
+        self.field_filter = field_filter
+        self.delete_field = delete_field
+        self.read_chunk = read_chunk
+        self.concurrency = concurrency
+        self.send_retries = send_retries
+        self._slots = asyncio.Semaphore(concurrency)
+        # firebase-admin < 6.2 only has the batch-endpoint send_multicast.
+        self._send_multicast = getattr(messaging, "send_each_for_multicast", None) or messaging.send_multicast
+        self._prune_errors = tuple(getattr(messaging, name) for name in ("UnregisteredError", "SenderIdMismatchError")
+                                   if hasattr(messaging, name))
+        self.totals = {"fanOuts": 0, "users": 0, "tokens": 0, "sent": 0, "failed": 0, "pruned": 0, "multicasts": 0}
+
+    # --- Firestore ---
+    def user_ids_for_batch(self, batch_id: str) -> List[str]:
+        """Distinct owners of scans from one batch (the query reads only userId)."""
+        query = self.db.collection("scans").where(filter=self.field_filter("batchNumber", "==", batch_id))
+        user_ids = {}
+        for doc in query.select(["userId"]).stream():
+            user_id = (doc.to_dict() or {}).get("userId")
+            if user_id:
+                user_ids[user_id] = True
+        return list(user_ids)
+
+    def _read_tokens(self, user_ids: List[str]) -> List[Tuple[str, str]]:
+        users = self.db.collection("users")
+        refs = [users.document(user_id) for user_id in user_ids]
+        pairs = []
+        for snap in self.db.get_all(refs, field_paths=["fcmToken"]):
+            if snap.exists:
+                token = (snap.to_dict() or {}).get("fcmToken")
+                if token:
+                    pairs.append((snap.id, token))
+        return pairs
+
+    async def resolve_tokens(self, user_ids: List[str]) -> Dict[str, List[str]]:
+        """token -> the users holding it, read in chunks of `read_chunk` docs."""
+        async def read(chunk):
+            async with self._slots:
+                return await asyncio.to_thread(self._read_tokens, chunk)
+        owners: Dict[str, List[str]] = {}
+        for pairs in await asyncio.gather(*(read(c) for c in _chunks(user_ids, self.read_chunk))):
+            for user_id, token in pairs:
+                owners.setdefault(token, []).append(user_id)
+        return owners
+
+    def _prune(self, dead: Dict[str, str]) -> int:
+        """Removes fcmToken from the users in `dead` (user -> dead token) that still hold that token."""
+        users = self.db.collection("users")
+        pruned = 0
+        for chunk in _chunks(list(dead), FIRESTORE_WRITE_LIMIT):
+            # The batch is atomic, so one user refreshing their token between
+            # the read and the commit fails the whole precondition check; the
+            # chunk is then read again and retried once.
+            for attempt in range(2):
+                snaps = self.db.get_all([users.document(user_id) for user_id in chunk], field_paths=["fcmToken"])
+                stale = [snap for snap in snaps
+                         if snap.exists and (snap.to_dict() or {}).get("fcmToken") == dead[snap.id]]
+                if not stale:
+                    break
+                batch = self.db.batch()
+                for snap in stale:
+                    batch.update(users.document(snap.id), {"fcmToken": self.delete_field},
+                                 option=self.db.write_option(last_update_time=snap.update_time))
+                try:
+                    batch.commit()
+                except Exception:
+                    if attempt:
+                        raise
+                    continue
+                pruned += len(stale)
+                break
+        return pruned
+
+    # --- FCM ---
+    def _send_group(self, tokens: List[str], title: str, body: str,
+                    data: Dict[str, str]) -> Tuple[int, List[str], List[str]]:
+        """Returns (delivered, dead tokens, tokens that failed for another reason)."""
+        message = self.messaging.MulticastMessage(
+            tokens=tokens,
+            notification=self.messaging.Notification(title=title, body=body),
+            data=data,
+        )
+        response = self._send_multicast(message)
+        dead, failed = [], []
+        for token, r in zip(tokens, response.responses):
+            if not r.success:
+                (dead if isinstance(r.exception, self._prune_errors) else failed).append(token)
+        return response.success_count, dead, failed
+
+    async def fan_out(self, user_ids: List[str], title: str, body: str,
+                      data: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Sends one notification to every token held by `user_ids`. Returns delivery metrics."""
+        t0 = time.perf_counter()
+        user_ids = list(dict.fromkeys(user_ids))
+        owners = await self.resolve_tokens(user_ids)
+        metrics = {"users": len(user_ids), **await self.deliver(owners, title, body, data)}
+        metrics["elapsedMs"] = round((time.perf_counter() - t0) * 1000, 1)
+        self.totals["fanOuts"] += 1
+        self.totals["users"] += len(user_ids)
+        return metrics
+
+    async def deliver(self, owners: Dict[str, List[str]], title: str, body: str,
+                      data: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Multicasts to the tokens of an already resolved token -> users map and prunes dead ones."""
+        tokens = list(owners)
+        groups = list(_chunks(tokens, FCM_MULTICAST_LIMIT))
+
+        async def send(group):
+            # Retries resend only the tokens FCM answered with a failure. A call
+            # that raises is not repeated: send_each_for_multicast sends one
+            # request per token, so part of the group may already have the
+            # notification and a resend would duplicate it.
+            sent, dead, todo = 0, [], group
+            for attempt in range(self.send_retries + 1):
+                try:
+                    async with self._slots:
+                        ok, gone, todo = await asyncio.to_thread(self._send_group, todo, title, body, data or {})
+                except Exception as e:
+                    print(f"❌ FCM multicast of {len(todo)} tokens failed: {e}")
+                    break
+                sent += ok
+                dead += gone
+                if not todo or attempt == self.send_retries:
+                    break
+                await asyncio.sleep(2 ** attempt)
+            return sent, dead
+        results = await asyncio.gather(*(send(g) for g in groups))
+
+        sent = sum(ok for ok, _ in results)
+        dead_users = {u: token for _, dead in results for token in dead for u in owners[token]}
+        pruned = 0
+        if dead_users:
+            try:
+                pruned = await asyncio.to_thread(self._prune, dead_users)
+            except Exception as e:
+                print(f"⚠ Pruning {len(dead_users)} stale FCM tokens failed: {e}")
+
+        metrics = {
+            "tokens": len(tokens),
+            "sent": sent,
+            "failed": len(tokens) - sent,
+            "pruned": pruned,
+            "multicasts": len(groups),
+        }
+        for key, value in metrics.items():
+            self.totals[key] += value
+        return metrics
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.totals)
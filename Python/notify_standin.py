@@ -0,0 +1,278 @@
+# notify_standin.py
+"""
+Offline stand-ins for the Firestore and FCM calls notifier.Notifier makes,
+for load-testing a fan-out without a Firebase project. FakeFirestore keeps
+collections in memory and answers the subset of the client API the notifier
+uses, including the last_update_time precondition on writes. FakeMessaging answers send_each_for_multicast after a simulated
+round trip, reports a chosen set of tokens as unregistered and can fail
+others once with a transient error. The Firestore
+emulator (FIRESTORE_EMULATOR_HOST) works in place of FakeFirestore.
+
+    python notify_standin.py --users 200000 --shared 0.05 --stale 0.02 --latency 0.15
+
+simulates a recall reaching every user and prints the delivery metrics.
+"""
+import argparse
+import asyncio
+import operator
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from notifier import Notifier
+
+DELETE_FIELD = object()
+
+# ------------------------
+# Firestore
+# ------------------------
+_OPS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+class FieldFilter:
+    def __init__(self, field_path: str, op_string: str, value: Any):
+        if op_string not in _OPS:
+            raise NotImplementedError(op_string)
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+    def matches(self, data: Dict[str, Any]) -> bool:
+        # Like Firestore, a range only matches values of the same type.
+        if self.field_path not in data:
+            return False
+        value = data[self.field_path]
+        if self.op_string != "==" and type(value) is not type(self.value):
+            return False
+        return _OPS[self.op_string](value, self.value)
+
+class FailedPrecondition(Exception):
+    pass
+
+class _WriteOption:
+    def __init__(self, last_update_time: Any):
+        self.last_update_time = last_update_time
+
+class _Snapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]], update_time: Any = None):
+        self.id = doc_id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return None if self._data is None else dict(self._data)
+
+class _DocumentRef:
+    def __init__(self, collection: "_Collection", doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data: Dict[str, Any]):
+        self.collection.db.writes += 1
+        self.collection.docs[self.id] = dict(data)
+        self.collection.touch(self.id)
+
+class _Query:
+    def __init__(self, collection: "_Collection", filters: List[FieldFilter], fields: Optional[List[str]] = None):
+        self.collection = collection
+        self.filters = filters
+        self.fields = fields
+
+    def where(self, filter: FieldFilter) -> "_Query":
+        return _Query(self.collection, self.filters + [filter], self.fields)
+
+    def select(self, field_paths: List[str]) -> "_Query":
+        return _Query(self.collection, self.filters, list(field_paths))
+
+    def stream(self):
+        self.collection.db.reads += 1
+        time.sleep(self.collection.db.latency)
+        for doc_id, data in list(self.collection.docs.items()):
+            if all(f.matches(data) for f in self.filters):
+                self.collection.db.docs_read += 1
+                if self.fields is not None:
+                    data = {k: data[k] for k in self.fields if k in data}
+                yield _Snapshot(doc_id, data, self.collection.update_times.get(doc_id, 0))
+
+class _Collection(_Query):
+    def __init__(self, db: "FakeFirestore", name: str):
+        self.db = db
+        self.name = name
+        # Docs assigned here directly keep update time 0; writes through
+        # set() or a batch advance it.
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.update_times: Dict[str, int] = {}
+        super().__init__(self, [])
+
+    def document(self, doc_id: str) -> _DocumentRef:
+        return _DocumentRef(self, doc_id)
+
+    def touch(self, doc_id: str):
+        self.db.clock += 1
+        self.update_times[doc_id] = self.db.clock
+
+class _WriteBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self.db = db
+        self.updates = []
+
+    def update(self, ref: _DocumentRef, fields: Dict[str, Any], option: Optional[_WriteOption] = None):
+        self.updates.append((ref, fields, option))
+
+    def commit(self):
+        if len(self.updates) > 500:
+            raise ValueError("maximum 500 writes allowed per request")
+        self.db.writes += 1
+        # All or nothing, like Firestore: check every precondition first.
+        for ref, _, option in self.updates:
+            if ref.id not in ref.collection.docs:
+                raise FailedPrecondition(f"No document to update: {ref.id}")
+            if option is not None and ref.collection.update_times.get(ref.id, 0) != option.last_update_time:
+                raise FailedPrecondition(f"{ref.id} was updated after {option.last_update_time}")
+        for ref, fields, _ in self.updates:
+            data = ref.collection.docs[ref.id]
+            for key, value in fields.items():
+                if value is DELETE_FIELD:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+            ref.collection.touch(ref.id)
+
+class FakeFirestore:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections: Dict[str, _Collection] = {}
+        self.reads = 0
+        self.docs_read = 0
+        self.writes = 0
+        self.clock = 0
+
+    def collection(self, name: str) -> _Collection:
+        if name not in self.collections:
+            self.collections[name] = _Collection(self, name)
+        return self.collections[name]
+
+    def get_all(self, references: List[_DocumentRef], field_paths: Optional[List[str]] = None):
+        self.reads += 1
+        time.sleep(self.latency)
+        for ref in references:
+            self.docs_read += 1
+            data = ref.collection.docs.get(ref.id)
+            if data is not None and field_paths is not None:
+                data = {k: data[k] for k in field_paths if k in data}
+            yield _Snapshot(ref.id, data, ref.collection.update_times.get(ref.id, 0))
+
+    def batch(self) -> _WriteBatch:
+        return _WriteBatch(self)
+
+    def write_option(self, last_update_time: Any) -> _WriteOption:
+        return _WriteOption(last_update_time)
+
+# ------------------------
+# FCM
+# ------------------------
+class UnregisteredError(Exception):
+    pass
+
+class SenderIdMismatchError(Exception):
+    pass
+
+class UnavailableError(Exception):
+    pass
+
+class Notification:
+    def __init__(self, title: Optional[str] = None, body: Optional[str] = None):
+        self.title = title
+        self.body = body
+
+class MulticastMessage:
+    def __init__(self, tokens: List[str], notification: Optional[Notification] = None,
+                 data: Optional[Dict[str, str]] = None):
+        if len(tokens) > 500:
+            raise ValueError("tokens must not contain more than 500 elements")
+        self.tokens = tokens
+        self.notification = notification
+        self.data = data
+
+class _SendResponse:
+    def __init__(self, exception: Optional[Exception]):
+        self.success = exception is None
+        self.exception = exception
+
+class _BatchResponse:
+    def __init__(self, responses: List[_SendResponse]):
+        self.responses = responses
+        self.success_count = sum(r.success for r in responses)
+        self.failure_count = len(responses) - self.success_count
+
+class FakeMessaging:
+    UnregisteredError = UnregisteredError
+    SenderIdMismatchError = SenderIdMismatchError
+    UnavailableError = UnavailableError
+    Notification = Notification
+    MulticastMessage = MulticastMessage
+
+    def __init__(self, latency: float = 0.0, stale_tokens: Optional[Set[str]] = None,
+                 flaky_tokens: Optional[Set[str]] = None):
+        self.latency = latency
+        self.stale_tokens = stale_tokens or set()
+        self.flaky_tokens = set(flaky_tokens or ())
+        self.calls = 0
+        self.delivered: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def send_each_for_multicast(self, message: MulticastMessage) -> _BatchResponse:
+        time.sleep(self.latency)
+        responses = []
+        with self._lock:
+            self.calls += 1
+            for token in message.tokens:
+                if token in self.stale_tokens:
+                    responses.append(_SendResponse(UnregisteredError("Requested entity was not found.")))
+                elif token in self.flaky_tokens:
+                    self.flaky_tokens.discard(token)
+                    responses.append(_SendResponse(UnavailableError("The service is currently unavailable.")))
+                else:
+                    self.delivered[token] = self.delivered.get(token, 0) + 1
+                    responses.append(_SendResponse(None))
+        return _BatchResponse(responses)
+
+# ------------------------
+# Recall simulation
+# ------------------------
+async def _simulate(args):
+    db = FakeFirestore(latency=args.latency)
+    users, scans = db.collection("users"), db.collection("scans")
+    stale = set()
+    for i in range(args.users):
+        # Every 1/shared-th user shares the previous user's device.
+        shared = args.shared and i % round(1 / args.shared) == 1
+        token = f"token-{i - 1 if shared else i}"
+        users.docs[f"user-{i}"] = {"fcmToken": token, "name": f"User {i}"}
+        scans.docs[f"scan-{i}"] = {"userId": f"user-{i}", "batchNumber": "RECALL-1", "productName": "x"}
+        if args.stale and i % round(1 / args.stale) == 0:
+            stale.add(token)
+    messaging = FakeMessaging(latency=args.latency, stale_tokens=stale)
+    notifier = Notifier(db, messaging, FieldFilter, DELETE_FIELD, concurrency=args.concurrency)
+
+    t0 = time.perf_counter()
+    user_ids = notifier.user_ids_for_batch("RECALL-1")
+    metrics = await notifier.fan_out(user_ids, "Recall", "Batch RECALL-1 has been recalled.", {"batchId": "RECALL-1"})
+    print(f"scan query {len(user_ids)} users, total {time.perf_counter() - t0:.2f}s")
+    print(metrics)
+    print(f"firestore queries {db.reads} ({db.docs_read} docs), write batches {db.writes}, fcm calls {messaging.calls}, "
+          f"max deliveries per token {max(messaging.delivered.values(), default=0)}")
+    left = sum(1 for d in users.docs.values() if "fcmToken" in d and d["fcmToken"] in stale)
+    print(f"stale tokens left on user docs: {left}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--shared", type=float, default=0.05, help="fraction of users sharing a device token")
+    parser.add_argument("--stale", type=float, default=0.02, help="fraction of tokens FCM reports unregistered")
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds per Firestore/FCM call")
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(_simulate(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# offload.py
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from fastapi import HTTPException
+
+# ------------------------
+# Managed executor for CPU-bound request stages
+# ------------------------
+# cv2, NumPy and pywt release the GIL for the heavy parts, so a thread pool
+# is enough to keep the event loop free for cheap endpoints while image work
+# is in flight. Admission is bounded: once `workers + max_queue` stages are
+# running or waiting, new stages are rejected with 429 instead of piling up.
+
+_TIMING_WINDOW = 512  # recent samples kept per stage for percentiles
+
+class _StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=_TIMING_WINDOW)
+        self.recent_wait = deque(maxlen=_TIMING_WINDOW)
+
+    def record(self, run_ms: float, wait_ms: float, ok: bool):
+        self.count += 1
+        self.errors += 0 if ok else 1
+        self.total_ms += run_ms
+        self.max_ms = max(self.max_ms, run_ms)
+        self.recent.append(run_ms)
+        self.recent_wait.append(wait_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        run = sorted(self.recent)
+        wait = sorted(self.recent_wait)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": _percentile(run, 50),
+            "p95_ms": _percentile(run, 95),
+            "p99_ms": _percentile(run, 99),
+            "queue_wait_p95_ms": _percentile(wait, 95),
+        }
+
+def _percentile(sorted_vals, pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(pct / 100.0 * (len(sorted_vals) - 1))))
+    return round(sorted_vals[idx], 3)
+
+class StageExecutor:
+    def __init__(self, workers: int, max_queue: int, name: str = "offload"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        self._stats: Dict[str, _StageStats] = {}
+
+    async def run(self, stage: str, fn: Callable, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the pool, timing it under `stage`. Raises 429 when saturated."""
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Server is busy processing images. Retry shortly.",
+                    headers={"Retry-After": "1"},
+                )
+            self._in_flight += 1
+
+        submitted = time.perf_counter()
+        started = [submitted]
+
+        def timed_call():
+            started[0] = time.perf_counter()
+            return fn(*args, **kwargs)
+
+        ok = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool, timed_call)
+            ok = True
+            return result
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._in_flight -= 1
+                stats = self._stats.setdefault(stage, _StageStats())
+                stats.record((finished - started[0]) * 1000, (started[0] - submitted) * 1000, ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "maxQueue": self.max_queue,
+                "inFlight": self._in_flight,
+                "rejected": self.rejected,
+                "stages": {name: s.snapshot() for name, s in sorted(self._stats.items())},
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,292 @@
+# qc_ingest.py
+import csv
+import io
+import json
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+try:
+    import openpyxl
+    _OPENPYXL_OK = True
+except Exception:
+    _OPENPYXL_OK = False
+try:
+    import pandas as pd
+    _PANDAS_OK = True
+except Exception:
+    _PANDAS_OK = False
+
+# ------------------------
+# Streaming QC file ingest
+# ------------------------
+# A QC upload only contributes two fields per row: the batch and its
+# pass/fail result. For CSV and XLSX the columns that hold them are worked out
+# once from the header (QCSchema), then each row is read straight from those
+# cells as the file streams past: a CSV reader over the spooled upload, or a
+# read-only openpyxl sheet. Rows are folded into per-batch results (QCSummary)
+# and, when a document writer is given, appended to the QC JSON that gets
+# pinned, so nothing grows with the row count except that file on disk.
+#
+# JSON uploads are parsed whole (rows may nest qcResults objects, and there
+# is no incremental JSON parser among the dependencies), then normalized row
+# by row as before. Legacy .xls needs pandas + xlrd and is read whole too.
+
+class QCRowError(ValueError):
+    """A row without a batch or result (reported as is, not as an unreadable file)."""
+
+QC_KEY_MAP = {
+    "productBatch": "productBatch",
+    "product_batch": "productBatch",
+    "Batch ID": "productBatch",
+    "BatchId": "productBatch",
+    "Batch": "productBatch",
+    "batch_id": "productBatch",
+    "status": "PassFail",
+    "PassFail": "PassFail",
+    "Pass/Fail": "PassFail",
+    "Result": "PassFail",
+    "isStandard": "PassFail"
+}
+
+def normalize_passfail(val: Any) -> str:
+    s = str(val).strip().upper()
+    s = s.replace("✅", "").replace("❌", "").strip()
+    if s in ["PASS", "P", "OK", "TRUE", "1", "YES", "Y"]:
+        return "PASS"
+    return "FAIL" if s in ["FAIL", "F", "NO", "N", "0", "FALSE"] else s
+
+def normalize_qc_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps one JSON row to {productBatch, PassFail}, reading nested qcResults objects."""
+    normalized = {}
+    for k, v in item.items():
+        if k in QC_KEY_MAP:
+            nk = QC_KEY_MAP[k]
+            normalized[nk] = v
+        if k == "qcResults" and isinstance(v, dict):
+            if "Pass" in v.values() or "pass" in v.values():
+                normalized["PassFail"] = "PASS"
+            if "Fail" in v.values() or "fail" in v.values():
+                normalized["PassFail"] = "FAIL"
+    for key, val in item.items():
+        if isinstance(val, dict):
+            if "qcResults" in val and isinstance(val["qcResults"], dict):
+                if any(x.lower() == "fail" for x in val["qcResults"].values()):
+                    normalized["PassFail"] = "FAIL"
+                    break
+                elif any(x.lower() == "pass" for x in val["qcResults"].values()):
+                    if "PassFail" not in normalized or normalized["PassFail"] != "FAIL":
+                        normalized["PassFail"] = "PASS"
+    return normalized
+
+class QCSchema:
+    """Column positions of productBatch / PassFail for one header, resolved once.
+
+    Like the per-row mapping, the last matching column wins and the output
+    keys come in the order their first column appears.
+    """
+
+    def __init__(self, header: List[Any]):
+        self.columns: Dict[str, int] = {}
+        self.order: List[str] = []
+        for idx, name in enumerate(header):
+            target = QC_KEY_MAP.get(name.strip() if isinstance(name, str) else name)
+            if target is None:
+                continue
+            if target not in self.columns:
+                self.order.append(target)
+            self.columns[target] = idx
+
+    def missing(self) -> Optional[str]:
+        for key in ("productBatch", "PassFail"):
+            if key not in self.columns:
+                return key
+        return None
+
+    def row(self, cells: List[Any]) -> Tuple[Any, Any]:
+        """(batch, raw pass/fail) from a row's cells; cells past a short row's end read as None."""
+        values = [cells[self.columns[key]] if self.columns[key] < len(cells) else None
+                  for key in ("productBatch", "PassFail")]
+        return values[0], values[1]
+
+class QCSummary:
+    """Per-batch results folded in row by row: a batch is standard only if every row passed."""
+
+    def __init__(self):
+        self.rows = 0
+        self.batches: Dict[Any, Dict[str, int]] = {}
+
+    def add(self, batch: Any, passfail: str):
+        counts = self.batches.get(batch)
+        if counts is None:
+            counts = self.batches[batch] = {"rows": 0, "failed": 0}
+        counts["rows"] += 1
+        if passfail != "PASS":
+            counts["failed"] += 1
+        self.rows += 1
+
+    def is_standard(self, batch: Any) -> bool:
+        return self.batches[batch]["failed"] == 0
+
+    def batch_results(self) -> List[List[Any]]:
+        """[[batch, isStandard], ...] sorted by batch."""
+        return [[batch, self.is_standard(batch)] for batch in sorted(self.batches)]
+
+class QCDocumentWriter:
+    """Writes the pinned QC JSON a row at a time, byte-identical to json.dumps(doc, indent=2)."""
+
+    def __init__(self, fh: TextIO, meta: Dict[str, Any]):
+        self._fh = fh
+        self._first = True
+        self._templates: Dict[Tuple[str, ...], str] = {}
+        self._encoded: Dict[Any, str] = {}
+        fh.write('{\n  "meta": ' + json.dumps(meta, indent=2).replace("\n", "\n  ") + ',\n  "qc": [')
+
+    def _template(self, keys: Tuple[str, ...]) -> str:
+        template = self._templates.get(keys)
+        if template is None:
+            fields = ",\n".join(f"      {json.dumps(k)}: {{}}" for k in keys)
+            template = self._templates[keys] = "    {{\n" + fields + "\n    }}"
+        return template
+
+    def _encode(self, value: Any) -> str:
+        # Batch ids and results repeat row after row; encode each once.
+        encoded = self._encoded.get(value)
+        if encoded is None:
+            encoded = json.dumps(value)
+            if len(self._encoded) < 65536:
+                self._encoded[value] = encoded
+        return encoded
+
+    def write(self, keys: Tuple[str, ...], values: Tuple[Any, ...]):
+        sep = "\n" if self._first else ",\n"
+        self._first = False
+        self._fh.write(sep + self._template(keys).format(*map(self._encode, values)))
+
+    def write_item(self, item: Dict[str, Any]):
+        self._fh.write("\n" if self._first else ",\n")
+        self._first = False
+        self._fh.write("    " + json.dumps(item, indent=2).replace("\n", "\n    "))
+
+    def close(self):
+        self._fh.write("]\n}" if self._first else "\n  ]\n}")
+
+# ------------------------
+# Row readers
+# ------------------------
+def _iter_csv(stream: BinaryIO) -> Iterator[List[Any]]:
+    # detach() so the wrapper doesn't close the caller's upload file.
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        for cells in csv.reader(text):
+            if cells:
+                yield cells
+    finally:
+        text.detach()
+
+def _xlsx_cell(value: Any) -> Any:
+    # Batch ids typed as numbers come back as float; keep them as the digits shown.
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+def _iter_xlsx(stream: BinaryIO) -> Iterator[List[Any]]:
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for values in sheet.iter_rows(values_only=True):
+            if all(v is None for v in values):
+                continue
+            yield [_xlsx_cell(v) for v in values]
+    finally:
+        workbook.close()
+
+def _iter_xls(stream: BinaryIO) -> Iterator[List[Any]]:
+    df = pd.read_excel(stream)
+    yield list(df.columns)
+    for record in df.itertuples(index=False):
+        yield [None if v != v else _xlsx_cell(v) for v in record]
+
+def _tabular_kind(lower: str) -> Optional[str]:
+    if lower.endswith(".csv"):
+        return "CSV"
+    if lower.endswith(".xlsx") or lower.endswith(".xls"):
+        return "Excel"
+    return None
+
+# ------------------------
+# Entry point
+# ------------------------
+def parse_qc_stream(stream: BinaryIO, filename: str,
+                    document: Optional[QCDocumentWriter] = None) -> QCSummary:
+    """Reads a QC upload (JSON, CSV, XLSX) row by row into a QCSummary.
+
+    Raises ValueError with a client-facing message for unreadable files and
+    rows without a batch or result.
+    """
+    lower = (filename or "").lower()
+    summary = QCSummary()
+
+    if lower.endswith(".json"):
+        text = io.TextIOWrapper(stream, encoding="utf-8")
+        try:
+            data = json.load(text)
+            if isinstance(data, dict) and "qcSubmissions" in data:
+                data = data["qcSubmissions"]
+            if isinstance(data, dict):
+                data = [data]
+            if not isinstance(data, list):
+                raise ValueError("JSON must be an array or object.")
+            items = [normalize_qc_item(r) for r in data]
+        except Exception as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        finally:
+            text.detach()
+        for idx, item in enumerate(items):
+            for key in ("productBatch", "PassFail"):
+                if key not in item:
+                    raise ValueError(f"Row {idx} missing key '{key}' after normalization.")
+            item["PassFail"] = normalize_passfail(item["PassFail"])
+            summary.add(item["productBatch"], item["PassFail"])
+            if document is not None:
+                document.write_item(item)
+        return summary
+
+    kind = _tabular_kind(lower)
+    if kind is None:
+        raise ValueError("Unsupported file type. Upload JSON, CSV, or XLSX.")
+    if lower.endswith(".xlsx") and _OPENPYXL_OK:
+        rows = _iter_xlsx(stream)
+    elif kind == "Excel":
+        if not _PANDAS_OK:
+            raise ValueError("XLS/XLSX provided but neither openpyxl nor pandas is installed on server.")
+        rows = _iter_xls(stream)
+    else:
+        rows = _iter_csv(stream)
+
+    schema: Optional[QCSchema] = None
+    missing: Optional[str] = None
+    batch_first = True
+    idx = 0
+    try:
+        for cells in rows:
+            if schema is None:
+                schema = QCSchema(cells)
+                missing = schema.missing()
+                batch_first = schema.order[:1] == ["productBatch"]
+                continue
+            if missing:
+                raise QCRowError(f"Row {idx} missing key '{missing}' after normalization.")
+            batch, passfail = schema.row(cells)
+            if batch is None:
+                raise QCRowError(f"Row {idx} missing key 'productBatch' after normalization.")
+            passfail = normalize_passfail(passfail)
+            summary.add(batch, passfail)
+            if document is not None:
+                document.write(tuple(schema.order), (batch, passfail) if batch_first else (passfail, batch))
+            idx += 1
+    except QCRowError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid {kind}: {e}")
+    return summary
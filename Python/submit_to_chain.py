@@ -1,33 +1,42 @@
 # submit_to_chain.py
 import io
+import itertools
 import hashlib
+import ipaddress
 import os
 import json
 import secrets
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+import asyncio
+import socket
+import time
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+from urllib.parse import urlparse
 
-import requests
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, Body
 from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from web3 import Web3
 from dotenv import load_dotenv
+from ipfs_client import IPFSClient
+from chain_cache import ContractReadCache
+from chain_indexer import ChainIndexer, parse_cursor
+from multicall import Multicall, MULTICALL3_ADDRESS
+from tx_pipeline import TxPipeline, CONFIRMED, FAILED, DROPPED, STUCK
+from jobs import JobQueue, JobFailed, FAILED as JOB_FAILED
+from verify_cache import VerifyCache, image_digest, batch_tag, product_tag
+from qc_ingest import QCDocumentWriter, QCSummary, parse_qc_stream
+from notifier import Notifier
+from expiry_alerts import ExpiryAlerts
 
 # --- All Imports at the top ---
 from fastapi.middleware.cors import CORSMiddleware
 import cv2
 import numpy as np
-import pywt
-from reedsolo import RSCodec, ReedSolomonError
-from collections import Counter
 import csv
-from io import StringIO, BytesIO
-try:
-    import pandas as pd
-    _PANDAS_OK = True
-except Exception:
-    _PANDAS_OK = False
 try:
     import firebase_admin
     from firebase_admin import credentials, messaging, firestore
@@ -49,12 +58,18 @@ account_address = os.getenv("PUBLIC_ADDRESS")
 contract_address = os.getenv("CONTRACT_ADDRESS")
 chain_id = int(os.getenv("CHAIN_ID", 80002))
 
-# --- Robust Watermarking Configuration ---
-ECC_BYTES = 32
-Q = 40.0
-WAVELET = 'haar'
-DWT_LEVEL = 2
-PAYLOAD_BIT_LENGTH = (32 + ECC_BYTES) * 8
+# --- Batch Embedding Configuration ---
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", os.cpu_count() or 1))
+
+# --- Watermark Profile Configuration ---
+# A name from watermark.PROFILES, or "auto" to let plan_profile pick per image
+# (optionally within WATERMARK_TIME_BUDGET_MS of embed + self-check time).
+WATERMARK_PROFILE = os.getenv("WATERMARK_PROFILE", "standard")
+WATERMARK_TIME_BUDGET_MS = float(os.getenv("WATERMARK_TIME_BUDGET_MS", 0)) or None
+
+# --- Request Offload Configuration ---
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", os.cpu_count() or 1))
+OFFLOAD_MAX_QUEUE = int(os.getenv("OFFLOAD_MAX_QUEUE", OFFLOAD_WORKERS * 4))
 
 # Create the FastAPI application instance
 app = FastAPI(title="AuthentiChain IPFS & Blockchain API")
@@ -77,41 +92,24 @@ if not w3.is_connected():
 contract_address = Web3.to_checksum_address(contract_address)
 
 # ------------------------
-# Embedded IPFS uploader (Pinata)
+# IPFS client (Pinata or local node pinning, hedged gateway fetches)
 # ------------------------
 PINATA_API_KEY = os.getenv("PINATA_API_KEY")
 PINATA_SECRET_KEY = os.getenv("PINATA_SECRET_KEY")
 
-if not all([PINATA_API_KEY, PINATA_SECRET_KEY]):
-    raise RuntimeError("❌ Missing Pinata API keys. Check your .env file.")
+ipfs = IPFSClient.from_env(PINATA_API_KEY, PINATA_SECRET_KEY)
 
-def upload_to_ipfs(file_bytes: bytes, filename: str) -> str:
-    url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-    headers = {
-        "pinata_api_key": PINATA_API_KEY,
-        "pinata_secret_api_key": PINATA_SECRET_KEY
-    }
-    files = {"file": (filename, file_bytes)}
-    try:
-        resp = requests.post(url, files=files, headers=headers)
-        resp.raise_for_status()
-        return resp.json()["IpfsHash"]
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Pinata error: {e}")
-        return None
+async def upload_to_ipfs(file_bytes: bytes, filename: str) -> Optional[str]:
+    return await ipfs.upload(file_bytes, filename)
 
-def fetch_from_ipfs(cid: str) -> dict:
-    """Fetches JSON data from a public IPFS gateway using the CID."""
-    gateway_url = f"https://ipfs.io/ipfs/{cid}"
-    try:
-        resp = requests.get(gateway_url, timeout=10)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.exceptions.RequestException as e:
-        print(f"❌ IPFS gateway error: {e}")
-        return None
-    except ValueError:
-        return None
+async def fetch_from_ipfs(cid: str) -> Optional[dict]:
+    """Fetches JSON data for a CID from the local CID cache or, on a miss, the gateways."""
+    return await ipfs.fetch_json(cid)
+
+@app.on_event("startup")
+async def _warm_ipfs_cache():
+    loaded = await asyncio.to_thread(ipfs.cache.warm)
+    print(f"✅ IPFS cache warmed with {loaded} entries.")
 
 # ------------------------
 # Contract ABI
@@ -128,22 +126,166 @@ abi = [
     {"inputs":[],"name":"viewTotalProducts","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
     {"inputs":[],"name":"viewTotalQCSubmissions","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"},
     {"inputs":[{"internalType":"string","name":"batchNumber","type":"string"}],"name":"viewQCSubmissions","outputs":[{"components":[{"internalType":"string","name":"uploaderId","type":"string"},{"internalType":"string","name":"qcCid","type":"string"},{"internalType":"bool","name":"isStandard","type":"bool"},{"internalType":"uint256","name":"timestamp","type":"uint256"}],"internalType":"struct Counterfeit.QCSubmission[]","name":"","type":"tuple[]"}],"stateMutability":"view","type":"function"},
-    {"inputs":[{"internalType":"string","name":"batchNumber","type":"string"}],"name":"checkProductStandard","outputs":[{"internalType":"bool","name":"exists","type":"bool"},{"internalType":"bool","name":"isStandard","type":"bool"}],"stateMutability":"view","type":"function"}
+    {"inputs":[{"internalType":"string","name":"batchNumber","type":"string"}],"name":"checkProductStandard","outputs":[{"internalType":"bool","name":"exists","type":"bool"},{"internalType":"bool","name":"isStandard","type":"bool"}],"stateMutability":"view","type":"function"},
+    {"anonymous":False,"inputs":[{"indexed":False,"internalType":"string","name":"productHash","type":"string"},{"indexed":False,"internalType":"string","name":"productCid","type":"string"},{"indexed":False,"internalType":"string","name":"batchNumber","type":"string"},{"indexed":False,"internalType":"string","name":"manufacturerId","type":"string"}],"name":"ProductAdded","type":"event"},
+    {"anonymous":False,"inputs":[{"indexed":False,"internalType":"string","name":"manufacturerId","type":"string"},{"indexed":False,"internalType":"string","name":"batchNumber","type":"string"}],"name":"BatchAdded","type":"event"},
+    {"anonymous":False,"inputs":[{"indexed":False,"internalType":"string","name":"uploaderId","type":"string"},{"indexed":False,"internalType":"string","name":"qcCid","type":"string"},{"indexed":False,"internalType":"bool","name":"isStandard","type":"bool"},{"indexed":False,"internalType":"string","name":"batchNumber","type":"string"}],"name":"QCSubmitted","type":"event"}
 ]
 
 contract = w3.eth.contract(address=contract_address, abi=abi)
 
+# View calls go through a read-through cache pinned to the last block whose
+# logs have been applied; see chain_cache.py.
+chain_reads = ContractReadCache(
+    w3,
+    contract,
+    multicall=Multicall(w3, contract, os.getenv("MULTICALL_ADDRESS", MULTICALL3_ADDRESS)),
+    poll_interval=float(os.getenv("CHAIN_CACHE_POLL", 3)),
+    max_lag=float(os.getenv("CHAIN_CACHE_MAX_LAG", 30)),
+)
+
+@app.on_event("startup")
+async def _start_chain_cache():
+    chain_reads.start()
+
+@app.on_event("shutdown")
+async def _stop_chain_cache():
+    await chain_reads.stop()
+
+# List / filter / count queries are answered from a local SQLite copy of the
+# contract's events; see chain_indexer.py. Set CONTRACT_DEPLOY_BLOCK so the
+# first backfill does not scan from genesis.
+chain_index = ChainIndexer(
+    w3,
+    contract,
+    os.getenv("CHAIN_INDEX_DB", "chain_index.db"),
+    from_block=int(os.getenv("CONTRACT_DEPLOY_BLOCK", 0)),
+    confirmations=int(os.getenv("CHAIN_INDEX_CONFIRMATIONS", 12)),
+    poll_interval=float(os.getenv("CHAIN_INDEX_POLL", 5)),
+)
+
+@app.on_event("startup")
+async def _start_chain_index():
+    chain_index.start()
+
+@app.on_event("shutdown")
+async def _stop_chain_index():
+    await chain_index.stop()
+
 # ------------------------
 # Helper Functions (blockchain tx)
 # ------------------------
-def sign_and_send_tx(txn):
-    signed = w3.eth.account.sign_transaction(txn, private_key)
-    tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-    receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-    return tx_hash.hex(), receipt
+# Writes go through one local nonce allocator and return as soon as the node
+# accepts the transaction; receipts are tracked in the background.
+tx_pipeline = TxPipeline(
+    w3,
+    private_key,
+    account_address,
+    chain_id,
+    poll_interval=float(os.getenv("TX_POLL_INTERVAL", 2)),
+    bump_after=float(os.getenv("TX_BUMP_AFTER", 45)),
+    max_bumps=int(os.getenv("TX_MAX_BUMPS", 5)),
+    rpc_concurrency=int(os.getenv("TX_RPC_CONCURRENCY", 8)),
+)
+# Backstop for a job waiting on a transaction the pipeline cannot resolve
+# (one adopted without its nonce); the job is retried after it.
+TX_CONFIRM_TIMEOUT = float(os.getenv("TX_CONFIRM_TIMEOUT", 1800))
+
+@app.on_event("startup")
+async def _start_tx_pipeline():
+    tx_pipeline.start()
+
+@app.on_event("shutdown")
+async def _stop_tx_pipeline():
+    await tx_pipeline.stop()
+
+# Webhooks are POSTed from this server, so a caller-supplied URL must not
+# point it at the internal network: https only, and every address the host
+# resolves to must be public. TX_WEBHOOK_ALLOWED_HOSTS (comma-separated)
+# narrows that to a fixed set of hosts.
+TX_WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.getenv("TX_WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+
+def _check_webhook_url(url: Optional[str]) -> Optional[str]:
+    """Returns the URL if it is safe to POST to, else raises a 400 (resolves DNS: run in a thread)."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme != "https" or not host or parsed.username or parsed.password:
+        raise HTTPException(status_code=400, detail="webhookUrl must be an https URL without credentials.")
+    if TX_WEBHOOK_ALLOWED_HOSTS and host not in TX_WEBHOOK_ALLOWED_HOSTS:
+        raise HTTPException(status_code=400, detail="webhookUrl host is not allowed.")
+    try:
+        infos = socket.getaddrinfo(host, parsed.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError):
+        raise HTTPException(status_code=400, detail="webhookUrl host does not resolve.")
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%")[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise HTTPException(status_code=400, detail="webhookUrl must point to a public host.")
+    return url
+
+async def submit_tx(contract_fn, gas: int, label: str, wait: bool = False, webhook_url: Optional[str] = None) -> Dict[str, Any]:
+    record = await tx_pipeline.submit(contract_fn, gas, label=label, webhook_url=webhook_url)
+    if wait:
+        record = await tx_pipeline.wait(record["txId"])
+    return record
+
+# ------------------------
+# Persistent job queue
+# ------------------------
+# Multi-step writes (QC submissions, durable batch embeds) run as jobs in a
+# local SQLite queue. Each pin / tx / receipt / notification is checkpointed,
+# so after a restart a job resumes at its first unfinished step. Workers
+# sharing JOBS_DIR hold leases on the jobs they run (JOBS_LEASE_SECONDS).
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+job_queue = JobQueue(
+    os.path.join(JOBS_DIR, "jobs.db"),
+    default_concurrency=int(os.getenv("JOBS_CONCURRENCY", 2)),
+    max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", 3)),
+    lease_seconds=float(os.getenv("JOBS_LEASE_SECONDS", 30))
+)
+# How long a wait=true request holds on before answering 202 with the job id.
+JOBS_WAIT_TIMEOUT = float(os.getenv("JOBS_WAIT_TIMEOUT", 300))
 
-def get_nonce():
-    return w3.eth.get_transaction_count(account_address)
+@app.on_event("startup")
+async def _start_job_queue():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def _stop_job_queue():
+    await job_queue.stop()
+
+def job_fields(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {"jobId": job["jobId"], "jobStatus": job["status"], "statusUrl": f"/jobs/{job['jobId']}"}
+
+async def job_result(job: Dict[str, Any]):
+    """Waits up to JOBS_WAIT_TIMEOUT for a job: its result, a 500 if it failed, or a 202 to poll."""
+    try:
+        job = await job_queue.wait(job["jobId"], timeout=JOBS_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        job = job_queue.get(job["jobId"])
+        return JSONResponse(status_code=202, content={"message": "Still running", **job_fields(job)})
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    return {**job["result"], "jobId": job["jobId"]}
+
+@app.get("/jobs/{job_id}", tags=["Write Operations"])
+async def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id.")
+    return job
+
+def tx_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "transaction_hash": record["transaction_hash"],
+        "txId": record["txId"],
+        "txStatus": record["status"],
+        "statusUrl": f"/tx/{record['txId']}"
+    }
 
 # ------------------------
 # Pydantic Models
@@ -181,100 +323,40 @@ class ReportRequest(BaseModel):
 # ======================================================================
 # 2. ROBUST WATERMARKING HELPER FUNCTIONS
 # ======================================================================
+# QIM engine + payload helpers live in watermark.py so they can be imported
+# (and benchmarked) without a blockchain connection.
+from watermark import (
+    payload_bit_length, resolve_profile,
+    prepare_data, embed_watermark, decode_watermark, decode_watermark_soft, decode_watermark_strips,
+    resilient_decode,
+    embed_and_verify, embed_capacity, normalize_hash,
+)
+from offload import StageExecutor
+from image_index import ImageIndex, image_fingerprint, query_fingerprint, decode_and_fingerprint
 
-def prepare_data(text_to_embed: str) -> np.ndarray:
-    if text_to_embed.startswith('0x'):
-        text_to_embed = text_to_embed[2:]
-
-    if len(text_to_embed) != 64:
-        raise ValueError("dataHash must be 32 bytes (64 hex characters).")
-
-    hash_bytes = bytes.fromhex(text_to_embed)
-    rsc = RSCodec(ECC_BYTES)
-    encoded_bytes = rsc.encode(hash_bytes)
-    bits = np.unpackbits(np.frombuffer(encoded_bytes, dtype=np.uint8))
-    if bits.size != PAYLOAD_BIT_LENGTH:
-        bits = np.resize(bits, PAYLOAD_BIT_LENGTH)
-    return bits.astype(np.uint8)
-
-def embed_watermark(image: np.ndarray, watermark_payload: np.ndarray) -> np.ndarray:
-    if image is None:
-        raise ValueError("Input image for embedding is None")
-
-    image_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-    y_channel, u_channel, v_channel = cv2.split(image_yuv)
-    coeffs = pywt.wavedec2(y_channel, WAVELET, level=DWT_LEVEL)
-    target_tuple = coeffs[-1]
-    target_coeffs = target_tuple[0]
-    coeffs_flat = target_coeffs.flatten()
-
-    payload_len = int(watermark_payload.size)
-    if payload_len > coeffs_flat.size:
-        raise ValueError(f"Watermark ({payload_len} bits) too large for the image's target sub-band ({coeffs_flat.size} coeffs). Use a larger image or reduce ECC_BYTES.")
-    
-    num_tiles = coeffs_flat.size // payload_len
-    for tile_idx in range(num_tiles):
-        start = tile_idx * payload_len
-        end = start + payload_len
-        for i in range(payload_len):
-            coeff_index = start + i
-            C = coeffs_flat[coeff_index]
-            q_idx = int(np.round(C / Q))
-            bit = int(watermark_payload[i])
-            if bit == 0:
-                if q_idx % 2 != 0:
-                    q_idx -= 1
-            else:
-                if q_idx % 2 == 0:
-                    q_idx += 1
-            coeffs_flat[coeff_index] = q_idx * Q
-
-    embedded_coeffs = coeffs_flat.reshape(target_coeffs.shape)
-    coeffs[-1] = (embedded_coeffs, target_tuple[1], target_tuple[2])
-    watermarked_y_channel = pywt.waverec2(coeffs, WAVELET)
-    watermarked_y_channel = np.clip(watermarked_y_channel, 0, 255).astype(np.uint8)
-
-    if watermarked_y_channel.shape != y_channel.shape:
-        watermarked_y_channel = cv2.resize(watermarked_y_channel, (y_channel.shape[1], y_channel.shape[0]))
-
-    watermarked_yuv = cv2.merge([watermarked_y_channel, u_channel, v_channel])
-    return cv2.cvtColor(watermarked_yuv, cv2.COLOR_YUV2BGR)
-
-def decode_watermark(watermarked_image: np.ndarray) -> Optional[str]:
-    if watermarked_image is None:
-        raise ValueError("Input image for decoding is None.")
-
-    watermarked_yuv = cv2.cvtColor(watermarked_image, cv2.COLOR_BGR2YUV)
-    watermarked_y, _, _ = cv2.split(watermarked_yuv)
-    coeffs = pywt.wavedec2(watermarked_y, WAVELET, level=DWT_LEVEL)
-    target_coeffs = coeffs[-1][0].flatten()
-
-    num_tiles = target_coeffs.size // PAYLOAD_BIT_LENGTH
-    if num_tiles == 0:
-        raise ValueError("Not enough capacity in the image to extract payload. Use a larger image.")
-
-    bit_votes = [[] for _ in range(PAYLOAD_BIT_LENGTH)]
-    for tile_idx in range(num_tiles):
-        start = tile_idx * PAYLOAD_BIT_LENGTH
-        for i in range(PAYLOAD_BIT_LENGTH):
-            val = target_coeffs[start + i]
-            q_idx = int(np.round(val / Q))
-            bit = 1 if (q_idx % 2) != 0 else 0
-            bit_votes[i].append(bit)
-
-    extracted_bits = np.array([Counter(v).most_common(1)[0][0] for v in bit_votes], dtype=np.uint8)
-    extracted_bytes = np.packbits(extracted_bits).tobytes()
-
-    rsc = RSCodec(ECC_BYTES)
-    try:
-        decoded = rsc.decode(extracted_bytes)
-        if isinstance(decoded, (tuple, list)):
-            decoded_bytes = bytes(decoded[0])
-        else:
-            decoded_bytes = bytes(decoded)
-        return "0x" + decoded_bytes.hex()
-    except ReedSolomonError:
-        return None
+# Image decode / DWT / RS / PNG encode run here instead of on the event loop.
+cpu_stages = StageExecutor(OFFLOAD_WORKERS, OFFLOAD_MAX_QUEUE)
+
+def _imdecode_color(image_stream: bytes) -> Optional[np.ndarray]:
+    return cv2.imdecode(np.frombuffer(image_stream, np.uint8), cv2.IMREAD_COLOR)
+
+def _imdecode_label(image_stream: bytes, resilient: bool = False) -> Optional[np.ndarray]:
+    """Luma plane only for the plain decode (a third of the memory); the geometry search wants colour."""
+    flags = cv2.IMREAD_COLOR if resilient else cv2.IMREAD_GRAYSCALE
+    return cv2.imdecode(np.frombuffer(image_stream, np.uint8), flags)
+
+async def _decode_label(img_cv2: np.ndarray, resilient: bool = False) -> Dict[str, Any]:
+    """Plain decode, or with resilient=True the scale/rotation/crop search spread over the embed pool.
+
+    confidence is the soft-vote agreement of an aligned read (0..1); None
+    when the hash came out of the geometry search.
+    """
+    if not resilient:
+        decode = decode_watermark_strips if img_cv2.ndim == 2 else decode_watermark_soft
+        decoded = await cpu_stages.run("decode_watermark", decode, img_cv2)
+        return {"hash": decoded["hash"], "confidence": decoded["confidence"],
+                "profile": decoded["profile"], "hypothesis": None}
+    return await cpu_stages.run("resilient_decode", resilient_decode, img_cv2, _get_embed_pool())
 
 # ------------------------
 # Create watermark output dir & helper
@@ -282,29 +364,130 @@ def decode_watermark(watermarked_image: np.ndarray) -> Optional[str]:
 WATERMARKED_DIR = "watermarked_images"
 os.makedirs(WATERMARKED_DIR, exist_ok=True)
 
+# ------------------------
+# Visual index of watermarked labels
+# ------------------------
+# Every embedded label is fingerprinted (pHash + ORB) so /verify can still
+# shortlist products when a photo's watermark is unreadable; see image_index.py.
+image_index = ImageIndex(os.getenv("IMAGE_INDEX_DB", "image_index.db"))
+_image_index_task: Optional[asyncio.Task] = None
+
+async def _backfill_image_index():
+    """Loads the index, then indexes files already in WATERMARKED_DIR (hash read from each watermark)."""
+    if not image_index.loaded:
+        await asyncio.to_thread(image_index.load)
+    names = [n for n in sorted(os.listdir(WATERMARKED_DIR)) if not image_index.has(n)]
+    if not names:
+        return
+    loop = asyncio.get_running_loop()
+    pool = _get_embed_pool()
+    added = 0
+    for name in names:
+        try:
+            fp = await loop.run_in_executor(pool, decode_and_fingerprint, os.path.join(WATERMARKED_DIR, name))
+        except Exception as e:
+            print(f"⚠ Could not fingerprint {name}: {e}")
+            continue
+        if fp is None:
+            continue
+        data_hash = fp.pop("dataHash")
+        image_index.add(normalize_hash(data_hash) if data_hash else None, name, fp)
+        if data_hash:
+            added += 1
+    print(f"✅ Image index backfill: {added}/{len(names)} existing labels attributed.")
+
+@app.on_event("startup")
+async def _start_image_index_backfill():
+    global _image_index_task
+    _image_index_task = asyncio.create_task(_backfill_image_index())
+
+@app.on_event("shutdown")
+async def _stop_image_index_backfill():
+    if _image_index_task is not None:
+        _image_index_task.cancel()
+
+async def _visual_candidates(img_cv2: np.ndarray, limit: int = 3) -> List[Dict[str, Any]]:
+    """Registered products whose label looks like this photo, confirmed on-chain, best first."""
+    fingerprint = await cpu_stages.run("fingerprint", query_fingerprint, img_cv2)
+    matches = await cpu_stages.run("image_search", image_index.search, fingerprint, limit)
+    if not matches:
+        return []
+    hashes = [m["dataHash"][2:] for m in matches]
+    details = await asyncio.to_thread(chain_reads.call_many, [("viewProductDetails", (h,)) for h in hashes])
+    candidates = []
+    for match, product_hash, product in zip(matches, hashes, details):
+        if not product[0]:
+            continue
+        _, cid, batch, manufacturer = product
+        candidates.append({
+            "productHash": product_hash,
+            "productCid": cid,
+            "batchId": batch,
+            "manufacturerId": manufacturer,
+            "score": match["score"],
+            "phashDistance": match["phashDistance"],
+            "featureInliers": match["featureInliers"],
+        })
+    return candidates
+
+# ------------------------
+# Verification cache
+# ------------------------
+# Re-uploads of the same bytes skip the decode and, while the contract read
+# cache is in sync, the whole /verify response; see verify_cache.py. Point
+# VERIFY_CACHE_DB at a file to share entries between uvicorn workers.
+verify_cache = VerifyCache(
+    os.getenv("VERIFY_CACHE_DB") or None,
+    decode_ttl=float(os.getenv("VERIFY_CACHE_DECODE_TTL", 86400)),
+)
+chain_reads.add_listener(verify_cache.on_chain_event)
+
+# A QC verdict only changes with a new submission, and that event evicts the
+# entry anyway. "No QC yet" and "not registered" are the answers to recheck soon.
+VERIFY_TTL_QC = float(os.getenv("VERIFY_CACHE_TTL_QC", 300))
+VERIFY_TTL_PENDING = float(os.getenv("VERIFY_CACHE_TTL_PENDING", 30))
+
+def _upload_key(image_stream: bytes, resilient: bool) -> Tuple[str, str]:
+    return image_digest(image_stream), ("resilient" if resilient else "plain")
+
+async def _decode_upload(image_stream: bytes, key: Tuple[str, str],
+                         resilient: bool = False) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """_decode_label through the decode cache -> (decoded, image); image is None on a cache hit."""
+    decoded = verify_cache.get_decoded(*key)
+    if decoded is not None:
+        return decoded, None
+    img_cv2 = await cpu_stages.run("imdecode", _imdecode_label, image_stream, resilient)
+    if img_cv2 is None:
+        raise ValueError("Failed to decode image.")
+    decoded = await _decode_label(img_cv2, resilient)
+    verify_cache.put_decoded(*key, decoded)
+    return decoded, img_cv2
+
 # ------------------------
 # API Endpoints (Write Operations)
 # ------------------------
 
 @app.post("/add_batch", tags=["Write Operations"])
-async def add_batch(data: BatchRequest):
+async def add_batch(data: BatchRequest, wait: bool = False, webhookUrl: Optional[str] = None):
+    if webhookUrl:
+        webhookUrl = await asyncio.to_thread(_check_webhook_url, webhookUrl)
     try:
-        txn = contract.functions.addBatch(data.manufacturerId, data.batchNumber).build_transaction({
-            "from": account_address,
-            "nonce": get_nonce(),
-            "gas": 300000,
-            "gasPrice": w3.eth.gas_price,
-            "chainId": chain_id
-        })
-        tx_hash, receipt = sign_and_send_tx(txn)
-        if receipt.status == 0:
-            raise HTTPException(status_code=500, detail="Transaction failed on the blockchain.")
-        return {"message": "Batch added successfully", "transaction_hash": tx_hash}
+        record = await submit_tx(
+            contract.functions.addBatch(data.manufacturerId, data.batchNumber),
+            gas=300000,
+            label=f"addBatch:{data.batchNumber}",
+            wait=wait,
+            webhook_url=webhookUrl
+        )
+        if record["status"] in (FAILED, DROPPED, STUCK):
+            raise HTTPException(status_code=500, detail=record["error"] or "Transaction failed on the blockchain.")
+        message = "Batch added successfully" if wait else "Batch transaction submitted"
+        return {"message": message, **tx_fields(record)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/add_product", tags=["Write Operations"])
-async def add_product(data: ProductRequest):
+def _prepare_product(data: ProductRequest):
+    """Salted product JSON and its hash: (product_hash, product_bytes)."""
     salt = secrets.token_hex(16)
     product_json = data.dict()
     product_json["salt"] = salt
@@ -313,38 +496,157 @@ async def add_product(data: ProductRequest):
 
     canonical = f"{data.productId}|{data.batchNumber}|{data.expiryDate}|{salt}"
     product_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return product_hash, product_bytes
 
-    product_cid = upload_to_ipfs(product_bytes, f"product_{product_hash}.json")
+async def _register_product(data: ProductRequest, wait: bool = False, webhook_url: Optional[str] = None) -> Dict[str, Any]:
+    if webhook_url:
+        webhook_url = await asyncio.to_thread(_check_webhook_url, webhook_url)
+    product_hash, product_bytes = _prepare_product(data)
+
+    product_cid = await upload_to_ipfs(product_bytes, f"product_{product_hash}.json")
     if not product_cid:
         raise HTTPException(status_code=500, detail="Failed to upload product JSON to IPFS.")
     
     product_uri = f"ipfs://{product_cid}"
 
     try:
-        txn = contract.functions.addProduct(
-            product_hash,
-            product_uri,
-            data.batchNumber,
-            data.manufacturerId
-        ).build_transaction({
-            "from": account_address,
-            "nonce": get_nonce(),
-            "gas": 500000,
-            "gasPrice": w3.eth.gas_price,
-            "chainId": chain_id
-        })
-        tx_hash, receipt = sign_and_send_tx(txn)
-        if receipt.status == 0:
-            raise HTTPException(status_code=500, detail="Transaction failed on the blockchain. Check if batch exists.")
+        record = await submit_tx(
+            contract.functions.addProduct(
+                product_hash,
+                product_uri,
+                data.batchNumber,
+                data.manufacturerId
+            ),
+            gas=500000,
+            label=f"addProduct:{product_hash}",
+            wait=wait,
+            webhook_url=webhook_url
+        )
+        if record["status"] in (FAILED, DROPPED, STUCK):
+            raise HTTPException(status_code=500,
+                                detail=record["error"] or "Transaction failed on the blockchain. Check if batch exists.")
         return {
-            "message": "Product added successfully",
+            "message": "Product added successfully" if wait else "Product transaction submitted",
             "productHash": product_hash,
             "productUri": product_uri,
-            "transaction_hash": tx_hash
+            **tx_fields(record)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/add_product", tags=["Write Operations"])
+async def add_product(data: ProductRequest, wait: bool = False, webhookUrl: Optional[str] = None):
+    return await _register_product(data, wait=wait, webhook_url=webhookUrl)
+
+# ------------------------
+# Bulk product registration
+# ------------------------
+BULK_READ_CHUNK = 64
+
+def _iter_product_rows(upload: UploadFile):
+    """
+    Yields (row_number, dict) from a CSV or JSONL upload without reading it all at once.
+    A JSONL line that does not parse yields its JSONDecodeError in place of the dict,
+    so that one line is reported invalid and the rest are still read.
+    """
+    lower = (upload.filename or "").lower()
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if lower.endswith(".csv"):
+        for idx, row in enumerate(csv.DictReader(text), start=1):
+            yield idx, row
+    else:
+        for idx, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    yield idx, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield idx, e
+
+def _read_chunk(rows, size: int = BULK_READ_CHUNK) -> List[Tuple[int, Any]]:
+    """Next rows of the spooled upload; run in a thread since the spool may be on disk."""
+    return list(itertools.islice(rows, size))
+
+async def _bulk_register_stream(rows, concurrency: int, wait: bool):
+    counts = {"submitted": 0, "confirmed": 0, "invalid": 0, "error": 0}
+    pending = set()
+
+    async def register(row_number: int, row: Any) -> Dict[str, Any]:
+        if isinstance(row, json.JSONDecodeError):
+            return {"row": row_number, "status": "invalid", "error": f"Invalid JSON: {row}"}
+        try:
+            data = ProductRequest(**row)
+        except (ValidationError, TypeError) as e:
+            return {"row": row_number, "status": "invalid", "error": str(e)}
+        try:
+            result = await _register_product(data, wait=wait)
+        except HTTPException as e:
+            return {"row": row_number, "productId": data.productId, "status": "error", "error": e.detail}
+        return {
+            "row": row_number,
+            "productId": data.productId,
+            "status": "confirmed" if wait else "submitted",
+            **{k: v for k, v in result.items() if k != "message"}
+        }
+
+    def emit(done) -> str:
+        lines = []
+        for task in done:
+            pending.discard(task)
+            result = task.result()
+            counts[result["status"]] += 1
+            lines.append(json.dumps(result) + "\n")
+        return "".join(lines)
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(_read_chunk, rows)
+            if not chunk:
+                break
+            for row_number, row in chunk:
+                while len(pending) >= concurrency:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    yield emit(done)
+                pending.add(asyncio.create_task(register(row_number, row)))
+    except (ValueError, csv.Error) as e:
+        # Malformed input: stop reading, but finish the rows already started.
+        counts["error"] += 1
+        yield json.dumps({"status": "error", "error": f"Could not parse upload: {e}"}) + "\n"
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        yield emit(done)
+    yield json.dumps({"summary": counts}) + "\n"
+
+@app.post("/add_products/bulk", tags=["Write Operations"])
+async def add_products_bulk(
+    file: UploadFile = File(...),
+    concurrency: int = 16,
+    wait: bool = False
+):
+    """
+    Registers every product row in a CSV or JSONL upload. Rows are validated
+    against ProductRequest, pinned in parallel (up to `concurrency` at once) and
+    submitted through the nonce pipeline. One NDJSON status line is streamed
+    back per row as it completes, followed by a summary line.
+    """
+    if not (file.filename or "").lower().endswith((".csv", ".jsonl", ".ndjson")):
+        raise HTTPException(status_code=400, detail="Unsupported file type. Upload CSV or JSONL.")
+    rows = _iter_product_rows(file)
+    concurrency = max(1, min(concurrency, 256))
+    return StreamingResponse(_bulk_register_stream(rows, concurrency, wait), media_type="application/x-ndjson")
+
+@app.get("/tx_stats", tags=["Write Operations"])
+async def tx_stats():
+    """Transactions awaiting a receipt, and the ones stuck after every gas bump (these need an operator)."""
+    return {"pending": tx_pipeline.pending_count(), "stuck": tx_pipeline.stuck()}
+
+@app.get("/tx/{tx_id}", tags=["Write Operations"])
+async def tx_status(tx_id: str):
+    """Status of a transaction submitted by one of the write endpoints."""
+    record = tx_pipeline.get(tx_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Unknown transaction id.")
+    return record
+
 # ------------------------
 # Watermarking Endpoints
 # ------------------------
@@ -352,41 +654,47 @@ async def add_product(data: ProductRequest):
 async def embed_robust_watermark_endpoint(
     request: Request,
     dataHash: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    profile: str = Form(WATERMARK_PROFILE)
 ):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image.")
 
     try:
-        payload_bits = prepare_data(dataHash)
-
         image_stream = await file.read()
-        image_array = np.frombuffer(image_stream, np.uint8)
-        img_cv2 = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+        img_cv2 = await cpu_stages.run("imdecode", _imdecode_color, image_stream)
         if img_cv2 is None:
             raise ValueError("Failed to decode uploaded image.")
 
-        y_channel = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2YUV)
-        y_channel = cv2.split(y_channel)[0]
-        coeffs_check = pywt.wavedec2(y_channel, WAVELET, level=DWT_LEVEL)
-        capacity = coeffs_check[-1][0].size
-        if capacity < PAYLOAD_BIT_LENGTH:
-            raise HTTPException(status_code=400, detail=f"Image too small for payload: capacity {capacity} bits < required {PAYLOAD_BIT_LENGTH} bits. Use a larger image or reduce ECC_BYTES.")
+        try:
+            profile = resolve_profile(profile, *img_cv2.shape[:2], WATERMARK_TIME_BUDGET_MS)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        payload_bits = prepare_data(dataHash, profile)
+
+        capacity = embed_capacity(*img_cv2.shape[:2], profile)
+        required = payload_bit_length(profile)
+        if capacity < required:
+            raise HTTPException(status_code=400, detail=f"Image too small for payload: capacity {capacity} bits < required {required} bits ('{profile}' profile). Use a larger image or a profile with fewer parity bytes.")
 
-        watermarked_img = embed_watermark(img_cv2, payload_bits)
+        watermarked_img = await cpu_stages.run("embed_watermark", embed_watermark, img_cv2, payload_bits, profile)
 
         safe_name = os.path.basename(file.filename)
         timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
         output_filename = f"watermarked_{timestamp}_{safe_name}.png"
         output_path = os.path.join(WATERMARKED_DIR, output_filename)
-        cv2.imwrite(output_path, watermarked_img)
+        await cpu_stages.run("imwrite", cv2.imwrite, output_path, watermarked_img)
+        fingerprint = await cpu_stages.run("fingerprint", image_fingerprint, watermarked_img)
+        image_index.add(normalize_hash(dataHash), output_filename, fingerprint)
 
         base_url = str(request.base_url).rstrip("/")
         download_url = f"{base_url}/download/{output_filename}"
 
         try:
-            decoded_hash = decode_watermark(watermarked_img)
+            decoded_hash = await cpu_stages.run("decode_watermark", decode_watermark, watermarked_img)
             verification_passed = (decoded_hash is not None and decoded_hash.lower() == (("0x" + dataHash.lower().lstrip("0x")).lower()))
+        except HTTPException:
+            raise
         except Exception:
             decoded_hash = None
             verification_passed = False
@@ -394,6 +702,7 @@ async def embed_robust_watermark_endpoint(
         return JSONResponse({
             "message": "Watermark embedded successfully",
             "dataHash": dataHash,
+            "profile": profile,
             "download_url": download_url,
             "saved_path": output_path,
             "verification_passed": verification_passed,
@@ -405,6 +714,226 @@ async def embed_robust_watermark_endpoint(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to embed watermark: {str(e)}")
 
+# ------------------------
+# Batch embedding (process pool)
+# ------------------------
+_embed_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_embed_pool() -> ProcessPoolExecutor:
+    global _embed_pool
+    if _embed_pool is None:
+        _embed_pool = ProcessPoolExecutor(max_workers=EMBED_WORKERS)
+    return _embed_pool
+
+@app.on_event("shutdown")
+def _shutdown_executors():
+    if _embed_pool is not None:
+        _embed_pool.shutdown(wait=False, cancel_futures=True)
+    cpu_stages.shutdown()
+
+@app.on_event("shutdown")
+async def _close_ipfs_client():
+    await ipfs.close()
+
+class _ChunkBuffer:
+    """Unseekable sink for zipfile; the stream generator drains it after each entry."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _zip_batch_entries(archive: zipfile.ZipFile) -> List[tuple]:
+    """
+    (filename, dataHash) for every image in an uploaded zip. The hash for each
+    image comes from an optional manifest.json ({"<filename>": "<dataHash>"})
+    or, failing that, from the image's file stem.
+    """
+    names = [n for n in archive.namelist() if not n.endswith("/")]
+    mapping: Dict[str, str] = {}
+    if "manifest.json" in names:
+        mapping = json.loads(archive.read("manifest.json").decode("utf-8"))
+        names.remove("manifest.json")
+    return [(name, mapping.get(name) or os.path.splitext(os.path.basename(name))[0]) for name in names]
+
+def _batch_items_from_zip(archive: zipfile.ZipFile):
+    for name, data_hash in _zip_batch_entries(archive):
+        yield name, data_hash, archive.read(name)
+
+def _batch_items_from_multipart(data_hashes: List[str], files: List[UploadFile]):
+    for data_hash, f in zip(data_hashes, files):
+        yield f.filename, data_hash, f.file.read()
+
+def _save_embed_output(entry: Dict[str, Any], result: Dict[str, Any], output_filename: str, base_url: str) -> Dict[str, Any]:
+    output_path = os.path.join(WATERMARKED_DIR, output_filename)
+    with open(output_path, "wb") as fh:
+        fh.write(result["png"])
+    image_index.add(normalize_hash(entry["dataHash"]), output_filename, result["fingerprint"])
+    entry.update({
+        "status": "ok",
+        "output": output_filename,
+        "download_url": f"{base_url}/download/{output_filename}",
+        "profile": result["profile"],
+        "verification_passed": result["verification_passed"],
+        "decoded_hash_from_self_check": result["decoded_hash_from_self_check"],
+    })
+    return entry
+
+async def _embed_batch_stream(items, base_url: str):
+    loop = asyncio.get_running_loop()
+    pool = _get_embed_pool()
+    window = EMBED_WORKERS * 2  # bound the number of images held in memory
+    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+
+    buf = _ChunkBuffer()
+    zf = zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED)
+    manifest: List[Dict[str, Any]] = []
+    pending: Dict[asyncio.Future, Dict[str, Any]] = {}
+
+    def collect(fut: asyncio.Future):
+        entry = pending.pop(fut)
+        try:
+            result = fut.result()
+        except Exception as e:
+            entry.update({"status": "error", "error": str(e)})
+            manifest.append(entry)
+            return
+        output_filename = f"watermarked_{timestamp}_{entry['index']:05d}_{os.path.basename(entry['filename'])}.png"
+        zf.writestr(output_filename, result["png"])
+        manifest.append(_save_embed_output(entry, result, output_filename, base_url))
+
+    for idx, (filename, data_hash, image_bytes) in enumerate(items):
+        while len(pending) >= window:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                collect(fut)
+            yield buf.drain()
+        fut = loop.run_in_executor(pool, embed_and_verify, data_hash, image_bytes, image_fingerprint,
+                                   WATERMARK_PROFILE, WATERMARK_TIME_BUDGET_MS)
+        pending[fut] = {"index": idx, "filename": filename, "dataHash": data_hash}
+
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for fut in done:
+            collect(fut)
+        yield buf.drain()
+
+    manifest.sort(key=lambda e: e["index"])
+    zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+    zf.close()
+    yield buf.drain()
+
+async def _run_embed_batch_job(job) -> Dict[str, Any]:
+    """Durable batch embed: every finished image is checkpointed as item:<index>."""
+    loop = asyncio.get_running_loop()
+    pool = _get_embed_pool()
+    base_url = job.params["baseUrl"]
+    archive = zipfile.ZipFile(job.params["archivePath"])
+    entries = _zip_batch_entries(archive)
+
+    async def process(idx: int, name: str, data_hash: str) -> Dict[str, Any]:
+        entry = {"index": idx, "filename": name, "dataHash": data_hash}
+        try:
+            result = await loop.run_in_executor(pool, embed_and_verify, data_hash, archive.read(name),
+                                                image_fingerprint, WATERMARK_PROFILE, WATERMARK_TIME_BUDGET_MS)
+        except Exception as e:
+            entry.update({"status": "error", "error": str(e)})
+            return entry
+        output_filename = f"watermarked_{job.id[:12]}_{idx:05d}_{os.path.basename(name)}.png"
+        return _save_embed_output(entry, result, output_filename, base_url)
+
+    window = max(1, EMBED_WORKERS * 2)
+    pending = set()
+    for idx, (name, data_hash) in enumerate(entries):
+        while len(pending) >= window:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        pending.add(asyncio.create_task(
+            job.step(f"item:{idx}", lambda idx=idx, name=name, data_hash=data_hash: process(idx, name, data_hash))
+        ))
+    if pending:
+        await asyncio.gather(*pending)
+
+    manifest = [job.checkpoints[f"item:{idx}"] for idx in range(len(entries))]
+    succeeded = sum(1 for entry in manifest if entry["status"] == "ok")
+    return {"items": len(manifest), "succeeded": succeeded, "failed": len(manifest) - succeeded, "manifest": manifest}
+
+job_queue.register("embed_batch", _run_embed_batch_job, concurrency=1)
+
+def _enqueue_embed_batch(archive: UploadFile, base_url: str) -> JSONResponse:
+    """Saves the uploaded zip under JOBS_DIR (named by its sha256) and queues it."""
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(JOBS_DIR, f"upload_{secrets.token_hex(8)}.tmp")
+    with open(tmp_path, "wb") as fh:
+        for chunk in iter(lambda: archive.file.read(1 << 20), b""):
+            digest.update(chunk)
+            fh.write(chunk)
+    if not zipfile.is_zipfile(tmp_path):
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="archive must be a zip file.")
+    archive_path = os.path.join(JOBS_DIR, f"embed_{digest.hexdigest()}.zip")
+    os.replace(tmp_path, archive_path)
+
+    job, created = job_queue.enqueue(
+        "embed_batch",
+        {"archivePath": archive_path, "baseUrl": base_url},
+        idempotency_key=f"embed_batch:{digest.hexdigest()}"
+    )
+    message = "Batch embed queued" if created else "Batch embed already submitted"
+    return JSONResponse(status_code=202, content={"message": message, **job_fields(job)})
+
+@app.post("/embed_robust_watermark/batch", tags=["Watermarking"])
+async def embed_robust_watermark_batch_endpoint(
+    request: Request,
+    archive: Optional[UploadFile] = File(None),
+    dataHashes: Optional[List[str]] = Form(None),
+    files: Optional[List[UploadFile]] = File(None),
+    durable: bool = False,
+):
+    """
+    Embeds watermarks for many label images in one call, spread over a pool of
+    EMBED_WORKERS processes. Send either a zip `archive` or paired `dataHashes`
+    and `files` form fields. Returns a streamed zip of PNGs plus manifest.json.
+
+    With `durable=true` (zip archives only) the batch runs as a background job
+    that survives restarts; poll /jobs/{jobId} for the manifest. Re-uploading
+    the same archive returns the existing job.
+    """
+    base_url = str(request.base_url).rstrip("/")
+    if durable:
+        if archive is None:
+            raise HTTPException(status_code=400, detail="durable=true requires a zip archive.")
+        return await asyncio.to_thread(_enqueue_embed_batch, archive, base_url)
+
+    if archive is not None:
+        try:
+            zip_in = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive must be a zip file.")
+        items = _batch_items_from_zip(zip_in)
+    elif files:
+        if not dataHashes or len(dataHashes) != len(files):
+            raise HTTPException(status_code=400, detail="Provide exactly one dataHash per uploaded file.")
+        items = _batch_items_from_multipart(dataHashes, files)
+    else:
+        raise HTTPException(status_code=400, detail="Upload a zip archive or dataHashes + files.")
+
+    return StreamingResponse(
+        _embed_batch_stream(items, base_url),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="watermarked_batch.zip"'},
+    )
+
 @app.get("/download/{filename}", tags=["Watermarking"])
 async def download_file(filename: str):
     filename = os.path.basename(filename)
@@ -414,20 +943,20 @@ async def download_file(filename: str):
     return FileResponse(file_path, media_type="image/png", filename=filename)
 
 @app.post("/decode_robust_watermark", tags=["Watermarking"])
-async def decode_robust_watermark_endpoint(file: UploadFile = File(...)):
+async def decode_robust_watermark_endpoint(file: UploadFile = File(...), resilient: bool = False):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image.")
 
     try:
         image_stream = await file.read()
-        image_array = np.frombuffer(image_stream, np.uint8)
-        img_cv2 = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        if img_cv2 is None:
-            raise ValueError("Failed to decode image.")
-
-        decoded_hash = decode_watermark(img_cv2)
-        if decoded_hash:
-            return {"decoded_hash": decoded_hash}
+        decoded, _ = await _decode_upload(image_stream, _upload_key(image_stream, resilient), resilient)
+        if decoded["hash"]:
+            response = {"decoded_hash": decoded["hash"], "confidence": decoded["confidence"],
+                        "profile": decoded.get("profile")}
+            if resilient:
+                # None when the scan was already aligned.
+                response["geometry"] = decoded["hypothesis"]
+            return response
         else:
             raise HTTPException(status_code=404, detail="Watermark not found or is too corrupted to decode.")
     except HTTPException:
@@ -443,18 +972,18 @@ async def decode_robust_watermark_endpoint(file: UploadFile = File(...)):
 async def view_product_details(product_hash: str):
     try:
         clean_hash = product_hash.strip().replace('"', '').replace("'", '').lstrip('0x')
-        product_details = contract.functions.viewProductDetails(clean_hash).call()
+        product_details = await asyncio.to_thread(chain_reads.call, "viewProductDetails", clean_hash)
         if not product_details[0]:
             raise HTTPException(status_code=404, detail="Product not found on the blockchain.")
 
         pid, cid, batch, manufacturer = product_details
         
         ipfs_cid = cid.replace("ipfs://", "")
-        ipfs_data = fetch_from_ipfs(ipfs_cid)
+        ipfs_data = await fetch_from_ipfs(ipfs_cid)
         if not ipfs_data:
             raise HTTPException(status_code=500, detail="Failed to retrieve product details from IPFS.")
         
-        exists, is_standard = contract.functions.checkProductStandard(batch).call()
+        exists, is_standard = await asyncio.to_thread(chain_reads.call, "checkProductStandard", batch)
         qc_status = "No QC data"
         
         if exists:
@@ -471,56 +1000,71 @@ async def view_product_details(product_hash: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+async def _qc_submission_details(row: Dict[str, Any]) -> Dict[str, Any]:
+    ipfs_cid = row["qcCid"].replace("ipfs://", "")
+    qc_data = await fetch_from_ipfs(ipfs_cid)
+    return {
+        "uploaderId": row["uploaderId"],
+        "qcCid": row["qcCid"],
+        "isStandard": row["isStandard"],
+        "timestamp": row["timestamp"],
+        "batchNumber": row["batchNumber"],
+        "confirmed": row["confirmed"],
+        "qcDetailsFromIPFS": qc_data if qc_data else "Could not retrieve JSON from IPFS.",
+        "qcGatewayUrl": ipfs.gateway_url(ipfs_cid)
+    }
+
+async def _qc_submission_stream(rows: List[Dict[str, Any]], next_cursor: Optional[str], concurrency: int):
+    # IPFS fetches run `concurrency` at a time but lines go out in chain order.
+    window = deque()
+    count = 0
+    try:
+        for row in rows:
+            window.append(asyncio.create_task(_qc_submission_details(row)))
+            while window and (len(window) >= concurrency or window[0].done()):
+                yield json.dumps(await window.popleft()) + "\n"
+                count += 1
+        while window:
+            yield json.dumps(await window.popleft()) + "\n"
+            count += 1
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        for task in window:
+            task.cancel()
+    yield json.dumps({"nextCursor": next_cursor, "count": count, "indexComplete": chain_index.caught_up}) + "\n"
+
 @app.get("/view_all_qc_submissions", tags=["Read Operations"])
-async def view_all_qc_submissions():
+async def view_all_qc_submissions(
+    cursor: Optional[str] = None,
+    limit: int = 200,
+    concurrency: int = 8,
+    batchNumber: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None
+):
     """
-    Retrieves all QC submissions by iterating through a known list of manufacturers.
-    Note: This is a workaround as the smart contract does not provide a direct
-    function to list all batches across all manufacturers.
+    Streams QC submissions from the local event index as NDJSON, one per line,
+    in chain order, each with its QC JSON from IPFS. The last line is
+    {"nextCursor", "count", "indexComplete"}; pass nextCursor back to read the
+    next page. A null nextCursor means there is nothing further.
     """
     try:
-        all_submissions = []
-        # Predefined list of manufacturer IDs to iterate through
-        manufacturer_ids = ["MANU001", "MANU002"] # Add more as needed
-        
-        processed_batches = set()
-
-        for manufacturerId in manufacturer_ids:
-            batch_list = contract.functions.viewBatchesByManufacturer(manufacturerId).call()
-            candidate_batches = sorted(set(batch_list))
-            
-            for batch_num in candidate_batches:
-                if batch_num in processed_batches:
-                    continue # Skip if already processed
-                
-                submissions = contract.functions.viewQCSubmissions(batch_num).call()
-                for submission in submissions:
-                    uploader_id, cid, is_standard, timestamp = submission
-                    ipfs_cid = cid.replace("ipfs://", "")
-                    qc_data = fetch_from_ipfs(ipfs_cid)
-                    gateway_url = f"https://ipfs.io/ipfs/{ipfs_cid}"
-                    
-                    submission_details = {
-                        "uploaderId": uploader_id,
-                        "qcCid": cid,
-                        "isStandard": is_standard,
-                        "timestamp": timestamp,
-                        "batchNumber": batch_num,
-                        "qcDetailsFromIPFS": qc_data if qc_data else "Could not retrieve JSON from IPFS.",
-                        "qcGatewayUrl": gateway_url
-                    }
-                    all_submissions.append(submission_details)
-                
-                processed_batches.add(batch_num)
-
-        return {"qcSubmissions": all_submissions}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        after = parse_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    rows, next_cursor = await asyncio.to_thread(
+        chain_index.qc_submissions, batch_number=batchNumber, since=since, until=until, after=after, limit=max(1, min(limit, 5000))
+    )
+    return StreamingResponse(
+        _qc_submission_stream(rows, next_cursor, max(1, min(concurrency, 64))),
+        media_type="application/x-ndjson"
+    )
 
 @app.post("/view_products_by_batch", tags=["Read Operations"])
 async def view_products_by_batch(data: BatchRequest):
     try:
-        product_hashes = contract.functions.viewProductsByBatch(data.batchNumber).call()
+        product_hashes = await asyncio.to_thread(chain_reads.call, "viewProductsByBatch", data.batchNumber)
         return {"batchNumber": data.batchNumber, "productHashes": product_hashes}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -528,7 +1072,7 @@ async def view_products_by_batch(data: BatchRequest):
 @app.post("/view_products_by_manufacturer", tags=["Read Operations"])
 async def view_products_by_manufacturer(data: BatchRequest):
     try:
-        product_hashes = contract.functions.viewProductsByManufacturer(data.manufacturerId).call()
+        product_hashes = await asyncio.to_thread(chain_reads.call, "viewProductsByManufacturer", data.manufacturerId)
         return {"manufacturerId": data.manufacturerId, "productHashes": product_hashes}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -536,31 +1080,138 @@ async def view_products_by_manufacturer(data: BatchRequest):
 @app.post("/view_batches_by_manufacturer", tags=["Read Operations"])
 async def view_batches_by_manufacturer(data: BatchRequest):
     try:
-        batch_numbers = contract.functions.viewBatchesByManufacturer(data.manufacturerId).call()
+        batch_numbers = await asyncio.to_thread(chain_reads.call, "viewBatchesByManufacturer", data.manufacturerId)
         return {"manufacturerId": data.manufacturerId, "batchNumbers": batch_numbers}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/executor_stats", tags=["Read Operations"])
+async def executor_stats():
+    """Per-stage timing and queue state of the CPU offload executor."""
+    return cpu_stages.snapshot()
+
+@app.get("/ipfs_cache_stats", tags=["Read Operations"])
+async def ipfs_cache_stats():
+    """Hit/miss counters and size of the local CID cache."""
+    return ipfs.cache.stats()
+
+@app.get("/image_index_stats", tags=["Read Operations"])
+async def image_index_stats():
+    return image_index.stats()
+
+@app.get("/verify_cache_stats", tags=["Read Operations"])
+async def verify_cache_stats():
+    """Hit/miss counters and entry counts of the /verify and decode caches."""
+    return verify_cache.stats()
+
+@app.get("/chain_cache_stats", tags=["Read Operations"])
+async def chain_cache_stats():
+    """Hit/miss counters and sync position of the contract read cache."""
+    return chain_reads.stats()
+
 @app.get("/view_totals", tags=["Read Operations"])
 async def view_totals():
+    if chain_index.caught_up:
+        summary = await asyncio.to_thread(chain_index.summary)
+        return {k: summary[k] for k in ("totalBatches", "totalProducts", "totalQCSubmissions")}
     try:
+        total_batches, total_products, total_qc = await asyncio.to_thread(chain_reads.call_many, [
+            ("viewTotalBatches", ()),
+            ("viewTotalProducts", ()),
+            ("viewTotalQCSubmissions", ()),
+        ])
         return {
-            "totalBatches": int(contract.functions.viewTotalBatches().call()),
-            "totalProducts": int(contract.functions.viewTotalProducts().call()),
-            "totalQCSubmissions": int(contract.functions.viewTotalQCSubmissions().call())
+            "totalBatches": int(total_batches),
+            "totalProducts": int(total_products),
+            "totalQCSubmissions": int(total_qc)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ------------------------
+# Event index queries (no RPC calls)
+# ------------------------
+# SQLite reads run in threads: the indexer holds the store's lock while it
+# writes a backfill chunk, and the event loop must not wait on it.
+def _index_page(items: List[Dict[str, Any]], next_cursor: Optional[str]) -> Dict[str, Any]:
+    return {"items": items, "nextCursor": next_cursor, "indexComplete": chain_index.caught_up}
+
+def _index_after(cursor: Optional[str]):
+    try:
+        return parse_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+@app.get("/index/products", tags=["Read Operations"])
+async def index_products(
+    batchNumber: Optional[str] = None,
+    manufacturerId: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+):
+    """ProductAdded events, filterable by batch, manufacturer and [since, until) unix time."""
+    after = _index_after(cursor)
+    return _index_page(*await asyncio.to_thread(
+        chain_index.products, batch_number=batchNumber, manufacturer_id=manufacturerId, since=since, until=until,
+        after=after, limit=max(1, min(limit, 5000))
+    ))
+
+@app.get("/index/batches", tags=["Read Operations"])
+async def index_batches(
+    manufacturerId: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+):
+    after = _index_after(cursor)
+    return _index_page(*await asyncio.to_thread(
+        chain_index.batches, manufacturer_id=manufacturerId, since=since, until=until,
+        after=after, limit=max(1, min(limit, 5000))
+    ))
+
+@app.get("/index/qc_submissions", tags=["Read Operations"])
+async def index_qc_submissions(
+    batchNumber: Optional[str] = None,
+    uploaderId: Optional[str] = None,
+    isStandard: Optional[bool] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+):
+    """QCSubmitted events without the IPFS payloads (see /view_all_qc_submissions for those)."""
+    after = _index_after(cursor)
+    return _index_page(*await asyncio.to_thread(
+        chain_index.qc_submissions, batch_number=batchNumber, uploader_id=uploaderId, is_standard=isStandard,
+        since=since, until=until, after=after, limit=max(1, min(limit, 5000))
+    ))
+
+@app.get("/index/manufacturers", tags=["Read Operations"])
+async def index_manufacturers():
+    return {"manufacturers": await asyncio.to_thread(chain_index.manufacturers), "indexComplete": chain_index.caught_up}
+
+@app.get("/index/summary", tags=["Read Operations"])
+async def index_summary(since: Optional[int] = None, until: Optional[int] = None):
+    """Dashboard counts, optionally limited to events in [since, until) unix time."""
+    return {**await asyncio.to_thread(chain_index.summary, since, until), "indexComplete": chain_index.caught_up}
+
+@app.get("/index/status", tags=["Read Operations"])
+async def index_status():
+    return chain_index.stats()
+
 # ======================================================================
 # 3. Firebase setup, QC parsing, notifications, verification
 # ======================================================================
 
 _FIREBASE_READY = False
 _db = None
+_notifier: Optional[Notifier] = None
 
 def _init_firebase_once():
-    global _FIREBASE_READY, _db
+    global _FIREBASE_READY, _db, _notifier
     if _FIREBASE_READY:
         return
     if not _FBASE_OK_IMPORT:
@@ -576,6 +1227,8 @@ def _init_firebase_once():
             if not firebase_admin._apps:
                 firebase_admin.initialize_app()
         _db = firestore.client()
+        _notifier = Notifier(_db, messaging, FieldFilter, firestore.DELETE_FIELD,
+                             concurrency=int(os.getenv("NOTIFY_CONCURRENCY", 8)))
         _FIREBASE_READY = True
         print("✅ Firebase initialized.")
     except Exception as e:
@@ -595,213 +1248,113 @@ def _send_push_to_token(token: str, title: str, body: str, data: Optional[Dict[s
     except Exception as e:
         print(f"❌ Push send error: {e}")
 
-async def _notify_users_of_failed_batch(batch_id: str):
+async def _notify_users_of_failed_batch(batch_id: str) -> Dict[str, Any]:
+    """Pushes a QC failure alert to every owner of the batch. Returns the fan-out's delivery metrics."""
     _init_firebase_once()
     if not _FIREBASE_READY:
         print("Firebase is not initialized. Cannot send notifications.")
-        return 0
-
-    user_ids = set()
-    try:
-        scans_ref = _db.collection('scans')
-        query_results = scans_ref.where('batchNumber', '==', batch_id).stream()
-        
-        for doc in query_results:
-            user_id = doc.to_dict().get('userId')
-            if user_id:
-                user_ids.add(user_id)
-    except Exception as e:
-        print(f"Error querying Firestore for user IDs: {e}")
-        return 0
+        return {"users": 0, "tokens": 0, "sent": 0}
 
+    user_ids = await asyncio.to_thread(_notifier.user_ids_for_batch, batch_id)
     if not user_ids:
         print(f"No users found with products from batch {batch_id}.")
-        return 0
-
-    tokens = []
-    try:
-        users_ref = _db.collection('users')
-        for user_id in user_ids:
-            user_doc = users_ref.document(user_id).get()
-            if user_doc.exists:
-                fcm_token = user_doc.to_dict().get('fcmToken')
-                if fcm_token:
-                    tokens.append(fcm_token)
-    except Exception as e:
-        print(f"Error retrieving FCM tokens: {e}")
-        return 0
-
-    if not tokens:
-        print("No FCM tokens found for the users.")
-        return 0
-    
-    title = "QC Alert: Product Failure"
-    body = f"A product you own from batch {batch_id} has failed a recent quality control check. It is not considered safe to consume."
-    
-    for t in tokens:
-        _send_push_to_token(
-            t,
-            title=title,
-            body=body,
-            data={"batchId": batch_id, "qcStatus": "NOT_STANDARD"}
-        )
-    
-    return len(tokens)
+        return {"users": 0, "tokens": 0, "sent": 0}
+
+    metrics = await _notifier.fan_out(
+        user_ids,
+        title="QC Alert: Product Failure",
+        body=f"A product you own from batch {batch_id} has failed a recent quality control check. It is not considered safe to consume.",
+        data={"batchId": batch_id, "qcStatus": "NOT_STANDARD"}
+    )
+    print(f"✅ Batch {batch_id} alert: {metrics['sent']}/{metrics['tokens']} tokens, "
+          f"{metrics['pruned']} stale pruned, {metrics['elapsedMs']:.0f} ms")
+    return metrics
+
+@app.get("/notification_stats", tags=["Read Operations"])
+async def notification_stats():
+    """Delivery totals across fan-outs since startup."""
+    return _notifier.stats() if _notifier is not None else {"fanOuts": 0}
+
+# Expiry alerts run as a daily job (one per date, so uvicorn workers sharing
+# JOBS_DIR don't repeat it) that only reads scans entering the 30-day window.
+EXPIRY_CHECK_INTERVAL = float(os.getenv("EXPIRY_CHECK_INTERVAL", 3600))
+expiry_alerts = ExpiryAlerts(
+    os.path.join(JOBS_DIR, "expiry_alerts.db"),
+    window_days=int(os.getenv("EXPIRY_WINDOW_DAYS", 30))
+)
+_expiry_task: Optional[asyncio.Task] = None
 
-async def _check_expiries_and_notify():
+async def _check_expiries_and_notify() -> Dict[str, Any]:
     _init_firebase_once()
     if not _FIREBASE_READY:
         print("Firebase not ready. Skipping expiry check.")
-        return
+        return {"alerts": 0}
+    summary = await expiry_alerts.run(_notifier)
+    print(f"✅ Expiry check {summary['windowStart']}..{summary['windowEnd']}: {summary['alerts']} alerts "
+          f"from {summary['scansRead']} scans, {summary['sent']} pushes sent")
+    return summary
 
-    today = datetime.now()
-    one_month_from_now = today + timedelta(days=30)
+async def _run_expiry_alerts_job(job) -> Dict[str, Any]:
+    return await _check_expiries_and_notify()
 
-    try:
-        scans_ref = _db.collection('scans')
-        query_results = scans_ref.stream()
-
-        for doc in query_results:
-            scan_data = doc.to_dict()
-            expiry_date_str = scan_data.get('expiryDate')
-            user_id = scan_data.get('userId')
-            product_name = scan_data.get('productName')
-
-            if not expiry_date_str or not user_id or not product_name:
-                continue
-
-            try:
-                expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d')
-                if today < expiry_date <= one_month_from_now:
-                    user_doc = _db.collection('users').document(user_id).get()
-                    if user_doc.exists:
-                        fcm_token = user_doc.to_dict().get('fcmToken')
-                        if fcm_token:
-                            _send_push_to_token(
-                                fcm_token,
-                                title='Product Expiry Alert',
-                                body=f'Your {product_name} is expiring on {expiry_date_str}!',
-                                data={'productId': doc.id, 'alertType': 'expiry'}
-                            )
-            except ValueError as e:
-                print(f"Invalid date format for product {doc.id}: {e}")
+job_queue.register("expiry_alerts", _run_expiry_alerts_job, concurrency=1)
 
-    except Exception as e:
-        print(f"Error during expiry check: {e}")
-
-def _normalize_passfail(val: Any) -> str:
-    s = str(val).strip().upper()
-    s = s.replace("✅", "").replace("❌", "").strip()
-    if s in ["PASS", "P", "OK", "TRUE", "1", "YES", "Y"]:
-        return "PASS"
-    return "FAIL" if s in ["FAIL", "F", "NO", "N", "0", "FALSE"] else s
-
-def _normalize_qc_item(item: Dict[str, Any]) -> Dict[str, Any]:
-    key_map = {
-        "productBatch": "productBatch",
-        "product_batch": "productBatch",
-        "Batch ID": "productBatch",
-        "BatchId": "productBatch",
-        "Batch": "productBatch",
-        "batch_id": "productBatch",
-        "status": "PassFail",
-        "PassFail": "PassFail",
-        "Pass/Fail": "PassFail",
-        "Result": "PassFail",
-        "isStandard": "PassFail"
-    }
-    normalized = {}
-    for k, v in item.items():
-        if k in key_map:
-            nk = key_map[k]
-            normalized[nk] = v
-        if k == "qcResults" and isinstance(v, dict):
-            if "Pass" in v.values() or "pass" in v.values():
-                normalized["PassFail"] = "PASS"
-            if "Fail" in v.values() or "fail" in v.values():
-                normalized["PassFail"] = "FAIL"
-    for key, val in item.items():
-        if isinstance(val, dict):
-            if "qcResults" in val and isinstance(val["qcResults"], dict):
-                if any(x.lower() == "fail" for x in val["qcResults"].values()):
-                    normalized["PassFail"] = "FAIL"
-                    break
-                elif any(x.lower() == "pass" for x in val["qcResults"].values()):
-                    if "PassFail" not in normalized or normalized["PassFail"] != "FAIL":
-                        normalized["PassFail"] = "PASS"
-    return normalized
-
-def _parse_qc_file_to_json(file_bytes: bytes, filename: str) -> List[Dict[str, Any]]:
-    lower = filename.lower()
-    rows: List[Dict[str, Any]] = []
-
-    if lower.endswith(".json"):
-        try:
-            data = json.loads(file_bytes.decode("utf-8"))
-            if isinstance(data, dict) and "qcSubmissions" in data:
-                data = data["qcSubmissions"]
-            if isinstance(data, dict):
-                data = [data]
-            if not isinstance(data, list):
-                raise ValueError("JSON must be an array or object.")
-            rows = [ _normalize_qc_item(r) for r in data ]
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
-    elif lower.endswith(".csv"):
+async def _schedule_expiry_alerts():
+    while True:
         try:
-            csv_text = file_bytes.decode("utf-8")
-            reader = csv.DictReader(StringIO(csv_text))
-            for r in reader:
-                rows.append(_normalize_qc_item(r))
+            job_queue.enqueue("expiry_alerts", {}, idempotency_key=f"expiry_alerts:{datetime.now().date().isoformat()}")
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid CSV: {e}")
-    elif lower.endswith(".xlsx") or lower.endswith(".xls"):
-        if not _PANDAS_OK:
-            raise HTTPException(status_code=400, detail="XLS/XLSX provided but pandas is not installed on server.")
-        try:
-            df = pd.read_excel(BytesIO(file_bytes))
-            rows = [ _normalize_qc_item(r) for r in df.to_dict(orient="records") ]
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid Excel: {e}")
-    else:
-        raise HTTPException(status_code=400, detail="Unsupported file type. Upload JSON, CSV, or XLSX.")
-
-    for idx, r in enumerate(rows):
-        if "productBatch" not in r:
-            if "product_batch" in r:
-                r["productBatch"] = r["product_batch"]
-            elif "Batch ID" in r:
-                r["productBatch"] = r["Batch ID"]
-            elif "BatchId" in r:
-                r["productBatch"] = r["BatchId"]
-            elif "Batch" in r:
-                r["productBatch"] = r["Batch"]
-            elif "batch_id" in r:
-                r["productBatch"] = r["batch_id"]
-            else:
-                raise HTTPException(status_code=400, detail=f"Row {idx} missing key 'productBatch' after normalization.")
-        
-        if "PassFail" not in r:
-            normalized_row = _normalize_qc_item(r)
-            if "PassFail" not in normalized_row:
-                raise HTTPException(status_code=400, detail=f"Row {idx} missing key 'PassFail' after normalization.")
-            r = normalized_row
+            print(f"❌ Could not queue the expiry check: {e}")
+        await asyncio.sleep(EXPIRY_CHECK_INTERVAL)
+
+@app.on_event("startup")
+async def _start_expiry_scheduler():
+    global _expiry_task
+    if _FBASE_OK_IMPORT and EXPIRY_CHECK_INTERVAL > 0:
+        _expiry_task = asyncio.create_task(_schedule_expiry_alerts())
 
-        r["PassFail"] = _normalize_passfail(r["PassFail"])
-    return rows
+@app.on_event("shutdown")
+async def _stop_expiry_scheduler():
+    if _expiry_task is not None:
+        _expiry_task.cancel()
+
+@app.get("/expiry_alert_stats", tags=["Read Operations"])
+async def expiry_alert_stats():
+    return expiry_alerts.stats()
 
 @app.post("/verify", tags=["Watermark + Verification"])
-async def verify_unified(file: UploadFile = File(...)):
+async def verify_unified(file: UploadFile = File(...), resilient: bool = False):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image.")
     try:
         image_stream = await file.read()
-        image_array = np.frombuffer(image_stream, np.uint8)
-        img_cv2 = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        if img_cv2 is None:
-            raise ValueError("Failed to decode image.")
-        decoded_hash = decode_watermark(img_cv2)
+        key = _upload_key(image_stream, resilient)
+        cached = verify_cache.get_verified(*key)
+        if cached is not None:
+            return cached
+        decoded, img_cv2 = await _decode_upload(image_stream, key, resilient)
+        decoded_hash = decoded["hash"]
         if not decoded_hash:
+            # Visual matches come from the image index and are not cached.
+            if img_cv2 is None:
+                img_cv2 = await cpu_stages.run("imdecode", _imdecode_label, image_stream, resilient)
+            candidates = await _visual_candidates(img_cv2)
+            if candidates:
+                # Looks like a registered label, but a visual match is not proof:
+                # a copied label looks the same. Report it as unverified.
+                best = candidates[0]
+                exists, is_standard = await asyncio.to_thread(chain_reads.call, "checkProductStandard", best["batchId"])
+                qc_status = "No QC data"
+                if exists:
+                    qc_status = "STANDARD ✅" if is_standard else "NOT STANDARD ❌"
+                return {
+                    "status": "WATERMARK_UNREADABLE_VISUAL_MATCH ⚠",
+                    "decodedHash": None,
+                    "batchId": best["batchId"],
+                    "qcStatus": qc_status,
+                    "productDetails": None,
+                    "candidates": candidates
+                }
             return {
                 "status": "COUNTERFEIT_OR_DAMAGED ❌",
                 "decodedHash": None,
@@ -810,31 +1363,39 @@ async def verify_unified(file: UploadFile = File(...)):
                 "productDetails": None
             }
         clean_hash = decoded_hash.lstrip("0x").lower()
-        product_details = contract.functions.viewProductDetails(clean_hash).call()
+        # Taken before the reads: if the cache syncs past it mid-request, the
+        # entry just looks older than it is and is evicted sooner.
+        read_block = chain_reads.consistent_block()
+        product_details = await asyncio.to_thread(chain_reads.call, "viewProductDetails", clean_hash)
         if not product_details[0]:
-            return {
+            response = {
                 "status": "COUNTERFEIT ❌",
                 "decodedHash": decoded_hash,
+                "watermarkConfidence": decoded["confidence"],
                 "batchId": None,
                 "qcStatus": "Unknown",
                 "productDetails": None
             }
+            if read_block is not None:
+                verify_cache.put_verified(*key, response, product_tag(decoded_hash), read_block, VERIFY_TTL_PENDING)
+            return response
         pid, cid, batch, manufacturer = product_details
-        exists, is_standard = contract.functions.checkProductStandard(batch).call()
+        exists, is_standard = await asyncio.to_thread(chain_reads.call, "checkProductStandard", batch)
         qc_status = "No QC data"
         if exists:
             qc_status = "STANDARD ✅" if is_standard else "NOT STANDARD ❌"
         ipfs_cid = cid.replace("ipfs://", "")
-        ipfs_data = fetch_from_ipfs(ipfs_cid)
+        ipfs_data = await fetch_from_ipfs(ipfs_cid)
         if qc_status == "STANDARD ✅":
             overall = "SAFE_TO_EAT ✅"
         elif qc_status == "NOT STANDARD ❌":
             overall = "QC_FAIL ❌"
         else:
             overall = "AUTHENTIC ✅"
-        return {
+        response = {
             "status": overall,
             "decodedHash": decoded_hash,
+            "watermarkConfidence": decoded["confidence"],
             "batchId": batch,
             "qcStatus": qc_status,
             "productDetails": {
@@ -844,6 +1405,11 @@ async def verify_unified(file: UploadFile = File(...)):
                 "ipfs": ipfs_data
             }
         }
+        # A failed IPFS fetch is worth retrying on the next scan.
+        if read_block is not None and ipfs_data is not None:
+            ttl = VERIFY_TTL_QC if exists else VERIFY_TTL_PENDING
+            verify_cache.put_verified(*key, response, batch_tag(batch), read_block, ttl)
+        return response
     except HTTPException:
         raise
     except Exception as e:
@@ -852,6 +1418,85 @@ async def verify_unified(file: UploadFile = File(...)):
 # ======================================================================
 # 4. NEW: REPORTING API ENDPOINTS
 # ======================================================================
+# ------------------------
+# Report listing
+# ------------------------
+# /view_reports reads one page at a time, newest first, optionally projected
+# to the fields the caller shows and filtered on the server. The cursor is
+# the id of the last report on the previous page. Filters combined with the
+# timestamp ordering need the matching composite indexes in Firestore (the
+# console links to them from the first failing query).
+#
+# The dashboard summary counts reports with aggregation queries and ranks
+# product hashes over a recent window only, so its cost doesn't track
+# all-time volume; it is cached for REPORTS_SUMMARY_TTL seconds and dropped
+# on every report write.
+REPORT_STATUSES = ("pending", "approved")
+REPORTS_SUMMARY_TTL = float(os.getenv("REPORTS_SUMMARY_TTL", 60))
+_reports_summary_cache: Dict[Tuple[int, int], Tuple[float, Dict[str, Any]]] = {}
+
+def _json_default(value: Any):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def _report_item(doc) -> Dict[str, Any]:
+    report_data = doc.to_dict() or {}
+    report_data["id"] = doc.id
+    return report_data
+
+def _reports_query(status: Optional[str], product_hash: Optional[str], since: Optional[int],
+                   until: Optional[int], fields: Optional[str], cursor: Optional[str], limit: int):
+    query = _db.collection("reports")
+    if status:
+        query = query.where(filter=FieldFilter("status", "==", status))
+    if product_hash:
+        query = query.where(filter=FieldFilter("productHash", "==", product_hash))
+    if since is not None:
+        query = query.where(filter=FieldFilter("timestamp", ">=", datetime.fromtimestamp(since, tz=timezone.utc)))
+    if until is not None:
+        query = query.where(filter=FieldFilter("timestamp", "<", datetime.fromtimestamp(until, tz=timezone.utc)))
+    query = query.order_by("timestamp", direction=firestore.Query.DESCENDING)
+    if fields:
+        query = query.select([f.strip() for f in fields.split(",") if f.strip()])
+    if cursor:
+        last = _db.collection("reports").document(cursor).get()
+        if not last.exists:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        query = query.start_after(last)
+    return query.limit(limit)
+
+def _report_lines(query, limit: int):
+    count = 0
+    last_id = None
+    try:
+        for doc in query.stream():
+            yield json.dumps(_report_item(doc), default=_json_default) + "\n"
+            count += 1
+            last_id = doc.id
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    yield json.dumps({"nextCursor": last_id if count == limit else None, "count": count}) + "\n"
+
+def _count(query) -> int:
+    return int(query.count().get()[0][0].value)
+
+def _reports_summary(days: int, top: int) -> Dict[str, Any]:
+    reports = _db.collection("reports")
+    total = _count(reports)
+    by_status = {s: _count(reports.where(filter=FieldFilter("status", "==", s))) for s in REPORT_STATUSES}
+    by_status["other"] = total - sum(by_status.values())
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    recent = reports.where(filter=FieldFilter("timestamp", ">=", since)).select(["productHash"])
+    hashes = Counter((doc.to_dict() or {}).get("productHash") for doc in recent.stream())
+    hashes.pop(None, None)
+    return {
+        "total": total,
+        "byStatus": by_status,
+        "windowDays": days,
+        "reportsInWindow": sum(hashes.values()),
+        "topProductHashes": [{"productHash": h, "reports": n} for h, n in hashes.most_common(top)],
+        "generatedAt": time.time(),
+    }
+
 @app.post("/add_report", tags=["Reporting"])
 async def add_report(report: ReportRequest):
     _init_firebase_once()
@@ -866,26 +1511,63 @@ async def add_report(report: ReportRequest):
             "status": "pending"
         }
         _db.collection("reports").add(report_data)
+        _reports_summary_cache.clear()
         return {"message": "Report submitted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit report: {str(e)}")
 
 @app.get("/view_reports", tags=["Reporting"])
-async def view_reports():
+async def view_reports(
+    status: Optional[str] = None,
+    productHash: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    format: str = "json"
+):
+    """
+    One page of reports, newest first. Filter on status, productHash and
+    [since, until) unix time; `fields` (comma-separated) limits what each
+    report carries besides its id. Pass nextCursor back for the next page; a
+    null nextCursor means there is nothing further. format=ndjson streams the
+    page one report per line (up to 50000), ending with {"nextCursor", "count"}.
+    """
     _init_firebase_once()
     if not _FIREBASE_READY:
         raise HTTPException(status_code=500, detail="Firebase is not initialized.")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson.")
+    limit = max(1, min(limit, 50000 if format == "ndjson" else 1000))
     try:
-        reports_ref = _db.collection("reports")
-        reports = []
-        for doc in reports_ref.stream():
-            report_data = doc.to_dict()
-            report_data['id'] = doc.id
-            reports.append(report_data)
-        return {"reports": reports}
+        query = await asyncio.to_thread(_reports_query, status, productHash, since, until, fields, cursor, limit)
+        if format == "ndjson":
+            return StreamingResponse(_report_lines(query, limit), media_type="application/x-ndjson")
+        reports = await asyncio.to_thread(lambda: [_report_item(doc) for doc in query.stream()])
+        return {"reports": reports, "nextCursor": reports[-1]["id"] if len(reports) == limit else None}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve reports: {str(e)}")
 
+@app.get("/view_reports/summary", tags=["Reporting"])
+async def view_reports_summary(days: int = 30, top: int = 10):
+    """Counts by status and the most reported product hashes of the last `days` days (cached briefly)."""
+    _init_firebase_once()
+    if not _FIREBASE_READY:
+        raise HTTPException(status_code=500, detail="Firebase is not initialized.")
+    key = (max(1, min(days, 365)), max(1, min(top, 100)))
+    cached = _reports_summary_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return {**cached[1], "cached": True}
+    try:
+        summary = await asyncio.to_thread(_reports_summary, *key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to summarize reports: {str(e)}")
+    _reports_summary_cache[key] = (time.monotonic() + REPORTS_SUMMARY_TTL, summary)
+    return {**summary, "cached": False}
+
 @app.delete("/delete_report/{report_id}", tags=["Reporting"])
 async def delete_report(report_id: str):
     _init_firebase_once()
@@ -893,10 +1575,12 @@ async def delete_report(report_id: str):
         raise HTTPException(status_code=500, detail="Firebase is not initialized.")
     try:
         report_ref = _db.collection("reports").document(report_id)
-        await report_ref.delete()
+        report_ref.delete()
+        _reports_summary_cache.clear()
         return {"message": f"Report {report_id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete report: {str(e)}")
+
 @app.post("/approve_report/{report_id}", tags=["Reporting"])
 async def approve_report(report_id: str):
     """
@@ -913,7 +1597,8 @@ async def approve_report(report_id: str):
             raise HTTPException(status_code=404, detail="Report not found.")
 
         report_ref.update({"status": "approved", "approvedAt": firestore.SERVER_TIMESTAMP})
-        
+        _reports_summary_cache.clear()
+
         return {"message": f"Report {report_id} approved successfully."}
     except HTTPException:
         raise
@@ -924,76 +1609,209 @@ async def approve_report(report_id: str):
 # 5. NEW: COMBINED QC SUBMISSION ENDPOINT
 # ======================================================================
 
+async def _run_qc_batch_notify_job(job) -> Dict[str, Any]:
+    batch_num = job.params["batchNumber"]
+    async def notify():
+        return await _notify_users_of_failed_batch(batch_num)
+    delivery = await job.step("notify", notify)
+    return {"batchNumber": batch_num, "delivery": delivery}
+
+async def _run_qc_submission_job(job) -> Dict[str, Any]:
+    """Pins the QC JSON once, then sends every batch tx in one pipelined run and confirms them together.
+
+    Failed-batch notifications are queued as their own jobs, so the
+    submission finishes once its transactions are mined.
+    """
+    params = job.params
+    uploader_id = params["uploaderId"]
+    batches = params["batches"]
+
+    async def pin():
+        if "payloadPath" in params:
+            with open(params["payloadPath"], "rb") as fh:
+                payload = fh.read()
+        else:
+            # Queued before QC documents were spooled to disk.
+            payload = params["payload"].encode("utf-8")
+        cid = await upload_to_ipfs(payload, params["ipfsFilename"])
+        if not cid:
+            raise RuntimeError("Failed to upload QC JSON to IPFS.")
+        return cid
+
+    qc_uri = f"ipfs://{await job.step('pin', pin)}"
+
+    # Each batch's signed transaction is checkpointed before it is broadcast,
+    # so a replay follows it instead of sending the batch again.
+    unsent = [(b, std) for b, std in batches if f"tx:{b}" not in job.checkpoints]
+
+    def record_plans(plans):
+        for i, plan in plans:
+            job.record(f"tx:{unsent[i][0]}", plan)
+
+    try:
+        sent = await tx_pipeline.submit_many([
+            (contract.functions.addQCSubmission(uploader_id, qc_uri, b, std), 300000, f"addQCSubmission:{b}")
+            for b, std in unsent
+        ], on_signed=record_plans)
+    except Exception:
+        # Failed before broadcasting; plans recorded so far were never sent.
+        for b, _ in unsent:
+            job.forget(f"tx:{b}")
+        raise
+    send_errors = []
+    for (batch_num, _), record in zip(unsent, sent):
+        if isinstance(record, Exception):
+            job.forget(f"tx:{batch_num}")
+            send_errors.append(f"{batch_num}: {record}")
+    if send_errors:
+        # Retried as a whole; the batches the node accepted are not sent again.
+        raise RuntimeError(f"{len(send_errors)} of {len(batches)} QC transactions not sent ({send_errors[0]}).")
+
+    async def confirm(batch_num: str) -> Dict[str, Any]:
+        plan = job.checkpoints[f"tx:{batch_num}"]
+        tx_id = plan["txId"]
+        if tx_pipeline.get(tx_id) is None:
+            # Signed before a restart: follow (or re-send) the recorded transaction.
+            tx_id = (await tx_pipeline.adopt(plan, label=f"addQCSubmission:{batch_num}"))["txId"]
+        # Gas bumps replace the hash; keep every one of them on record.
+        tx_pipeline.on_resend(tx_id, lambda plan: job.record(f"tx:{batch_num}", plan))
+        try:
+            record = await tx_pipeline.wait(tx_id, timeout=TX_CONFIRM_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"QC transaction for batch {batch_num} not resolved after {TX_CONFIRM_TIMEOUT:.0f}s.")
+        if record["status"] == DROPPED:
+            # Never mined: the retry sends this batch again.
+            job.forget(f"tx:{batch_num}")
+            raise RuntimeError(f"QC transaction for batch {batch_num} dropped: {record['error']}")
+        return {"status": record["status"], "transaction_hash": record["transaction_hash"], "receipt": record["receipt"],
+                "error": record["error"]}
+
+    receipts = await asyncio.gather(*(
+        job.step(f"receipt:{b}", lambda b=b: confirm(b)) for b, _ in batches
+    ))
+
+    results = []
+    for (batch_num, batch_is_standard), receipt in zip(batches, receipts):
+        results.append({
+            "batchNumber": batch_num,
+            "isStandard": batch_is_standard,
+            "txStatus": receipt["status"],
+            "transaction_hash": receipt["transaction_hash"],
+            "error": receipt.get("error"),
+        })
+        if receipt["status"] == CONFIRMED and not batch_is_standard:
+            # The key makes a replayed submission reuse the batch's notify job.
+            job_queue.enqueue("qc_batch_notify", {"batchNumber": batch_num},
+                              idempotency_key=f"qc_batch_notify:{job.id}:{batch_num}")
+    failed = [r["batchNumber"] for r in results if r["txStatus"] != CONFIRMED]
+    if len(failed) == len(results):
+        raise JobFailed(f"Transaction failed or stuck for batch(es) {', '.join(map(str, failed))}.")
+
+    if "payloadPath" in params and os.path.exists(params["payloadPath"]):
+        os.remove(params["payloadPath"])
+    confirmed = [r for r in results if r["txStatus"] == CONFIRMED]
+    return {
+        "message": "QC submission added successfully" if not failed
+                   else f"QC submission added; {len(failed)} of {len(results)} batch transactions failed or are stuck",
+        "uploaderId": uploader_id,
+        "uploadDate": params["uploadDate"],
+        "qcUri": qc_uri,
+        "batchesProcessed": [r["batchNumber"] for r in confirmed],
+        "failedBatches": failed,
+        "batches": results,
+        "transaction_hash": confirmed[-1]["transaction_hash"]
+    }
+
+job_queue.register("qc_submission", _run_qc_submission_job)
+job_queue.register("qc_batch_notify", _run_qc_batch_notify_job, concurrency=1)
+
+def _spool_qc_document(stream, filename: str, meta: Dict[str, Any], path: str) -> QCSummary:
+    """Parses the upload into per-batch results while writing the QC JSON to pin to `path`."""
+    tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            document = QCDocumentWriter(fh, meta)
+            summary = parse_qc_stream(stream, filename, document)
+            document.close()
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return summary
+
 @app.post("/add_qc_submission", tags=["Write Operations"])
 async def add_qc_submission(
+    request: Request,
     uploaderId: str = Form(...),
     uploadDate: str = Form(...),
     qc_file: UploadFile = File(...),
+    wait: bool = True,
 ):
-    raw_bytes = await qc_file.read()
-    qc_rows = _parse_qc_file_to_json(raw_bytes, qc_file.filename)
-    batch_numbers = sorted(list(set(r["productBatch"] for r in qc_rows)))
-    if not batch_numbers:
+    """
+    Queues the QC upload as a persistent job (pin, one tx per batch sent as a
+    single pipelined run, failure notifications as follow-up jobs); the
+    result lists each batch's tx status. A retry with the same Idempotency-Key header, or the same
+    uploader/date/file when no header is sent, returns the original job
+    instead of pinning and submitting again; if that job failed, it is re-run
+    from its checkpoints. With wait=false, or once JOBS_WAIT_TIMEOUT passes,
+    the response is a 202 with the job id to poll at /jobs/{jobId}.
+    """
+    # The upload is already spooled by Starlette: hash it in chunks, then
+    # parse it from the start. Each request writes the QC JSON to pin to its
+    # own file: a job only ever reads the copy it was created with, and a
+    # request that lands on an existing job discards its copy.
+    digest = hashlib.sha256(f"{uploaderId}|{uploadDate}|{qc_file.filename}|".encode("utf-8"))
+    for chunk in iter(lambda: qc_file.file.read(1 << 20), b""):
+        digest.update(chunk)
+    qc_file.file.seek(0)
+    meta = {
+        "uploaderId": uploaderId,
+        "uploadDate": uploadDate,
+        "sourceFilename": qc_file.filename
+    }
+    payload_path = os.path.join(JOBS_DIR, f"qc_{digest.hexdigest()}_{secrets.token_hex(4)}.json")
+    try:
+        summary = await asyncio.to_thread(_spool_qc_document, qc_file.file, qc_file.filename, meta, payload_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not summary.batches:
+        os.remove(payload_path)
         raise HTTPException(status_code=400, detail="No valid batch numbers found in the QC file.")
-    payload = {
-        "meta": {
+    batches = summary.batch_results()
+
+    idempotency_key = request.headers.get("Idempotency-Key") or digest.hexdigest()
+
+    job, created = job_queue.enqueue(
+        "qc_submission",
+        {
             "uploaderId": uploaderId,
             "uploadDate": uploadDate,
-            "sourceFilename": qc_file.filename
+            "payloadPath": payload_path,
+            "ipfsFilename": f"qc_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.json",
+            "batches": batches,
         },
-        "qc": qc_rows
-    }
-    payload_bytes = json.dumps(payload, indent=2).encode("utf-8")
-    qc_cid = upload_to_ipfs(payload_bytes, f"qc_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.json")
-    if not qc_cid:
-        raise HTTPException(status_code=500, detail="Failed to upload QC JSON to IPFS.")
-    qc_uri = f"ipfs://{qc_cid}"
-    
-    try:
-        for batch_num in batch_numbers:
-            batch_is_standard = all(_normalize_passfail(r["PassFail"]) == "PASS" for r in qc_rows if r["productBatch"] == batch_num)
-            
-            current_nonce = get_nonce()
-
-            txn = contract.functions.addQCSubmission(
-                uploaderId, 
-                qc_uri, 
-                batch_num, 
-                batch_is_standard
-            ).build_transaction({
-                "from": account_address,
-                "nonce": current_nonce,
-                "gas": 300000,
-                "gasPrice": w3.eth.gas_price,
-                "chainId": chain_id
-            })
-            tx_hash, receipt = sign_and_send_tx(txn)
-            if receipt.status == 0:
-                raise HTTPException(status_code=500, detail=f"Transaction failed on the blockchain for batch {batch_num}.")
-            
-            if not batch_is_standard:
-                await _notify_users_of_failed_batch(batch_num)
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-        
-    return {
-        "message": "QC submission added successfully",
-        "uploaderId": uploaderId,
-        "uploadDate": uploadDate,
-        "qcUri": qc_uri,
-        "batchesProcessed": batch_numbers,
-        "transaction_hash": tx_hash
-    }
+        idempotency_key=f"qc_submission:{idempotency_key}"
+    )
+    if not created:
+        # The existing job pins the copy it was queued with.
+        os.remove(payload_path)
+    if not wait:
+        message = "QC submission queued" if created else "QC submission already received"
+        return JSONResponse(status_code=202, content={"message": message, **job_fields(job)})
+
+    return await job_result(job)
 
 @app.get("/check_expiries")
-async def check_expiries():
+async def check_expiries(wait: bool = False):
     """
-    Manually triggers the expiry date notification check.
-    For testing purposes. In a production environment, this would be a scheduled task.
+    Queues an expiry check now instead of waiting for the scheduler. It only
+    alerts about scans that entered the window since the last check. With
+    wait=true the response is the run's summary.
     """
-    await _check_expiries_and_notify()
-    return {"message": "Expiry check initiated."}
+    job, _ = job_queue.enqueue("expiry_alerts", {})
+    if not wait:
+        return {"message": "Expiry check initiated.", **job_fields(job)}
+    return await job_result(job)
 
 
 # ------------------------
@@ -0,0 +1,136 @@
+# test_ipfs_standin.py
+"""
+IPFSClient against ipfs_standin servers on loopback ports.
+
+    cd Python && python -m pytest -q test_ipfs_standin.py
+"""
+import asyncio
+
+from cid_cache import CIDCache
+from ipfs_client import GatewaySource, IPFSClient, PinataBackend, compute_cid_v0
+from ipfs_standin import IPFSStandIn
+
+def _run(scenario, *standins, **client_args):
+    """Starts the stand-ins, builds a client over their gateways and awaits scenario(client, urls)."""
+    async def main():
+        urls = [await s.start() for s in standins]
+        client = IPFSClient([GatewaySource(url) for url in urls], PinataBackend("key", "secret", urls[0]),
+                            timeout=5.0, retries=0, backoff=0.01, **client_args)
+        try:
+            return await scenario(client, urls)
+        finally:
+            await client.close()
+            for s in standins:
+                await s.stop()
+    return asyncio.run(main())
+
+# ------------------------
+# Cache fills
+# ------------------------
+def test_verified_fetch_fills_the_cache(tmp_path):
+    standin = IPFSStandIn()
+    data = b'{"productId": "P-1"}'
+    cid = standin.put(data)
+    cache = CIDCache(str(tmp_path), 1 << 20)
+
+    async def scenario(client, urls):
+        assert await client.fetch_bytes(cid) == data
+        requests = standin.requests
+        assert await client.fetch_bytes(cid) == data
+        return requests
+
+    requests = _run(scenario, standin, cache=cache)
+    assert requests == 1 and standin.requests == 1
+    assert cache.get(cid) == data
+
+def test_unverifiable_fetch_is_not_cached(tmp_path):
+    # Over one 256 KiB chunk the CID names a DAG root, which the client cannot check.
+    standin = IPFSStandIn()
+    data = b"x" * (300 * 1024)
+    cid = standin.put(data)
+    cache = CIDCache(str(tmp_path), 1 << 20)
+
+    async def scenario(client, urls):
+        assert await client.fetch_bytes(cid) == data
+        assert await client.fetch_bytes(cid) == data
+
+    _run(scenario, standin, cache=cache)
+    assert standin.requests == 2
+    assert cache.get(cid) is None
+
+def test_mismatched_content_is_rejected(tmp_path):
+    standin = IPFSStandIn()
+    cid = standin.put(b"original")
+    standin.blocks[cid] = b"tampered"
+    cache = CIDCache(str(tmp_path), 1 << 20)
+
+    async def scenario(client, urls):
+        return await client.fetch_bytes(cid)
+
+    assert _run(scenario, standin, cache=cache) is None
+    assert cache.get(cid) is None
+
+def test_upload_pins_and_caches(tmp_path):
+    standin = IPFSStandIn()
+    data = b"label metadata"
+    cache = CIDCache(str(tmp_path), 1 << 20)
+
+    async def scenario(client, urls):
+        return await client.upload(data, "meta.json")
+
+    cid = _run(scenario, standin, cache=cache)
+    assert cid == compute_cid_v0(data)
+    assert standin.blocks[cid] == data
+    assert cache.get(cid) == data
+
+# ------------------------
+# Gateway failover
+# ------------------------
+def test_failing_gateway_falls_over_to_the_next():
+    down, up = IPFSStandIn(fail_rate=1.0), IPFSStandIn()
+    data = b"served by the second gateway"
+    cid = up.put(data)
+    down.put(data)
+
+    async def scenario(client, urls):
+        return await client.fetch_bytes(cid)
+
+    assert _run(scenario, down, up, hedge_delay=10.0) == data
+    assert down.requests == 1 and up.requests == 1
+
+def test_missing_and_tampered_gateways_fall_over():
+    missing, tampered, good = IPFSStandIn(), IPFSStandIn(), IPFSStandIn()
+    data = b"only the third gateway has this right"
+    cid = good.put(data)
+    tampered.blocks[cid] = b"not it"
+
+    async def scenario(client, urls):
+        return await client.fetch_bytes(cid)
+
+    assert _run(scenario, missing, tampered, good, hedge_delay=10.0) == data
+    assert (missing.requests, tampered.requests, good.requests) == (1, 1, 1)
+
+def test_slow_gateway_is_hedged():
+    slow, fast = IPFSStandIn(latency=2.0), IPFSStandIn()
+    data = b"hedged"
+    cid = slow.put(data)
+    fast.put(data)
+
+    async def scenario(client, urls):
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        body = await client.fetch_bytes(cid)
+        return body, loop.time() - t0
+
+    body, elapsed = _run(scenario, slow, fast, hedge_delay=0.05)
+    assert body == data
+    assert elapsed < 1.0
+
+def test_all_gateways_down_returns_none():
+    a, b = IPFSStandIn(fail_rate=1.0), IPFSStandIn(fail_rate=1.0)
+    cid = a.put(b"unreachable")
+
+    async def scenario(client, urls):
+        return await client.fetch_bytes(cid)
+
+    assert _run(scenario, a, b, hedge_delay=10.0) is None
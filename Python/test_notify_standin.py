@@ -0,0 +1,160 @@
+# test_notify_standin.py
+"""
+Notifier and ExpiryAlerts against notify_standin's in-memory Firestore and FCM.
+
+    cd Python && python -m pytest -q test_notify_standin.py
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import notify_standin as ns
+from expiry_alerts import ExpiryAlerts
+from notifier import Notifier
+
+def _setup(tokens, **messaging_args):
+    """FakeFirestore with users u0.. holding `tokens`, and a Notifier over it."""
+    db = ns.FakeFirestore()
+    users = db.collection("users")
+    for i, token in enumerate(tokens):
+        users.document(f"u{i}").set({"fcmToken": token, "name": f"User {i}"})
+    messaging = ns.FakeMessaging(**messaging_args)
+    return db, messaging, Notifier(db, messaging, ns.FieldFilter, ns.DELETE_FIELD)
+
+def _user_ids(n):
+    return [f"u{i}" for i in range(n)]
+
+# ------------------------
+# Fan-out
+# ------------------------
+def test_shared_tokens_get_one_notification():
+    db, messaging, notifier = _setup(["t0", "t0", "t1", "t2", "t2"])
+    metrics = asyncio.run(notifier.fan_out(_user_ids(5), "Recall", "Batch B1 has been recalled."))
+    assert metrics["users"] == 5 and metrics["tokens"] == 3 and metrics["sent"] == 3
+    assert messaging.delivered == {"t0": 1, "t1": 1, "t2": 1}
+
+def test_dead_tokens_are_pruned():
+    db, messaging, notifier = _setup(["t0", "dead", "t2", "dead"], stale_tokens={"dead"})
+    metrics = asyncio.run(notifier.fan_out(_user_ids(4), "Recall", "body"))
+    assert metrics["sent"] == 2 and metrics["failed"] == 1 and metrics["pruned"] == 2
+    docs = db.collection("users").docs
+    assert "fcmToken" not in docs["u1"] and "fcmToken" not in docs["u3"]
+    assert docs["u1"]["name"] == "User 1"
+    assert docs["u0"]["fcmToken"] == "t0"
+
+    # The next fan-out no longer pays for them.
+    metrics = asyncio.run(notifier.fan_out(_user_ids(4), "Recall", "body"))
+    assert metrics["tokens"] == 2 and metrics["pruned"] == 0
+
+def test_pruning_is_batched():
+    n = 1200
+    db, messaging, notifier = _setup([f"dead-{i}" for i in range(n)], stale_tokens={f"dead-{i}" for i in range(n)})
+    writes = db.writes
+    metrics = asyncio.run(notifier.fan_out(_user_ids(n), "Recall", "body"))
+    assert metrics["pruned"] == n and metrics["multicasts"] == 3
+    assert db.writes - writes == 3
+    assert not any("fcmToken" in d for d in db.collection("users").docs.values())
+
+def test_refreshed_token_is_not_pruned():
+    db, messaging, notifier = _setup(["t0", "dead"], stale_tokens={"dead"})
+    users = db.collection("users")
+
+    async def main():
+        owners = await notifier.resolve_tokens(_user_ids(2))
+        # The app registers a new token between the read and the prune.
+        users.document("u1").set({"fcmToken": "fresh"})
+        return await notifier.deliver(owners, "Recall", "body")
+
+    metrics = asyncio.run(main())
+    assert metrics["pruned"] == 0
+    assert users.docs["u1"]["fcmToken"] == "fresh"
+
+def test_token_refreshed_during_prune_is_kept():
+    db, messaging, notifier = _setup(["dead-0", "dead-1", "dead-2"])
+    users = db.collection("users")
+    get_all = db.get_all
+    raced = []
+
+    def racing_get_all(refs, field_paths=None):
+        snaps = list(get_all(refs, field_paths))
+        if not raced:
+            raced.append(True)
+            users.document("u1").set({"fcmToken": "fresh"})
+        return snaps
+
+    db.get_all = racing_get_all
+    pruned = notifier._prune({"u0": "dead-0", "u1": "dead-1", "u2": "dead-2"})
+    assert pruned == 2
+    assert "fcmToken" not in users.docs["u0"] and "fcmToken" not in users.docs["u2"]
+    assert users.docs["u1"]["fcmToken"] == "fresh"
+
+def test_only_failed_tokens_are_resent():
+    db, messaging, notifier = _setup(["t0", "t1", "t2"], flaky_tokens={"t1"})
+    notifier.send_retries = 1
+    metrics = asyncio.run(notifier.fan_out(_user_ids(3), "Recall", "body"))
+    assert metrics["sent"] == 3 and metrics["failed"] == 0
+    assert messaging.delivered == {"t0": 1, "t1": 1, "t2": 1}
+    assert messaging.calls == 2
+
+def test_raising_multicast_is_not_repeated():
+    db, messaging, notifier = _setup(["t0", "t1"])
+    send = messaging.send_each_for_multicast
+
+    def send_then_raise(message):
+        send(message)
+        raise ConnectionError("connection reset")
+
+    notifier._send_multicast = send_then_raise
+    metrics = asyncio.run(notifier.fan_out(_user_ids(2), "Recall", "body"))
+    assert metrics["sent"] == 0 and metrics["failed"] == 2
+    assert messaging.delivered == {"t0": 1, "t1": 1}
+
+# ------------------------
+# Expiry alerts
+# ------------------------
+TODAY = date(2026, 10, 17)
+
+def _scan(db, scan_id, user_id, product, expires_in, written=None):
+    db.collection("scans").document(scan_id).set({
+        "userId": user_id,
+        "productName": product,
+        "expiryDate": (TODAY + timedelta(days=expires_in)).isoformat(),
+        "timestamp": written or datetime(2026, 1, 1, tzinfo=timezone.utc),
+    })
+
+def test_expiry_alerts_are_not_repeated_across_reruns(tmp_path):
+    db, messaging, notifier = _setup(["t0", "t1", "t2"])
+    _scan(db, "s0", "u0", "Amoxicillin", 5)
+    _scan(db, "s1", "u1", "Amoxicillin", 5)
+    _scan(db, "s2", "u2", "Ibuprofen", 20)
+    _scan(db, "s3", "u2", "Ibuprofen", 90)
+    _scan(db, "s4", "u0", "Aspirin", -3)
+    path = str(tmp_path / "expiry.db")
+
+    first = asyncio.run(ExpiryAlerts(path).run(notifier, TODAY))
+    assert first["alerts"] == 3 and first["sent"] == 3
+    assert messaging.delivered == {"t0": 1, "t1": 1, "t2": 1}
+
+    # Same day again, from a fresh instance on the same state (a restart).
+    again = asyncio.run(ExpiryAlerts(path).run(notifier, TODAY))
+    assert again["alerts"] == 0 and again["sent"] == 0
+
+    # A rescan of an alerted product plus a new scan already inside the window.
+    now = datetime.now(timezone.utc)
+    _scan(db, "s5", "u1", "Amoxicillin", 5, written=now)
+    _scan(db, "s6", "u1", "Paracetamol", 10, written=now)
+    rerun = asyncio.run(ExpiryAlerts(path).run(notifier, TODAY + timedelta(days=1)))
+    assert rerun["alerts"] == 1 and rerun["alreadyAlerted"] == 1
+    assert messaging.delivered == {"t0": 1, "t1": 2, "t2": 1}
+
+def test_expiry_window_only_reads_new_slices(tmp_path):
+    db, messaging, notifier = _setup(["t0"])
+    for i in range(50):
+        _scan(db, f"s{i}", "u0", f"P{i}", i * 3)
+    alerts = ExpiryAlerts(str(tmp_path / "expiry.db"), window_days=30)
+
+    first = asyncio.run(alerts.run(notifier, TODAY))
+    assert first["alerts"] == 10
+    # The next day, only expiries that just entered the window are read.
+    nxt = asyncio.run(alerts.run(notifier, TODAY + timedelta(days=3)))
+    assert nxt["alerts"] == 1
+    assert nxt["scansRead"] == 1
@@ -0,0 +1,461 @@
+# tx_pipeline.py
+import asyncio
+import bisect
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import requests
+from web3.exceptions import TransactionNotFound
+
+# ------------------------
+# Transaction pipeline for the server's signing account
+# ------------------------
+# One local nonce allocator feeds every write. Allocation, signing and
+# eth_sendRawTransaction happen under a single lock. A nonce whose send
+# fails outright goes back to the allocator as a hole, and holes are handed
+# out before fresh nonces, so the next transaction closes any gap and the ones
+# queued above it become minable. A nonce the node reports as taken ("nonce
+# too low", a replacement) triggers a resync from the "pending" count, which
+# never steps back over nonces this process still holds. Nobody blocks on
+# inclusion: a background task polls receipts, re-sends a stuck transaction
+# with the same nonce and a bumped gas price, and fires an optional webhook
+# once the transaction is final.
+#
+# submit_many() signs a run of calls against consecutive nonces and keeps up
+# to `rpc_concurrency` sends in flight, so N transactions cost about N /
+# rpc_concurrency round trips instead of N and all land in the same block or
+# two. Sends start in nonce order, so the node never holds more than that
+# many out-of-order nonces. Every call the node accepts is returned as sent,
+# wherever it sits in the run; only the rejected ones are signed again, once.
+# The signed transactions are handed to `on_signed` before the first one is
+# broadcast, so a caller can record them and a crash mid-run re-sends nothing
+# (adopt() re-broadcasts a recorded transaction the node never saw).
+# Receipts are fetched with the same fan-out.
+#
+# A caller that persists plan() can register on_resend() to get the updated
+# plan after each gas bump, so every hash the nonce was sent under survives a
+# restart. Once the account's mined nonce count passes a transaction's nonce
+# and none of its hashes has a receipt, another transaction took the nonce:
+# the record ends as DROPPED instead of waiting forever. A transaction still
+# unmined `bump_after` seconds after its last bump (max_bumps of them) ends
+# as STUCK with an error: its nonce holds back every later transaction from
+# the account, which needs an operator. STUCK records are still polled and
+# move to CONFIRMED / FAILED / DROPPED if that changes.
+
+PENDING = "pending"
+CONFIRMED = "confirmed"
+FAILED = "failed"      # mined with status 0
+DROPPED = "dropped"    # its nonce was mined by a transaction we don't know
+STUCK = "stuck"        # not mined after max_bumps gas bumps
+
+def _accepted(e: Exception) -> bool:
+    # The node already holds exactly this transaction (a retried send that went through).
+    return "already known" in str(e).lower()
+
+def _nonce_taken(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "nonce too low" in msg or "replacement transaction underpriced" in msg
+
+class TxPipeline:
+    def __init__(self, w3, private_key: str, account_address: str, chain_id: int,
+                 poll_interval: float = 2.0, bump_after: float = 45.0, bump_factor: float = 1.125,
+                 max_bumps: int = 5, gas_price_ttl: float = 10.0, keep_finished: int = 10_000,
+                 rpc_concurrency: int = 8):
+        self.w3 = w3
+        self.private_key = private_key
+        self.account_address = account_address
+        self.chain_id = chain_id
+        self.poll_interval = poll_interval
+        self.bump_after = bump_after
+        self.bump_factor = bump_factor
+        self.max_bumps = max_bumps
+        self.gas_price_ttl = gas_price_ttl
+        self.keep_finished = keep_finished
+        self.rpc_concurrency = rpc_concurrency
+
+        self._send_lock = threading.Lock()
+        self._next_nonce: Optional[int] = None
+        self._holes: List[int] = []
+        self._gas_price = (0, 0.0)
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._unsigned: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._resend_hooks: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # --- submission ---
+    def _current_gas_price(self) -> int:
+        price, fetched_at = self._gas_price
+        if time.monotonic() - fetched_at > self.gas_price_ttl:
+            price = self.w3.eth.gas_price
+            self._gas_price = (price, time.monotonic())
+        return price
+
+    def _resync_nonce(self):
+        # Holes below the node's count were filled by someone else.
+        node_nonce = self.w3.eth.get_transaction_count(self.account_address, "pending")
+        self._holes = [n for n in self._holes if n >= node_nonce]
+        self._next_nonce = max(node_nonce, self._next_nonce or 0)
+
+    def _allocate_nonce(self) -> int:
+        if self._holes:
+            return self._holes.pop(0)
+        nonce = self._next_nonce
+        self._next_nonce += 1
+        return nonce
+
+    def _release_nonce(self, nonce: int):
+        bisect.insort(self._holes, nonce)
+
+    def _build(self, contract_fn, gas: int, nonce: int, gas_price: int) -> Dict[str, Any]:
+        return contract_fn.build_transaction({
+            "from": self.account_address,
+            "nonce": nonce,
+            "gas": gas,
+            "gasPrice": gas_price,
+            "chainId": self.chain_id
+        })
+
+    def _sign(self, tx: Dict[str, Any]) -> Tuple[str, bytes]:
+        signed = self.w3.eth.account.sign_transaction(tx, self.private_key)
+        return self.w3.to_hex(signed.hash), signed.raw_transaction
+
+    def _sign_and_send(self, tx: Dict[str, Any]) -> str:
+        signed = self.w3.eth.account.sign_transaction(tx, self.private_key)
+        return self.w3.to_hex(self.w3.eth.send_raw_transaction(signed.raw_transaction))
+
+    def _send_new(self, contract_fn, gas: int, label: str) -> Dict[str, Any]:
+        with self._send_lock:
+            if self._next_nonce is None:
+                self._resync_nonce()
+            for attempt in range(2):
+                gas_price = self._current_gas_price()
+                nonce = self._allocate_nonce()
+                try:
+                    tx = self._build(contract_fn, gas, nonce, gas_price)
+                    tx_hash, raw = self._sign(tx)
+                except Exception:
+                    self._release_nonce(nonce)
+                    raise
+                sent = self._send_raw(raw)
+                if not isinstance(sent, Exception) or _accepted(sent):
+                    return self._new_record(tx, tx_hash, label)
+                if not _nonce_taken(sent):
+                    self._release_nonce(tx["nonce"])
+                    raise sent
+                if attempt == 1:
+                    raise sent
+                # Someone else used this account, or a previous process
+                # left transactions in the mempool.
+                self._resync_nonce()
+
+    def _new_record(self, tx: Dict[str, Any], tx_hash: str, label: str) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "txId": uuid.uuid4().hex,
+            "label": label,
+            "status": PENDING,
+            "nonce": tx["nonce"],
+            "gasPrice": tx["gasPrice"],
+            "transactionHashes": [tx_hash],
+            "transaction_hash": tx_hash,
+            "submittedAt": now,
+            "lastSentAt": now,
+            "bumps": 0,
+            "receipt": None,
+            "error": None,
+            "webhookUrl": None,
+            "_tx": tx,
+        }
+
+    def _send_raw(self, raw: bytes) -> Union[str, Exception]:
+        try:
+            return self.w3.to_hex(self.w3.eth.send_raw_transaction(raw))
+        except Exception as e:
+            return e
+
+    def _send_many(self, calls: List[Tuple[Any, int, str]],
+                   on_signed: Optional[Callable[[List[Tuple[int, Dict[str, Any]]]], None]] = None
+                   ) -> List[Union[Dict[str, Any], Exception]]:
+        results: List[Union[Dict[str, Any], Exception, None]] = [None] * len(calls)
+        with self._send_lock:
+            if self._next_nonce is None:
+                self._resync_nonce()
+            todo = list(range(len(calls)))
+            for attempt in range(2):
+                gas_price = self._current_gas_price()
+                records, raws, nonces = [], [], []
+                try:
+                    for i in todo:
+                        contract_fn, gas, label = calls[i]
+                        nonces.append(self._allocate_nonce())
+                        tx = self._build(contract_fn, gas, nonces[-1], gas_price)
+                        tx_hash, raw = self._sign(tx)
+                        records.append(self._new_record(tx, tx_hash, label))
+                        raws.append(raw)
+                    if on_signed is not None:
+                        on_signed([(i, self.plan(r)) for i, r in zip(todo, records)])
+                except Exception as e:
+                    # Nothing from this round was sent: hand every nonce back.
+                    for nonce in nonces:
+                        self._release_nonce(nonce)
+                    if attempt == 0:
+                        raise
+                    # The first round's accepted sends still stand.
+                    for i in todo:
+                        results[i] = e
+                    break
+                with ThreadPoolExecutor(max_workers=max(1, min(self.rpc_concurrency, len(raws)))) as pool:
+                    sent = list(pool.map(self._send_raw, raws))
+
+                retry, taken = [], False
+                for i, record, r in zip(todo, records, sent):
+                    if not isinstance(r, Exception) or _accepted(r):
+                        results[i] = record
+                        continue
+                    results[i] = r
+                    retry.append(i)
+                    if _nonce_taken(r):
+                        taken = True
+                    else:
+                        self._release_nonce(record["nonce"])
+                if not retry or attempt == 1:
+                    break
+                if taken:
+                    self._resync_nonce()
+                todo = retry
+        return results
+
+    def plan(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """What a caller needs to resume a transaction after a restart (JSON-serializable)."""
+        return {
+            "txId": record["txId"],
+            "nonce": record["nonce"],
+            "transaction_hash": record["transaction_hash"],
+            "transactionHashes": list(record["transactionHashes"]),
+            "tx": dict(record.get("_tx") or self._unsigned[record["txId"]]),
+        }
+
+    def _register(self, record: Dict[str, Any], webhook_url: Optional[str]) -> Dict[str, Any]:
+        record["webhookUrl"] = webhook_url
+        tx_id = record["txId"]
+        tx = record.pop("_tx")
+        if tx is not None:
+            self._unsigned[tx_id] = tx
+        self._records[tx_id] = record
+        self._events[tx_id] = asyncio.Event()
+        return self.get(tx_id)
+
+    async def submit(self, contract_fn, gas: int, label: str = "", webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        """Signs and broadcasts a contract call without waiting for inclusion. Returns the public record."""
+        record = await asyncio.to_thread(self._send_new, contract_fn, gas, label)
+        return self._register(record, webhook_url)
+
+    async def submit_many(self, calls: List[Tuple[Any, int, str]],
+                          on_signed: Optional[Callable[[List[Tuple[int, Dict[str, Any]]]], None]] = None
+                          ) -> List[Union[Dict[str, Any], Exception]]:
+        """Broadcasts (contract_fn, gas, label) calls on consecutive nonces.
+
+        on_signed(list of (call index, plan())) runs in a worker thread before
+        each round of sends. Returns one entry per call, in order: its public
+        record, or the exception its send raised.
+        """
+        if not calls:
+            return []
+        results = await asyncio.to_thread(self._send_many, calls, on_signed)
+        return [r if isinstance(r, Exception) else self._register(r, None) for r in results]
+
+    def _resume(self, plan: Dict[str, Any], label: str) -> Dict[str, Any]:
+        tx = plan.get("tx")
+        hashes = plan.get("transactionHashes") or [plan["transaction_hash"]]
+        if tx is None:
+            # Recorded without its transaction: it can only be watched, and
+            # the node may still know its nonce.
+            nonce = plan.get("nonce")
+            if nonce is None:
+                try:
+                    nonce = self.w3.eth.get_transaction(hashes[-1])["nonce"]
+                except Exception:
+                    pass
+            record = self._new_record({"nonce": nonce, "gasPrice": None}, hashes[-1], label)
+            record["_tx"] = None
+        else:
+            with self._send_lock:
+                if self._next_nonce is None:
+                    self._resync_nonce()
+                # Keep the allocator off this nonce.
+                nonce = tx["nonce"]
+                if nonce in self._holes:
+                    self._holes.remove(nonce)
+                elif nonce >= self._next_nonce:
+                    self._holes = sorted(set(self._holes) | set(range(self._next_nonce, nonce)))
+                    self._next_nonce = nonce + 1
+                # Signing is deterministic, so this is the last hash sent. If the
+                # node never saw it (a crash between signing and sending) it goes
+                # out now; otherwise the node answers "already known" or "nonce
+                # too low" and the receipt poll sorts it out.
+                tx_hash, raw = self._sign(tx)
+                self._send_raw(raw)
+            record = self._new_record(tx, tx_hash, label)
+        record["transactionHashes"] = list(dict.fromkeys(hashes + [record["transaction_hash"]]))
+        record["bumps"] = len(record["transactionHashes"]) - 1
+        return record
+
+    async def adopt(self, plan: Dict[str, Any], label: str = "", webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        """Tracks a transaction from its plan() after a restart, re-sending it if the node never got it."""
+        hashes = set(plan.get("transactionHashes") or [plan["transaction_hash"]])
+        for record in self._records.values():
+            if hashes & set(record["transactionHashes"]):
+                return self.get(record["txId"])
+        record = await asyncio.to_thread(self._resume, plan, label)
+        return self._register(record, webhook_url)
+
+    def on_resend(self, tx_id: str, fn: Callable[[Dict[str, Any]], None]):
+        """Calls fn(plan()) from a worker thread each time the transaction is re-sent with a higher gas price."""
+        if tx_id in self._records and self._records[tx_id]["status"] == PENDING:
+            self._resend_hooks[tx_id] = fn
+
+    # --- status ---
+    def get(self, tx_id: str) -> Optional[Dict[str, Any]]:
+        record = self._records.get(tx_id)
+        if record is None:
+            return None
+        return {k: v for k, v in record.items() if k != "webhookUrl"}
+
+    async def wait(self, tx_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        event = self._events.get(tx_id)
+        if event is not None:
+            await asyncio.wait_for(event.wait(), timeout)
+        return self.get(tx_id)
+
+    def pending_count(self) -> int:
+        return sum(1 for r in self._records.values() if r["status"] == PENDING)
+
+    def stuck(self) -> List[Dict[str, Any]]:
+        return [self.get(k) for k, r in self._records.items() if r["status"] == STUCK]
+
+    # --- receipt tracking ---
+    def _find_receipt(self, hashes: List[str]):
+        for tx_hash in hashes:
+            try:
+                return self.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _find_receipts(self, hash_lists: List[List[str]]) -> List[Any]:
+        if len(hash_lists) <= 1:
+            return [self._find_receipt(hashes) for hashes in hash_lists]
+        with ThreadPoolExecutor(max_workers=min(self.rpc_concurrency, len(hash_lists))) as pool:
+            return list(pool.map(self._find_receipt, hash_lists))
+
+    def _bump(self, tx_id: str):
+        tx = dict(self._unsigned[tx_id])
+        tx["gasPrice"] = max(int(tx["gasPrice"] * self.bump_factor) + 1, self._current_gas_price())
+        try:
+            tx_hash = self._sign_and_send(tx)
+        except Exception as e:
+            # Usually "nonce too low": one of the earlier hashes was just mined.
+            print(f"⚠ Gas bump for nonce {tx['nonce']} not sent: {e}")
+            return
+        record = self._records[tx_id]
+        self._unsigned[tx_id] = tx
+        record["gasPrice"] = tx["gasPrice"]
+        record["transactionHashes"].append(tx_hash)
+        record["bumps"] += 1
+        record["lastSentAt"] = time.time()
+        hook = self._resend_hooks.get(tx_id)
+        if hook is not None:
+            try:
+                hook(self.plan(record))
+            except Exception as e:
+                print(f"⚠ Recording gas bump for nonce {tx['nonce']} failed: {e}")
+
+    def _finish(self, tx_id: str, status: str, receipt=None, error: Optional[str] = None):
+        record = self._records[tx_id]
+        record["status"] = status
+        record["error"] = error
+        if receipt is not None:
+            record["transaction_hash"] = self.w3.to_hex(receipt["transactionHash"])
+            record["receipt"] = {
+                "blockNumber": receipt["blockNumber"],
+                "gasUsed": receipt["gasUsed"],
+                "status": receipt["status"],
+            }
+        self._unsigned.pop(tx_id, None)
+        self._resend_hooks.pop(tx_id, None)
+        event = self._events.pop(tx_id, None)
+        if event is not None:
+            event.set()
+        if record["webhookUrl"]:
+            asyncio.create_task(self._fire_webhook(record["webhookUrl"], self.get(tx_id)))
+        self._trim()
+
+    def _trim(self):
+        finished = [k for k, r in self._records.items() if r["status"] not in (PENDING, STUCK)]
+        for tx_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._records[tx_id]
+
+    async def _fire_webhook(self, url: str, payload: Dict[str, Any]):
+        try:
+            # No redirects: the URL was vetted, where it redirects to was not.
+            await asyncio.to_thread(requests.post, url, json=payload, timeout=10, allow_redirects=False)
+        except Exception as e:
+            print(f"❌ Tx webhook to {url} failed: {e}")
+
+    async def poll_once(self):
+        pending = [k for k, r in self._records.items() if r["status"] in (PENDING, STUCK)]
+        if not pending:
+            return
+        # Read before the receipts: a nonce below this count with no receipt
+        # for any of its hashes was used by some other transaction.
+        mined_nonces = await asyncio.to_thread(self.w3.eth.get_transaction_count, self.account_address, "latest")
+        receipts = await asyncio.to_thread(
+            self._find_receipts, [list(self._records[k]["transactionHashes"]) for k in pending])
+        for tx_id, receipt in zip(pending, receipts):
+            record = self._records[tx_id]
+            if receipt is not None:
+                self._finish(tx_id, CONFIRMED if receipt["status"] == 1 else FAILED, receipt=receipt)
+            elif record["nonce"] is not None and record["nonce"] < mined_nonces:
+                error = f"nonce {record['nonce']} was mined by another transaction; this one was replaced or dropped"
+                print(f"❌ Tx {record['label'] or tx_id}: {error}")
+                self._finish(tx_id, DROPPED, error=error)
+            elif record["status"] == STUCK:
+                continue
+            elif tx_id in self._unsigned:
+                if time.time() - record["lastSentAt"] <= self.bump_after:
+                    continue
+                if record["bumps"] < self.max_bumps:
+                    await asyncio.to_thread(self._bump, tx_id)
+                else:
+                    self._stick(tx_id)
+            elif time.time() - record["lastSentAt"] > self.bump_after * (self.max_bumps + 1):
+                # Adopted without its transaction, so it can't be re-priced.
+                self._stick(tx_id)
+
+    def _stick(self, tx_id: str):
+        record = self._records[tx_id]
+        error = (f"not mined after {record['bumps']} gas bumps; nonce {record['nonce']} holds back "
+                 f"every later transaction from this account")
+        print(f"❌ Tx {record['label'] or tx_id} stuck: {error}")
+        self._finish(tx_id, STUCK, error=error)
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"❌ Tx receipt poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,172 @@
+# verify_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# ------------------------
+# Cache for /verify and watermark decodes
+# ------------------------
+# Scanners upload the same label photo again and again. Entries are keyed by
+# a SHA-256 of the uploaded bytes plus the decode mode, and live in
+# SQLite: ":memory:" for a single process, or a file (WAL) that every uvicorn
+# worker opens so one worker's decode serves the others.
+#
+# `decoded` holds watermark decode results. They depend on the bytes alone,
+# so they only age out after `decode_ttl`.
+#
+# `verified` holds whole /verify responses. Those depend on chain state, so
+# each carries a tag (the batch for registered products, the product hash for
+# unregistered ones), the block its contract reads were made at, and a TTL
+# the caller picks from the QC status. on_chain_event() (fed by the contract
+# read cache's log poller) deletes entries whose tag an event touched and
+# records the tag in `stale`; a put whose reads predate that block is
+# dropped, so a slow request can't re-insert what an event just evicted.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS decoded (
+    digest TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    result TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (digest, mode)
+);
+CREATE TABLE IF NOT EXISTS verified (
+    digest TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (digest, mode)
+);
+CREATE INDEX IF NOT EXISTS verified_tag ON verified(tag);
+CREATE TABLE IF NOT EXISTS stale (
+    tag TEXT PRIMARY KEY,
+    block INTEGER NOT NULL,
+    at REAL NOT NULL
+);
+"""
+
+def image_digest(image_bytes: bytes) -> str:
+    # Collision resistance matters (a crafted upload must not land on a real
+    # label's entry), and with SHA extensions sha256 outruns blake2b/md5.
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def batch_tag(batch_number: str) -> str:
+    return f"batch:{batch_number}"
+
+def product_tag(product_hash: str) -> str:
+    product_hash = product_hash.strip().lower()
+    if product_hash.startswith("0x"):
+        product_hash = product_hash[2:]
+    return f"product:{product_hash}"
+
+class VerifyCache:
+    def __init__(self, db_path: Optional[str] = None, decode_ttl: float = 86400.0,
+                 max_ttl: float = 3600.0, prune_every: int = 512):
+        self.db_path = db_path or ":memory:"
+        self.decode_ttl = decode_ttl
+        self.max_ttl = max_ttl
+        self.prune_every = prune_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        self.hits = {"decoded": 0, "verified": 0}
+        self.misses = {"decoded": 0, "verified": 0}
+        self.invalidations = 0
+        self.dropped = 0
+
+        db_dir = os.path.dirname(db_path) if db_path else ""
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        if db_path:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # --- reads ---
+    def _get(self, table: str, digest: str, mode: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT result FROM {table} WHERE digest = ? AND mode = ? AND expires_at > ?",
+                (digest, mode, time.time()),
+            ).fetchone()
+        if row is None:
+            self.misses[table] += 1
+            return None
+        self.hits[table] += 1
+        return json.loads(row[0])
+
+    def get_decoded(self, digest: str, mode: str) -> Optional[Dict[str, Any]]:
+        return self._get("decoded", digest, mode)
+
+    def get_verified(self, digest: str, mode: str) -> Optional[Dict[str, Any]]:
+        return self._get("verified", digest, mode)
+
+    # --- writes ---
+    def put_decoded(self, digest: str, mode: str, result: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO decoded (digest, mode, result, expires_at) VALUES (?, ?, ?, ?)",
+                (digest, mode, json.dumps(result), time.time() + self.decode_ttl),
+            )
+        self._after_put()
+
+    def put_verified(self, digest: str, mode: str, result: Dict[str, Any], tag: str, block: int, ttl: float):
+        """Stores a /verify response built from contract reads made at `block`."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR REPLACE INTO verified (digest, mode, tag, block, result, expires_at) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM stale WHERE tag = ? AND block > ?)",
+                (digest, mode, tag, block, json.dumps(result), now + min(ttl, self.max_ttl), tag, block),
+            )
+        if cur.rowcount == 0:
+            self.dropped += 1
+        self._after_put()
+
+    def on_chain_event(self, name: str, args: Dict[str, Any], block: int):
+        """Evicts responses an event may have changed. Shaped as a ContractReadCache listener."""
+        if name == "QCSubmitted":
+            tag = batch_tag(args["batchNumber"])
+        elif name == "ProductAdded":
+            tag = product_tag(args["productHash"])
+        else:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            cur = self._conn.execute("DELETE FROM verified WHERE tag = ? AND block < ?", (tag, block))
+            self._conn.execute(
+                "INSERT INTO stale (tag, block, at) VALUES (?, ?, ?) "
+                "ON CONFLICT(tag) DO UPDATE SET block = MAX(block, excluded.block), at = excluded.at",
+                (tag, block, time.time()),
+            )
+        self.invalidations += cur.rowcount
+
+    def _after_put(self):
+        self._puts += 1
+        if self._puts % self.prune_every:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM decoded WHERE expires_at <= ?", (now,))
+            self._conn.execute("DELETE FROM verified WHERE expires_at <= ?", (now,))
+            # No request is still in flight with reads from before an hour-old event.
+            self._conn.execute("DELETE FROM stale WHERE at <= ?", (now - self.max_ttl,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {t: self._conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("decoded", "verified")}
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "entries": counts,
+            "invalidations": self.invalidations,
+            "droppedStalePuts": self.dropped,
+            "store": self.db_path,
+        }
@@ -0,0 +1,778 @@
+# watermark.py
+import cv2
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, wait
+import pywt
+from reedsolo import RSCodec, ReedSolomonError
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+# --- Robust Watermarking Configuration ---
+ECC_BYTES = 32
+Q = 40.0
+WAVELET = 'haar'
+DWT_LEVEL = 2
+PAYLOAD_BIT_LENGTH = (32 + ECC_BYTES) * 8
+
+# --- Watermark profiles ---
+# A profile fixes the RS parity bytes, the quantization step and the target
+# sub-band (decomposition level + orientation H or V; D at level 1 holds the
+# header). "standard" is the configuration above and is how images without a
+# header are read; the others announce themselves through a header (see
+# "Profile header"). Ids are written into images, so never renumber or reuse
+# one. Listed most robust first (JPEG survival in bench_profiles.py), the
+# order plan_profile tries.
+# msPerMP is embed + self-check decode time per megapixel on one core.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "print":    {"id": 3, "eccBytes": 32, "q": 56.0, "level": 2, "band": "H", "msPerMP": 30.0},
+    "robust":   {"id": 2, "eccBytes": 48, "q": 48.0, "level": 1, "band": "H", "msPerMP": 32.0},
+    "standard": {"id": 0, "eccBytes": ECC_BYTES, "q": Q, "level": 1, "band": "H", "msPerMP": 21.0},
+    "compact":  {"id": 1, "eccBytes": 16, "q": 40.0, "level": 1, "band": "H", "msPerMP": 29.0},
+}
+DEFAULT_PROFILE = "standard"
+PLAN_MIN_TILES = 16     # redundancy plan_profile asks for before it trades robustness for tiles
+
+def get_profile(name: Optional[str]) -> Dict[str, Any]:
+    try:
+        return PROFILES[name or DEFAULT_PROFILE]
+    except KeyError:
+        raise ValueError(f"Unknown watermark profile '{name}'. Choose one of: {', '.join(PROFILES)}.")
+
+def payload_bit_length(profile: Optional[str] = None) -> int:
+    return (32 + get_profile(profile)["eccBytes"]) * 8
+
+# ------------------------
+# QIM engine (vectorized)
+# ------------------------
+# The payload is repeated over the target sub-band (coeffs[-1][0], the
+# horizontal detail band of the finest DWT level, for "standard") in
+# consecutive "tiles" of payload-length coefficients. Each tile row is
+# quantized with whole-array ops; rounding (np.rint, half-to-even) and parity
+# match the original per-coefficient loop so existing images still decode.
+
+def _tile_view(coeffs_flat: np.ndarray, payload_len: int) -> np.ndarray:
+    num_tiles = coeffs_flat.size // payload_len
+    return coeffs_flat[:num_tiles * payload_len].reshape(num_tiles, payload_len)
+
+def qim_embed(coeffs_flat: np.ndarray, payload_bits: np.ndarray, q: float = Q) -> np.ndarray:
+    """Quantizes every full tile of coeffs_flat in place to carry payload_bits."""
+    tiles = _tile_view(coeffs_flat, payload_bits.size)
+    q_idx = np.rint(tiles / q)
+    parity = q_idx.astype(np.int64) & 1
+    bits = payload_bits.astype(np.int64)
+    # bit 0 on an odd index steps down, bit 1 on an even index steps up
+    q_idx += np.where(bits == 0, -parity, 1 - parity)
+    tiles[...] = q_idx * q
+    return coeffs_flat
+
+def qim_extract_votes(coeffs_flat: np.ndarray, payload_len: int, q: float = Q) -> np.ndarray:
+    """Returns the (num_tiles, payload_len) matrix of parity bits read from each tile."""
+    tiles = _tile_view(coeffs_flat, payload_len)
+    return (np.rint(tiles / q).astype(np.int64) & 1).astype(np.uint8)
+
+def majority_vote(votes: np.ndarray) -> np.ndarray:
+    """Column-wise majority; ties go to the first tile like Counter.most_common did."""
+    num_tiles = votes.shape[0]
+    ones = votes.sum(axis=0, dtype=np.int64) * 2
+    bits = (ones > num_tiles).astype(np.uint8)
+    ties = ones == num_tiles
+    bits[ties] = votes[0, ties]
+    return bits
+
+# ------------------------
+# Soft-decision votes
+# ------------------------
+# A coefficient that lands right on a quantizer level is a sure vote; one
+# halfway between two levels is a coin flip. Each coefficient votes +w for
+# parity 1 and -w for parity 0, with w = 1 - 2 * (distance to the nearest
+# level, in steps of Q). A bit's vote sum against its noise level
+# sqrt(sum of w^2) is how many standard deviations it sits from a coin flip.
+# Bytes holding a weak bit go to Reed-Solomon as erasures (at most half the
+# parity bytes), which cost one parity symbol each instead of two for an
+# unknown error, and a band whose bits are all coin flips is rejected
+# without running RS at all.
+
+SOFT_ERASURE_Z = 1.0                # a byte with a bit weaker than this is erased
+SOFT_JUNK_Z = 1.5                   # mean over bits; an unwatermarked band averages ~0.8
+SOFT_MIN_TILES = 8                  # below this the junk test can't tell
+
+def soft_votes(coeffs: np.ndarray, q: float = Q) -> np.ndarray:
+    """Signed soft vote per coefficient, in [-1, 1]."""
+    x = coeffs / q
+    q_idx = np.rint(x)
+    weight = 1.0 - 2.0 * np.abs(x - q_idx)
+    return np.where(q_idx.astype(np.int64) & 1, weight, -weight)
+
+def qim_soft_votes(coeffs_flat: np.ndarray, payload_len: int, q: float = Q) -> np.ndarray:
+    """Soft counterpart of qim_extract_votes: the (num_tiles, payload_len) matrix of signed votes."""
+    return soft_votes(_tile_view(coeffs_flat, payload_len), q)
+
+# ------------------------
+# Target band (Haar fast path)
+# ------------------------
+# For haar, each level-1 coefficient is a signed sum / 2 of its own 2x2 pixel
+# block (cH: top pair - bottom pair), and deeper levels repeat that on the
+# LL band. Embedding needs no full transform or waverec2: a band is read from
+# four strided views per level, and the quantization change is spread back
+# onto the same views. pywt pads an odd last row or column by repeating it.
+# For a sum across it that just drops half of each change. For a difference
+# across it the coefficient is 0 whatever the pixels, so that edge is left
+# alone. Other wavelets go through pywt.
+
+# signs of the (0,1), (1,0) and (1,1) pixels of a block, relative to (0,0)
+_HAAR_SIGNS = {"A": (1, 1, 1), "H": (1, -1, -1), "V": (-1, 1, -1), "D": (-1, -1, 1)}
+_BAND_INDEX = {"H": 0, "V": 1, "D": 2}
+
+def _haar_band(x: np.ndarray, kind: str) -> np.ndarray:
+    h, w = x.shape
+    if (h | w) & 1:
+        x = np.pad(x, ((0, h & 1), (0, w & 1)), mode="edge")
+    sb, sc, sd = _HAAR_SIGNS[kind]
+    pair = np.add if sb > 0 else np.subtract
+    band = pair(x[0::2, 0::2], x[0::2, 1::2], dtype=np.float32)
+    pair = np.add if sc * sd > 0 else np.subtract
+    lower = pair(x[1::2, 0::2], x[1::2, 1::2], dtype=np.float32)
+    if sc > 0:
+        band += lower
+    else:
+        band -= lower
+    band *= 0.5
+    return band
+
+def _haar_spread(out: np.ndarray, delta: np.ndarray, kind: str):
+    """Adds to `out` (in place) the change that moves its `kind` band by delta."""
+    h, w = out.shape
+    sb, sc, sd = _HAAR_SIGNS[kind]
+    delta = delta * 0.5
+    if h & 1 and sc < 0:
+        delta[-1] = 0
+    if w & 1 and sb < 0:
+        delta[:, -1] = 0
+    out[0::2, 0::2] += delta
+    out[0::2, 1::2] += sb * delta[:, :w // 2]
+    out[1::2, 0::2] += sc * delta[:h // 2]
+    out[1::2, 1::2] += sd * delta[:h // 2, :w // 2]
+
+def _band(y: np.ndarray, level: int, kind: str) -> np.ndarray:
+    if WAVELET != "haar":
+        return pywt.wavedec2(y, WAVELET, level=max(DWT_LEVEL, level))[-level][_BAND_INDEX[kind]]
+    for _ in range(level - 1):
+        y = _haar_band(y, "A")
+    return _haar_band(y, kind)
+
+@lru_cache(maxsize=256)
+def band_plan(height: int, width: int, profile: str = DEFAULT_PROFILE) -> Tuple[int, int, int]:
+    """(rows, cols, tiles) of a profile's target band for a height x width luma plane."""
+    p = get_profile(profile)
+    filter_len = pywt.Wavelet(WAVELET).dec_len
+    rows, cols = height, width
+    for _ in range(p["level"]):
+        rows = pywt.dwt_coeff_len(rows, filter_len, "symmetric")
+        cols = pywt.dwt_coeff_len(cols, filter_len, "symmetric")
+    return rows, cols, rows * cols // payload_bit_length(profile)
+
+def embed_capacity(height: int, width: int, profile: str = DEFAULT_PROFILE) -> int:
+    """Target band size in coefficients, without transforming anything."""
+    rows, cols, _ = band_plan(height, width, profile)
+    return rows * cols
+
+def target_band(y: np.ndarray, profile: str = DEFAULT_PROFILE) -> np.ndarray:
+    """A profile's target band of a uint8 luma plane (coeffs[-1][0] of wavedec2 for "standard")."""
+    p = get_profile(profile)
+    return _band(y, p["level"], p["band"])
+
+def _embed_haar(y: np.ndarray, watermark_payload: np.ndarray, p: Dict[str, Any],
+                header: Optional[np.ndarray]) -> np.ndarray:
+    level, kind = p["level"], p["band"]
+    chain = [y]
+    for _ in range(level - 1):
+        chain.append(_haar_band(chain[-1], "A"))
+    band = _haar_band(chain[-1], kind)
+    delta = qim_embed(band.ravel().copy(), watermark_payload, p["q"]).reshape(band.shape)
+    delta -= band
+    out = y.astype(np.float32)
+    for i in reversed(range(level)):
+        dest = out if i == 0 else np.zeros(chain[i].shape, np.float32)
+        _haar_spread(dest, delta, kind if i == level - 1 else "A")
+        delta = dest
+    if header is not None:
+        band = _haar_band(y, HEADER_BAND)
+        delta = qim_embed(band.ravel().copy(), header, HEADER_Q).reshape(band.shape)
+        delta -= band
+        _haar_spread(out, delta, HEADER_BAND)
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+def _embed_pywt(y: np.ndarray, watermark_payload: np.ndarray, p: Dict[str, Any],
+                header: Optional[np.ndarray]) -> np.ndarray:
+    coeffs = pywt.wavedec2(y, WAVELET, level=max(DWT_LEVEL, p["level"]))
+
+    def requantize(level: int, kind: str, bits: np.ndarray, q: float):
+        details = list(coeffs[-level])
+        band = details[_BAND_INDEX[kind]]
+        details[_BAND_INDEX[kind]] = qim_embed(band.flatten(), bits, q).reshape(band.shape)
+        coeffs[-level] = tuple(details)
+
+    requantize(p["level"], p["band"], watermark_payload, p["q"])
+    if header is not None:
+        requantize(1, HEADER_BAND, header, HEADER_Q)
+    watermarked_y = np.clip(pywt.waverec2(coeffs, WAVELET), 0, 255).astype(np.uint8)
+    if watermarked_y.shape != y.shape:
+        watermarked_y = cv2.resize(watermarked_y, (y.shape[1], y.shape[0]))
+    return watermarked_y
+
+# ------------------------
+# Profile header
+# ------------------------
+# Non-default profiles also write 16 header bits (profile id, then its
+# complement) repeated over the level-1 diagonal band, which no profile
+# carries payload in. The bands are orthogonal, so the header leaves the
+# payload alone. "standard" images get no header, so they stay
+# decode-compatible with labels embedded before profiles existed (not
+# pixel-identical: the Haar fast path can differ by 1 in a few pixels).
+# The header only orders the decode attempts (the named profile first, then
+# "standard", then the rest), so it can use a small step: a label whose
+# header did not survive still reads, just a little later.
+
+HEADER_BAND = "D"
+HEADER_Q = 16.0
+HEADER_BITS = 16
+HEADER_MIN_Z = 3.0      # mean per-bit z; junk averages ~0.8 like the payload test
+HEADER_PIXELS = 1 << 18 # luma pixels the decoder reads the header from
+
+def header_bits(profile: str) -> np.ndarray:
+    profile_id = get_profile(profile)["id"]
+    return np.unpackbits(np.array([profile_id, profile_id ^ 0xFF], dtype=np.uint8))
+
+def read_header(y: np.ndarray) -> Optional[str]:
+    """Profile named by a luma plane's header, or None when there is no readable one."""
+    band = _band(y, 1, HEADER_BAND).ravel()
+    if band.size < HEADER_BITS:
+        return None
+    votes = qim_soft_votes(band, HEADER_BITS, HEADER_Q)
+    scores = votes.sum(axis=0)
+    z = np.abs(scores) / np.sqrt(np.maximum((votes ** 2).sum(axis=0), 1e-12))
+    if z.mean() < HEADER_MIN_Z:
+        return None
+    profile_id, check = np.packbits((scores > 0).astype(np.uint8)).tolist()
+    if profile_id ^ 0xFF != check:
+        return None
+    return next((name for name, p in PROFILES.items() if p["id"] == profile_id), None)
+
+def plan_profile(height: int, width: int, time_budget_ms: Optional[float] = None,
+                 min_tiles: int = PLAN_MIN_TILES) -> str:
+    """Most robust profile with at least min_tiles tiles that fits the time budget.
+
+    If none reaches min_tiles, the one with the most tiles (the most
+    redundancy this image can hold) wins.
+    """
+    megapixels = height * width / 1e6
+    fits = [name for name, p in PROFILES.items()
+            if time_budget_ms is None or p["msPerMP"] * megapixels <= time_budget_ms]
+    if not fits:
+        raise ValueError(f"No watermark profile fits a {time_budget_ms:g} ms budget at {height}x{width}.")
+    tiles = {name: band_plan(height, width, name)[2] for name in fits}
+    for name in fits:
+        if tiles[name] >= min_tiles:
+            return name
+    best = max(fits, key=lambda name: tiles[name])
+    if tiles[best] == 0:
+        raise ValueError(f"Image too small for any watermark profile ({height}x{width}).")
+    return best
+
+def resolve_profile(profile: Optional[str], height: int, width: int,
+                    time_budget_ms: Optional[float] = None) -> str:
+    """A profile name as given, or for "auto" the one plan_profile picks for the image."""
+    if profile == "auto":
+        return plan_profile(height, width, time_budget_ms)
+    get_profile(profile)
+    return profile or DEFAULT_PROFILE
+
+# ------------------------
+# Payload + image helpers
+# ------------------------
+def prepare_data(text_to_embed: str, profile: str = DEFAULT_PROFILE) -> np.ndarray:
+    if text_to_embed.startswith('0x'):
+        text_to_embed = text_to_embed[2:]
+
+    if len(text_to_embed) != 64:
+        raise ValueError("dataHash must be 32 bytes (64 hex characters).")
+
+    hash_bytes = bytes.fromhex(text_to_embed)
+    rsc = RSCodec(get_profile(profile)["eccBytes"])
+    encoded_bytes = rsc.encode(hash_bytes)
+    bits = np.unpackbits(np.frombuffer(encoded_bytes, dtype=np.uint8))
+    payload_len = payload_bit_length(profile)
+    if bits.size != payload_len:
+        bits = np.resize(bits, payload_len)
+    return bits.astype(np.uint8)
+
+def embed_watermark(image: np.ndarray, watermark_payload: np.ndarray, profile: str = DEFAULT_PROFILE) -> np.ndarray:
+    if image is None:
+        raise ValueError("Input image for embedding is None")
+    p = get_profile(profile)
+    payload_len = int(watermark_payload.size)
+    if payload_len != payload_bit_length(profile):
+        raise ValueError(f"Payload has {payload_len} bits but profile '{profile}' carries {payload_bit_length(profile)}; "
+                         f"use prepare_data(data_hash, '{profile}').")
+
+    image_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
+    y_channel = image_yuv[..., 0]
+    capacity = embed_capacity(*y_channel.shape, profile)
+    if payload_len > capacity:
+        raise ValueError(f"Watermark ({payload_len} bits) too large for the image's target sub-band ({capacity} coeffs). Use a larger image or a profile with fewer parity bytes.")
+
+    header = None if p["id"] == PROFILES[DEFAULT_PROFILE]["id"] else header_bits(profile)
+    embed = _embed_haar if WAVELET == "haar" else _embed_pywt
+    image_yuv[..., 0] = embed(y_channel, watermark_payload, p, header)
+    return cv2.cvtColor(image_yuv, cv2.COLOR_YUV2BGR)
+
+def _decode_watermark(watermarked_image: np.ndarray, profile: Optional[str] = None) -> Dict[str, Any]:
+    if watermarked_image is None:
+        raise ValueError("Input image for decoding is None.")
+
+    watermarked_yuv = cv2.cvtColor(watermarked_image, cv2.COLOR_BGR2YUV)
+    watermarked_y, _, _ = cv2.split(watermarked_yuv)
+    return decode_watermark_strips(watermarked_y, watermarked_y.size, profile)
+
+def decode_watermark_soft(watermarked_image: np.ndarray, profile: Optional[str] = None) -> Dict[str, Any]:
+    """decode_watermark returning {hash, confidence, erasures, corrected, profile}; see decode_soft_bits."""
+    return _decode_watermark(watermarked_image, profile)
+
+def decode_watermark(watermarked_image: np.ndarray, profile: Optional[str] = None) -> Optional[str]:
+    return _decode_watermark(watermarked_image, profile)["hash"]
+
+def _rs_decode(extracted_bits: np.ndarray, rsc: Optional[RSCodec] = None,
+               erase_pos: Optional[List[int]] = None):
+    """-> (0x hash or None, number of corrected bytes)."""
+    extracted_bytes = np.packbits(extracted_bits).tobytes()
+    rsc = rsc or RSCodec(ECC_BYTES)
+    try:
+        decoded = rsc.decode(extracted_bytes, erase_pos=erase_pos or None)
+        if isinstance(decoded, (tuple, list)):
+            decoded_bytes = bytes(decoded[0])
+            corrected = len(decoded[2]) if len(decoded) > 2 else 0
+        else:
+            decoded_bytes = bytes(decoded)
+            corrected = 0
+        if not any(decoded_bytes):
+            # The all-zero codeword is what a flat, unwatermarked band reads as.
+            return None, 0
+        return "0x" + decoded_bytes.hex(), corrected
+    except ReedSolomonError:
+        return None, 0
+
+def decode_payload_bits(extracted_bits: np.ndarray, rsc: Optional[RSCodec] = None) -> Optional[str]:
+    """Reed-Solomon decodes PAYLOAD_BIT_LENGTH majority bits into a 0x hash, or None."""
+    return _rs_decode(extracted_bits, rsc)[0]
+
+def decode_soft_bits(scores: np.ndarray, squares: np.ndarray, magnitudes: np.ndarray, num_tiles: int,
+                     rsc: Optional[RSCodec] = None, ecc_bytes: int = ECC_BYTES) -> Dict[str, Any]:
+    """Reed-Solomon decode from per-bit soft vote sums, with weak bytes as erasures.
+
+    scores, squares and magnitudes are the per-bit sums of v, v^2 and |v| over
+    the tiles. confidence is the mean |score| / magnitude, from 0 (coin flips)
+    to 1 (every tile agrees, every coefficient on a level).
+    """
+    z = np.abs(scores) / np.sqrt(np.maximum(squares, 1e-12))
+    confidence = float((np.abs(scores) / np.maximum(magnitudes, 1e-12)).mean())
+    result = {"hash": None, "confidence": round(confidence, 3), "erasures": 0, "corrected": 0}
+    if num_tiles >= SOFT_MIN_TILES and z.mean() < SOFT_JUNK_Z:
+        return result
+
+    byte_z = z.reshape(-1, 8).min(axis=1)
+    weak = np.flatnonzero(byte_z < SOFT_ERASURE_Z)
+    erase_pos = sorted(weak[np.argsort(byte_z[weak], kind="stable")][:ecc_bytes // 2].tolist())
+    decoded_hash, corrected = _rs_decode((scores > 0).astype(np.uint8), rsc or RSCodec(ecc_bytes), erase_pos)
+    if decoded_hash is not None:
+        result.update(hash=decoded_hash, erasures=len(erase_pos), corrected=corrected)
+    return result
+
+# ------------------------
+# Strip decode (luma plane only)
+# ------------------------
+# A Haar coefficient at level L only sees its own 2^L x 2^L pixel block, so
+# the luma plane can be transformed a strip of whole blocks at a time and the
+# band rows come out identical to the full wavedec2 (an odd last row gets the
+# same symmetric padding). Votes are summed per payload bit as strips go by,
+# and RS is tried each time the tile count doubles: a clean label stops after
+# its first strip, and memory is one strip's band however large the scan.
+#
+# Profiles are tried one after another: the one the header (read from a
+# HEADER_PIXELS band across the middle) names, then "standard", then the rest.
+
+STRIP_PIXELS = 1 << 20     # luma pixels per strip
+STRIP_FIRST_TILES = 16     # first RS attempt once this many tiles are in
+
+def _decode_profile_strips(luma: np.ndarray, profile: str, strip_pixels: int) -> Dict[str, Any]:
+    p = get_profile(profile)
+    L = payload_bit_length(profile)
+    h, w = luma.shape
+    num_tiles = band_plan(h, w, profile)[2]
+    usable = num_tiles * L
+    block = 1 << p["level"]
+    # Longer filters reach across blocks, so anything but haar gets one strip.
+    rows = max(block, -(-(strip_pixels // w) // block) * block) if WAVELET == "haar" else h
+
+    scores, squares, magnitudes = np.zeros(L), np.zeros(L), np.zeros(L)
+    rsc = RSCodec(p["eccBytes"])
+    read = 0
+    next_try = STRIP_FIRST_TILES * L
+    result: Dict[str, Any] = {}
+    for top in range(0, h, rows):
+        band = _band(luma[top:top + rows], p["level"], p["band"]).ravel()[:usable - read]
+        votes = soft_votes(band, p["q"])
+        # Whole tiles from a tile boundary sum column-wise; anything else by bincount.
+        whole = band.size // L * L if read % L == 0 else 0
+        tiles = votes[:whole].reshape(-1, L)
+        scores += tiles.sum(axis=0)
+        squares += (tiles * tiles).sum(axis=0)
+        magnitudes += np.abs(tiles).sum(axis=0)
+        if whole < band.size:
+            rest = votes[whole:]
+            bit = np.arange(read + whole, read + band.size) % L
+            scores += np.bincount(bit, rest, L)
+            squares += np.bincount(bit, rest * rest, L)
+            magnitudes += np.bincount(bit, np.abs(rest), L)
+        read += band.size
+        if read >= next_try or read >= usable:
+            result = decode_soft_bits(scores, squares, magnitudes, read // L, rsc, p["eccBytes"])
+            if result["hash"] is not None or read >= usable:
+                break
+            next_try = 2 * read
+    result.update(profile=profile if result["hash"] else None,
+                  tilesRead=min(num_tiles, -(-read // L)), tilesTotal=num_tiles)
+    return result
+
+def decode_watermark_strips(luma: np.ndarray, strip_pixels: int = STRIP_PIXELS,
+                            profile: Optional[str] = None) -> Dict[str, Any]:
+    """decode_watermark_soft for a single-channel luma plane, stopping at the first strip that decodes.
+
+    Without a profile every one that fits is tried. Adds profile / tilesRead / tilesTotal.
+    """
+    if luma is None or luma.ndim != 2:
+        raise ValueError("Strip decode needs a single-channel luma image.")
+    h, w = luma.shape
+    names = [name for name in ([profile] if profile else PROFILES) if band_plan(h, w, name)[2]]
+    if not names:
+        raise ValueError("Not enough capacity in the image to extract payload. Use a larger image.")
+    if len(names) > 1:
+        # A band of rows across the middle, where labels have content.
+        rows = max(2, HEADER_PIXELS // w & ~1)
+        top = max(0, (h - rows) // 2) & ~1
+        named = read_header(luma[top:top + rows])
+        names.sort(key=lambda name: (name != named, name != DEFAULT_PROFILE))
+
+    result: Dict[str, Any] = {}
+    for name in names:
+        attempt = _decode_profile_strips(luma, name, strip_pixels)
+        if attempt["hash"] is not None:
+            return attempt
+        result = result or attempt
+    return result
+
+# ------------------------
+# Geometry-resilient decode (opt-in)
+# ------------------------
+# decode_watermark needs the scan pixel-aligned with the embedded image.
+# resilient_decode tries the plain decoder first and only then searches a
+# bounded grid of (scale, rotation) hypotheses, each read at both pixel
+# parities and a range of original band widths (which absorbs crops).
+#
+# With band width Wb, scan coefficient (r, c) carries payload bit
+# (r*Wb + c + K) mod PAYLOAD_BIT_LENGTH, where K depends on the unknown crop.
+# Grouping parities by (r*Wb + c) mod L doesn't need K, so every variant is
+# scored on a strip of the band with a few bincounts: misaligned variants read
+# as noise and are dropped before any Reed-Solomon work. RS only runs for the
+# best-scoring geometries across all hypotheses, once per candidate K, which
+# is a cyclic roll of the majority bits.
+#
+# The finest detail band does not survive downsampling, so the scale grid only
+# holds upscales (camera captures, 1.5x/2x exports); undoing them needs an
+# exact grid hit to within about half a pixel across the image. The search
+# reads the "standard" profile only; other profiles decode on the aligned path.
+
+RESILIENT_SCALES = (1.0, 2.0, 1.5, 1.25, 4.0 / 3.0, 3.0, 1.1)
+RESILIENT_ROTATIONS = (0.0, 90.0, 180.0, 270.0, -0.5, 0.5, -1.0, 1.0)
+RESILIENT_MAX_CROP = 24         # px trimmed from each edge that the search covers
+RESILIENT_SCORE_ROWS = 64       # band rows used to score a variant
+RESILIENT_MIN_CONFIDENCE = 30.0  # z-score; misaligned variants stay well below
+RESILIENT_DECODE_NOW = 300.0    # decoded right away instead of waiting for the whole grid
+RESILIENT_MAX_CANDIDATES = 6    # geometries, across all hypotheses, that get RS attempts
+RESILIENT_MIN_TILES = 8
+
+def _luma(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2YUV)[:, :, 0]
+
+def _undo_geometry(y: np.ndarray, scale: float, angle: float, rows: Optional[tuple] = None,
+                   interpolation: int = cv2.INTER_LANCZOS4) -> np.ndarray:
+    """Rotates a luma plane by -angle degrees about its centre and resamples it by 1/scale.
+
+    With rows=(start, stop), only those output rows are rendered.
+    """
+    quarter = int(round(angle / 90.0))
+    angle -= 90.0 * quarter
+    if quarter % 4:
+        y = np.ascontiguousarray(np.rot90(y, -quarter))
+    h, w = y.shape
+    out_w, out_h = int(round(w / scale)), int(round(h / scale))
+    start, stop = rows or (0, out_h)
+    if scale == 1.0 and angle == 0.0:
+        return y[start:stop].astype(np.float64)
+    m = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), -angle, 1.0 / scale)
+    m[0, 2] += (out_w - w) / 2.0
+    m[1, 2] += (out_h - h) / 2.0 - start
+    warped = cv2.warpAffine(y, m, (out_w, stop - start), flags=interpolation, borderMode=cv2.BORDER_REFLECT)
+    return warped.astype(np.float64)
+
+def _band_parity(y: np.ndarray, py: int, px: int) -> np.ndarray:
+    band = pywt.dwt2(y[py:, px:], WAVELET)[1][0]
+    return (np.rint(band / Q).astype(np.int64) & 1).astype(np.float64)
+
+def _strip_parity(strip: np.ndarray, py: int, px: int) -> np.ndarray:
+    """_band_parity for a scoring strip: the Haar cH band by slicing, minus pywt's padded odd edge."""
+    e = strip[py:, px:]
+    e = e[:e.shape[0] // 2 * 2, :e.shape[1] // 2 * 2]
+    band = ((e[0::2, 0::2] + e[0::2, 1::2]) - (e[1::2, 0::2] + e[1::2, 1::2])) / 2
+    return (np.rint(band / Q).astype(np.int64) & 1).astype(np.float64)
+
+def _bit_votes(parity: np.ndarray, wb: int):
+    """(ones, totals) per payload position, grouping band cells by (r*wb + c) mod L."""
+    L = PAYLOAD_BIT_LENGTH
+    h, w = parity.shape
+    idx = ((np.arange(h, dtype=np.int64)[:, None] * wb + np.arange(w, dtype=np.int64)[None, :]) % L).ravel()
+    return np.bincount(idx, weights=parity.ravel(), minlength=L), np.bincount(idx, minlength=L)
+
+def _bit_votes_for_widths(values: np.ndarray, widths: np.ndarray):
+    """Sums and counts of values per payload position for many band widths -> each (len(widths), L).
+
+    Each row is folded once into a histogram over column mod L; for width wb,
+    row r's histogram is that histogram rotated by r*wb, read through a window
+    view over two copies laid end to end.
+    """
+    L = PAYLOAD_BIT_LENGTH
+    h, w = values.shape
+    flat = (np.arange(h, dtype=np.int64)[:, None] * L + np.arange(w, dtype=np.int64)[None, :] % L).ravel()
+    sums = np.bincount(flat, weights=values.ravel(), minlength=h * L)
+    totals = np.bincount(flat, minlength=h * L).astype(np.float64)
+    hist = np.stack([sums, totals]).reshape(2, h, L)
+    windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([hist, hist], axis=2), L, axis=2)
+    rows = np.arange(h, dtype=np.int64)
+    starts = L - (rows[None, :] * widths[:, None]) % L
+    votes = windows[:, rows[None, :], starts].sum(axis=2)
+    return votes[0], votes[1]
+
+def _vote_confidence(parity: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """How far the parities grouped by payload position are from noise, as a z-score per width.
+
+    Row and column means are removed first: flat areas, text and resampling
+    leave parity patterns tied to the pixel grid that would otherwise score
+    for any grouping. What remains is a chi-square over the L positions. A
+    width that is a multiple of L puts the payload itself in the column
+    means, so that width is scored with row means removed only.
+    """
+    L = PAYLOAD_BIT_LENGTH
+    rows_only = parity - parity.mean(axis=1, keepdims=True)
+    both = rows_only - rows_only.mean(axis=0, keepdims=True)
+    z = np.zeros(len(widths))
+    for residual, mask in ((both, widths % L != 0), (rows_only, widths % L == 0)):
+        variance = residual.var()
+        if not mask.any() or variance <= 0:
+            continue
+        sums, totals = _bit_votes_for_widths(residual, widths[mask])
+        chi2 = (sums ** 2 / np.maximum(totals * variance, 1e-9)).sum(axis=-1)
+        z[mask] = (chi2 - L) / np.sqrt(2 * L)
+    return z
+
+def _score_hypothesis(y: np.ndarray, scale: float, angle: float,
+                      max_crop: int = RESILIENT_MAX_CROP) -> List[Dict[str, Any]]:
+    """Scores every parity/band-width variant of one (scale, angle) on a strip; returns those above the threshold."""
+    quarter_turned = int(round(angle / 90.0)) % 2
+    h, w = y.shape[::-1] if quarter_turned else y.shape
+    out_h, out_w = int(round(h / scale)), int(round(w / scale))
+    if (out_h // 2) * (out_w // 2) // PAYLOAD_BIT_LENGTH < RESILIENT_MIN_TILES:
+        return []
+    top = max(0, out_h // 2 - RESILIENT_SCORE_ROWS) & ~1
+    strip = _undo_geometry(y, scale, angle, rows=(top, min(out_h, top + 2 * RESILIENT_SCORE_ROWS + 2)),
+                           interpolation=cv2.INTER_CUBIC)
+
+    # wb is the band width of the uncropped original, the same for every parity.
+    bw = (out_w + 1) // 2
+    widths = np.arange(bw, bw + max_crop + 1)
+    by_width: Dict[int, List] = {}
+    for py in (0, 1):
+        for px in (0, 1):
+            confidence = _vote_confidence(_strip_parity(strip, py, px), widths)
+            for wb, z in zip(widths, confidence):
+                by_width.setdefault(int(wb), []).append((round(float(z), 1), [py, px]))
+
+    # Neighbouring pixel parities see the same grid through the Haar pairs and
+    # score alike, and the best-scoring one is not always the one that decodes:
+    # a candidate is one geometry, carrying all four parities best first.
+    return [
+        {"scale": scale, "rotation": angle, "bandWidth": wb, "confidence": max(z for z, _ in found),
+         "pixelOffsets": [offset for _, offset in sorted(found, key=lambda f: -f[0])]}
+        for wb, found in by_width.items() if max(z for z, _ in found) >= RESILIENT_MIN_CONFIDENCE
+    ]
+
+def _decode_candidate(y: np.ndarray, candidate: Dict[str, Any],
+                      max_crop: int = RESILIENT_MAX_CROP) -> Dict[str, Any]:
+    """Reads the whole band for one scored geometry and tries RS for each pixel parity and crop shift K."""
+    L = PAYLOAD_BIT_LENGTH
+    wb = candidate["bandWidth"]
+    base = _undo_geometry(y, candidate["scale"], candidate["rotation"])
+    rsc = RSCodec(ECC_BYTES)
+    max_band_crop = max_crop // 2
+    rs_attempts = 0
+    for py, px in candidate["pixelOffsets"]:
+        parity = _band_parity(base, py, px)
+        ones, totals = _bit_votes(parity, wb)
+        bits = (2 * ones > totals).astype(np.uint8)
+        seen = set()
+        for r0 in range(max_band_crop + 1):
+            for c0 in range(min(max_band_crop, wb - parity.shape[1]) + 1):
+                shift = (r0 * wb + c0) % L
+                if shift in seen:
+                    continue
+                seen.add(shift)
+                decoded = decode_payload_bits(np.roll(bits, shift), rsc)
+                if decoded is not None:
+                    return {"hash": decoded, "pixelOffset": [py, px], "shift": shift,
+                            "rsAttempts": rs_attempts + len(seen)}
+        rs_attempts += len(seen)
+    return {"hash": None, "rsAttempts": rs_attempts}
+
+def resilient_decode(image: np.ndarray, executor=None,
+                     scales=RESILIENT_SCALES, rotations=RESILIENT_ROTATIONS) -> Dict[str, Any]:
+    """decode_watermark with a fallback search over scale/rotation/crop hypotheses.
+
+    A variant scoring above RESILIENT_DECODE_NOW is decoded as soon as its
+    hypothesis is scored; otherwise the best RESILIENT_MAX_CANDIDATES are
+    tried once every hypothesis is in. With an executor (a process pool) the
+    work is spread over its workers and the first successful decode cancels
+    the rest.
+    """
+    stats = {"hypothesesTried": 0, "candidates": 0, "rsAttempts": 1}
+    aligned = decode_watermark_soft(image)
+    if aligned["hash"] is not None:
+        return {"hash": aligned["hash"], "confidence": aligned["confidence"], "profile": aligned["profile"],
+                "hypothesis": None, **stats}
+
+    y = _luma(image)
+    hypotheses = [(s, a) for s in scales for a in rotations]
+    scored: List[Dict[str, Any]] = []
+
+    def finish(candidate: Dict[str, Any], result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        stats["rsAttempts"] += result["rsAttempts"]
+        if result["hash"] is None:
+            return None
+        hypothesis = {k: v for k, v in candidate.items() if k != "pixelOffsets"}
+        hypothesis.update(pixelOffset=result["pixelOffset"], shift=result["shift"])
+        return {"hash": result["hash"], "confidence": None, "profile": DEFAULT_PROFILE,
+                "hypothesis": hypothesis, **stats}
+
+    queued = set()
+
+    def take(candidates: List[Dict[str, Any]], strong_only: bool) -> List[Dict[str, Any]]:
+        picked = []
+        for c in sorted(candidates, key=lambda c: -c["confidence"]):
+            if stats["candidates"] >= RESILIENT_MAX_CANDIDATES:
+                break
+            if id(c) in queued or (strong_only and c["confidence"] < RESILIENT_DECODE_NOW):
+                continue
+            queued.add(id(c))
+            stats["candidates"] += 1
+            picked.append(c)
+        return picked
+
+    if executor is None:
+        for s, a in hypotheses:
+            stats["hypothesesTried"] += 1
+            group = _score_hypothesis(y, s, a)
+            scored.extend(group)
+            for candidate in take(group, strong_only=True):
+                found = finish(candidate, _decode_candidate(y, candidate))
+                if found:
+                    return found
+        for candidate in take(scored, strong_only=False):
+            found = finish(candidate, _decode_candidate(y, candidate))
+            if found:
+                return found
+        return {"hash": None, "confidence": aligned["confidence"], "profile": None, "hypothesis": None, **stats}
+
+    scoring = {executor.submit(_score_hypothesis, y, s, a) for s, a in hypotheses}
+    decoding: Dict[Any, Dict[str, Any]] = {}
+    pending = set(scoring)
+    leftovers_queued = False
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut in decoding:
+                    found = finish(decoding[fut], fut.result())
+                    if found:
+                        return found
+                    continue
+                stats["hypothesesTried"] += 1
+                group = fut.result()
+                scored.extend(group)
+                for candidate in take(group, strong_only=True):
+                    f = executor.submit(_decode_candidate, y, candidate)
+                    decoding[f] = candidate
+                    pending.add(f)
+            if not leftovers_queued and stats["hypothesesTried"] == len(hypotheses):
+                leftovers_queued = True
+                for candidate in take(scored, strong_only=False):
+                    f = executor.submit(_decode_candidate, y, candidate)
+                    decoding[f] = candidate
+                    pending.add(f)
+    finally:
+        for fut in list(scoring) + list(decoding):
+            fut.cancel()
+    return {"hash": None, "confidence": aligned["confidence"], "profile": None, "hypothesis": None, **stats}
+
+# ------------------------
+# Worker entry points (run inside process pools)
+# ------------------------
+def normalize_hash(data_hash: str) -> str:
+    data_hash = data_hash.strip().lower()
+    if data_hash.startswith("0x"):
+        data_hash = data_hash[2:]
+    return "0x" + data_hash
+
+def embed_and_verify(data_hash: str, image_bytes: bytes,
+                     fingerprint_fn: Optional[Callable[[np.ndarray], Any]] = None,
+                     profile: Optional[str] = None, time_budget_ms: Optional[float] = None) -> Dict[str, Any]:
+    """prepare_data + embed_watermark + self-check decode for one label image.
+
+    Takes and returns plain bytes so it can be shipped to a worker process.
+    With fingerprint_fn, the result also carries fingerprint_fn(watermarked).
+    profile may be "auto" (see resolve_profile); the one used is returned.
+    """
+    img_cv2 = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img_cv2 is None:
+        raise ValueError("Failed to decode uploaded image.")
+    profile = resolve_profile(profile, *img_cv2.shape[:2], time_budget_ms)
+    payload_bits = prepare_data(data_hash, profile)
+
+    watermarked_img = embed_watermark(img_cv2, payload_bits, profile)
+    ok, png = cv2.imencode(".png", watermarked_img)
+    if not ok:
+        raise ValueError("Failed to encode watermarked image as PNG.")
+
+    try:
+        decoded_hash = decode_watermark(watermarked_img)
+        verification_passed = decoded_hash is not None and decoded_hash.lower() == normalize_hash(data_hash)
+    except Exception:
+        decoded_hash = None
+        verification_passed = False
+
+    result = {
+        "png": png.tobytes(),
+        "profile": profile,
+        "verification_passed": verification_passed,
+        "decoded_hash_from_self_check": decoded_hash,
+    }
+    if fingerprint_fn is not None:
+        result["fingerprint"] = fingerprint_fn(watermarked_img)
+    return result
@@ -19,12 +19,26 @@ export default function QCUploader({ user, onLogout }) {
     setLoading(true);
     setError(null);
     try {
-      const response = await fetch(`${API_BASE_URL}/view_all_qc_submissions`);
-      if (!response.ok) {
-        throw new Error("Network response was not ok");
-      }
-      const data = await response.json();
-      setSubmissions(data.qcSubmissions || []);
+      // The endpoint streams NDJSON pages; the last line of each page
+      // carries the cursor for the next one.
+      const all = [];
+      let cursor = null;
+      do {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await fetch(`${API_BASE_URL}/view_all_qc_submissions${query}`);
+        if (!response.ok) {
+          throw new Error("Network response was not ok");
+        }
+        const lines = (await response.text()).split('\n').filter(Boolean).map((line) => JSON.parse(line));
+        const trailer = lines.pop() || {};
+        const failed = lines.find((line) => line.error);
+        if (failed) {
+          throw new Error(failed.error);
+        }
+        all.push(...lines);
+        cursor = trailer.nextCursor;
+      } while (cursor);
+      setSubmissions(all);
     } catch (err) {
       setError("Failed to fetch QC submissions.");
       console.error(err);